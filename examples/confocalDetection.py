@@ -16,10 +16,12 @@ focalRadius = 0.000250
 pinholeModifier = {1 / 3: [], 1: [], 3: []}
 # list of all relative positions from the ideal focal spot position in nm
 positions = [1000, 800, 500, 300, 150, 100, 50, 25, 0, -25, -50, -100, -150, -300, -500, -800, -1000]
-# Number of total rays produced by the focal spot
-nRays = 100000
+# Number of total rays produced by the focal spot. Quasi-random rays converge much faster than random rays: with
+# 8192 quasi-random rays, all the transmission values below are within 0.001 of those obtained with 4 000 000 random
+# rays, while 100000 random rays (as used before) are only within 0.0035.
+nRays = 8192
 # Production of rays from a focal spot with a radius determined by focalRadius
-inputRays = RandomUniformRays(yMax=focalRadius, yMin=-focalRadius, maxCount=nRays)
+inputRays = QuasiRandomUniformRays(yMax=focalRadius, yMin=-focalRadius, maxCount=nRays)
 # Focal length of the objective
 objFocalLength = 5
 
@@ -54,14 +54,22 @@ import math
 """ General matrices and groups for tracing rays and gaussian beams"""
 from .matrix import *
 from .matrixgroup import *
+from .parallel import *
 
 """ Ray matrices for geometrical optics """
 from .ray import *
+from .rayfile import *
+from .quasirandom import *
 from .rays import *
+from .tracearray import *
+from .detector import *
+from .estimate import *
 from .imagingpath import *
+from .efficiency import *
 
 """ ABCD matrices for gaussian beams """
 from .gaussianbeam import *
+from .gaussianbeams import *
 from .laserpath import *
 from .lasercavity import *
 
@@ -107,6 +107,23 @@ class Axicon(Matrix):
 
         return outputRay
 
+    def traceArraysThrough(self, y, theta, z=0.0, isBlocked=False):
+        """ The same as traceThrough() for many rays at once. The rays are
+        deviated toward the axis exactly as in mul_ray().
+
+        See Also
+        --------
+        raytracing.Matrix.traceArraysThrough
+        raytracing.Axicon.mul_ray
+        """
+        (y, theta, z, isBlocked) = self.asRayArrays(y, theta, z, isBlocked)
+        (outputY, outputTheta, outputZ, outputIsBlocked) = super(Axicon, self).traceArraysThrough(y, theta,
+                                                                                                 z, isBlocked)
+        # theta == 0 is not deviated
+        outputTheta = outputTheta - np.sign(y) * self.deviationAngle()
+
+        return (outputY, outputTheta, outputZ, outputIsBlocked)
+
     def mul_matrix(self, rightSideMatrix):
         """ The final matrix of an optical path with an axicon can be calculated using this function.
 
@@ -0,0 +1,209 @@
+from .rays import *
+
+import numpy as np
+
+
+class Detector:
+    """A detector that accumulates the histograms of the heights, of the
+    angles and of the (height, angle) pairs of the rays it receives, with
+    fixed bins.  The rays are not kept: the rays can be added chunk by
+    chunk (see Matrix.detectManyThrough()) and the memory used does not
+    depend on the number of rays.  Detectors with the same bins, filled
+    by parallel workers for instance, can be merged together.
+
+    Parameters
+    ----------
+    yBinCount : int
+        The number of bins for the heights (default=40)
+    yRange : (float, float)
+        The minimum and maximum heights (default=(-1, 1))
+    thetaBinCount : int
+        The number of bins for the angles (default=40)
+    thetaRange : (float, float)
+        The minimum and maximum angles (default=(-pi/2, pi/2))
+
+    Attributes
+    ----------
+    yHistogram : array
+        The total weight of the rays in each bin of height
+    thetaHistogram : array
+        The total weight of the rays in each bin of angle
+    yThetaHistogram : array
+        The total weight of the rays in each bin of (height, angle), of shape
+        (yBinCount, thetaBinCount)
+    rayCount : int
+        The number of rays received, including those out of range
+    totalWeight : float
+        The total weight of the rays received, including those out of range
+
+    Examples
+    --------
+    >>> from raytracing import *
+    >>> detector = Detector(yBinCount=4, yRange=(-2, 2), thetaBinCount=2, thetaRange=(-1, 1))
+    >>> detector.add(y=[-1.5, 0.5, 0.7, 3], theta=[0.5, -0.5, 0.5, 0])
+    >>> print(detector.yHistogram)
+    [1. 0. 2. 0.]
+    >>> print(detector.rayCount, detector.totalWeight)
+    4 4.0
+
+    Notes
+    -----
+    As with numpy.histogram(), the last bin includes the maximum value.
+    """
+
+    def __init__(self, yBinCount=40, yRange=(-1, 1), thetaBinCount=40, thetaRange=(-np.pi / 2, np.pi / 2)):
+        if yBinCount <= 0 or thetaBinCount <= 0:
+            raise ValueError("The number of bins must be positive.")
+        if yRange[1] <= yRange[0] or thetaRange[1] <= thetaRange[0]:
+            raise ValueError("The ranges must be (minimum, maximum).")
+
+        self.yBinCount = int(yBinCount)
+        self.yRange = (float(yRange[0]), float(yRange[1]))
+        self.thetaBinCount = int(thetaBinCount)
+        self.thetaRange = (float(thetaRange[0]), float(thetaRange[1]))
+        self.clear()
+
+    def clear(self):
+        """ Removes all the rays received. """
+        self.yHistogram = np.zeros(self.yBinCount)
+        self.thetaHistogram = np.zeros(self.thetaBinCount)
+        self.yThetaHistogram = np.zeros((self.yBinCount, self.thetaBinCount))
+        self.rayCount = 0
+        self.totalWeight = 0.0
+
+    @property
+    def yBinEdges(self):
+        """ The edges of the bins of height """
+        return np.linspace(self.yRange[0], self.yRange[1], self.yBinCount + 1)
+
+    @property
+    def thetaBinEdges(self):
+        """ The edges of the bins of angle """
+        return np.linspace(self.thetaRange[0], self.thetaRange[1], self.thetaBinCount + 1)
+
+    @property
+    def yValues(self):
+        """ The centers of the bins of height """
+        edges = self.yBinEdges
+        return (edges[:-1] + edges[1:]) / 2
+
+    @property
+    def thetaValues(self):
+        """ The centers of the bins of angle """
+        edges = self.thetaBinEdges
+        return (edges[:-1] + edges[1:]) / 2
+
+    @staticmethod
+    def binIndices(values, binCount, valueRange):
+        """ The index of the bin of each value, with bins of equal widths,
+        or -1 if the value is out of range. """
+        (minValue, maxValue) = valueRange
+        isInRange = (values >= minValue) & (values <= maxValue)
+        values = values[isInRange]
+
+        indices = np.floor((values - minValue) / (maxValue - minValue) * binCount).astype(int)
+        indices = np.minimum(indices, binCount - 1)
+        # Round-off may put a value in a neighbouring bin: the edges decide,
+        # exactly as with numpy.histogram()
+        edges = np.linspace(minValue, maxValue, binCount + 1)
+        indices[values < edges[indices]] -= 1
+        indices[(values >= edges[indices + 1]) & (indices != binCount - 1)] += 1
+
+        allIndices = np.full(isInRange.shape, -1)
+        allIndices[isInRange] = indices
+        return allIndices
+
+    def add(self, y, theta, weights=None):
+        """ Adds rays to the histograms, given by their heights and angles.
+
+        Parameters
+        ----------
+        y : array of float
+            Heights of the rays
+        theta : array of float
+            Angles of the rays
+        weights : float or array of float
+            Weights of the rays (Optional). Rays without weight have a weight of 1.
+        """
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        theta = np.atleast_1d(np.asarray(theta, dtype=float))
+        if y.shape != theta.shape or y.ndim != 1:
+            raise ValueError("'y' and 'theta' must be one-dimensional and have the same length.")
+        if weights is None:
+            weights = np.ones(len(y))
+        weights = np.broadcast_to(np.asarray(weights, dtype=float), y.shape)
+
+        yIndices = self.binIndices(y, self.yBinCount, self.yRange)
+        thetaIndices = self.binIndices(theta, self.thetaBinCount, self.thetaRange)
+
+        isInRange = yIndices >= 0
+        self.yHistogram += np.bincount(yIndices[isInRange], weights=weights[isInRange], minlength=self.yBinCount)
+        isInRange = thetaIndices >= 0
+        self.thetaHistogram += np.bincount(thetaIndices[isInRange], weights=weights[isInRange],
+                                           minlength=self.thetaBinCount)
+        isInRange = (yIndices >= 0) & (thetaIndices >= 0)
+        indices = yIndices[isInRange] * self.thetaBinCount + thetaIndices[isInRange]
+        self.yThetaHistogram += np.bincount(indices, weights=weights[isInRange],
+                                            minlength=self.yBinCount * self.thetaBinCount).reshape(
+            self.yBinCount, self.thetaBinCount)
+
+        self.rayCount += len(y)
+        self.totalWeight += float(np.sum(weights))
+
+    def addRays(self, rays):
+        """ Adds the rays that are not blocked to the histograms, with
+        their weights.
+
+        Parameters
+        ----------
+        rays : Rays or list of Ray
+            The rays
+        """
+        if not isinstance(rays, Rays):
+            rays = Rays(rays)
+
+        (y, theta, z, isBlocked) = rays.rayArrays()
+        isNotBlocked = ~isBlocked
+        weights = None
+        if rays.isWeighted:
+            weights = rays.weights[isNotBlocked]
+        self.add(y[isNotBlocked], theta[isNotBlocked], weights=weights)
+
+    def hasSameBinsAs(self, other):
+        """ True if the other detector has the same bins """
+        return (self.yBinCount == other.yBinCount and self.yRange == other.yRange
+                and self.thetaBinCount == other.thetaBinCount and self.thetaRange == other.thetaRange)
+
+    def merge(self, other):
+        """ Adds the rays received by another detector with the same bins,
+        for instance from another process.
+
+        Parameters
+        ----------
+        other : Detector
+            The other detector
+
+        Returns
+        -------
+        detector : Detector
+            This detector, to chain merges
+        """
+        if not self.hasSameBinsAs(other):
+            raise ValueError("Only detectors with the same bins can be merged.")
+
+        self.yHistogram += other.yHistogram
+        self.thetaHistogram += other.thetaHistogram
+        self.yThetaHistogram += other.yThetaHistogram
+        self.rayCount += other.rayCount
+        self.totalWeight += other.totalWeight
+        return self
+
+    def rayCountHistogram(self):
+        """ The centers of the bins of height and the histogram, as
+        returned by Rays.rayCountHistogram(). """
+        return (list(self.yValues), list(self.yHistogram))
+
+    def rayAnglesHistogram(self):
+        """ The centers of the bins of angle and the histogram, as
+        returned by Rays.rayAnglesHistogram(). """
+        return (list(self.thetaValues), list(self.thetaHistogram))
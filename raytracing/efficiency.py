@@ -0,0 +1,172 @@
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.patches as patches
+
+
+class EfficiencyReport:
+    """The collection efficiency of an imaging path for a source of rays,
+    obtained with ImagingPath.efficiencyReport().  Each ray of the source is
+    represented by its optical invariants with the principal ray (Irp) and
+    with the axial ray (Iar), relative to the Lagrange invariant (Iap).
+    If one of them is more than 1.0, the ray is expected to be blocked.
+    If both are less than 1.0, the ray should go through unless there is
+    vignetting.
+
+    Nothing is printed or displayed: use printSummary() and display().
+
+    Attributes
+    ----------
+    label : str
+        The label of the imaging path
+    lagrangeInvariant : float
+        The Lagrange invariant of the path (Iap)
+    principalRay : Ray
+        The principal ray of the path
+    axialRay : Ray
+        The axial ray of the path
+    NA : float
+        The object-side numerical aperture of the path
+    fNumber : float
+        The f-number of the path
+    fieldOfView : float
+        The field of view of the path
+    apertureStop : (float, float)
+        The position and diameter of the aperture stop
+    maxHeight : float
+        The half-height of the source
+    maxAngle : float
+        The half-angle of emission of the source
+    Irp : array
+        The optical invariant of each source ray with the principal ray, divided by Iap
+    Iar : array
+        The optical invariant of the axial ray with each source ray, divided by Iap
+    isExpectedBlocked : array of bool
+        True for the rays expected to be blocked (abs(Irp) or abs(Iar) more than 1.0)
+    isVignetted : array of bool
+        True for the rays not expected to be blocked but blocked anyway
+    isTransmitted : array of bool
+        True for the rays not expected to be blocked that go through
+    blockedPositions : array
+        The position where each ray is blocked (or the end of the path if it is not)
+    """
+
+    def __init__(self, label, lagrangeInvariant, principalRay, axialRay, NA, fNumber, fieldOfView, apertureStop,
+                 maxHeight, maxAngle, Irp, Iar, isBlocked, blockedPositions):
+        self.label = label
+        self.lagrangeInvariant = lagrangeInvariant
+        self.principalRay = principalRay
+        self.axialRay = axialRay
+        self.NA = NA
+        self.fNumber = fNumber
+        self.fieldOfView = fieldOfView
+        self.apertureStop = apertureStop
+        self.maxHeight = maxHeight
+        self.maxAngle = maxAngle
+
+        self.Irp = Irp
+        self.Iar = Iar
+        self.isExpectedBlocked = (np.abs(Irp) > 1) | (np.abs(Iar) > 1)
+        self.isVignetted = ~self.isExpectedBlocked & isBlocked
+        self.isTransmitted = ~self.isExpectedBlocked & ~isBlocked
+        self.blockedPositions = blockedPositions
+
+    @property
+    def nRays(self):
+        """ The number of rays from the source """
+        return len(self.Irp)
+
+    @property
+    def sourceInvariant(self):
+        """ The optical invariant of the source, height ⨉ half-angle """
+        return self.maxHeight * self.maxAngle
+
+    @property
+    def expectedBlockedCount(self):
+        """ The number of rays expected to be blocked """
+        return int(np.count_nonzero(self.isExpectedBlocked))
+
+    @property
+    def vignettedCount(self):
+        """ The number of rays lost to vignetting """
+        return int(np.count_nonzero(self.isVignetted))
+
+    @property
+    def transmittedCount(self):
+        """ The number of rays transmitted, among those not expected to be blocked """
+        return int(np.count_nonzero(self.isTransmitted))
+
+    @property
+    def efficiency(self):
+        """ The fraction of the source rays that are transmitted (Monte Carlo) """
+        if self.nRays == 0:
+            return 0.0
+        return self.transmittedCount / self.nRays
+
+    @property
+    def relativeEfficiency(self):
+        """ The fraction of the rays not expected to be blocked that are transmitted """
+        count = self.vignettedCount + self.transmittedCount
+        if count == 0:
+            return 0.0
+        return self.transmittedCount / count
+
+    @property
+    def vignettingPositions(self):
+        """ The positions of the blockers responsible for vignetting """
+        return set(self.blockedPositions[self.isVignetted])
+
+    def printSummary(self):
+        """ Prints the properties of the system and of the source, and
+        the collection efficiency and vignetting. """
+        Iap = self.lagrangeInvariant
+        print("Optical System Properties for {0}".format(self.label))
+        print("---------------------------------------------------")
+        print(" Lagrange invariant: {0:.2f} mm = {1:.2f} mm ⨉ {2:.2f} ≈ 1/2 FOV ⨉ NA".format(Iap, self.principalRay.y,
+                                                                                           self.axialRay.theta))
+        print(" Object-side NA is {0:.2f}, and f/# is {1:.2f} ".format(self.NA, self.fNumber))
+        print(" Field of view is {0:.2f} mm".format(self.fieldOfView))
+        print("\nSource Properties")
+        print("-------------------")
+        print(" Object/source equivalent invariant: {0:.2f} mm = {1:.2f} mm ⨉ {2:.2f} ≈ height ⨉ half-angle".format(
+            self.sourceInvariant, self.maxHeight, self.maxAngle))
+        print("\nEfficiency")
+        print("----------")
+        print(" Collection efficiency from Monte Carlo: {0:.1f}% of ±{2:.2f} radian, over field diameter of {1:.1f} mm".format(
+            100 * self.efficiency, 2 * self.maxHeight, self.maxAngle))
+        print(" Collection efficiency from ratio of system to source invariants: {0:.1f}%".format(
+            Iap / self.sourceInvariant * 100))
+        stopPosition, stopDiameter = self.apertureStop
+        print(" Efficiency limited by {0:.1f} mm diameter of AS at z={1:.1f}".format(stopDiameter, stopPosition))
+        print(" For 100% efficiency, the system would require an increase of {0:.2f}⨉ in detection NA with same FOV".format(
+            self.sourceInvariant / Iap))
+        print("\nVignetting")
+        print("----------")
+        print("Relative efficiency: {0:.1f}% of maximum for this system".format(100 * self.relativeEfficiency))
+        if self.vignettedCount >= 2:
+            print("  Loss to vignetting: {0:.1f}%".format(100 * (1 - self.relativeEfficiency)))
+            print("  Vignetting is due to blockers at positions: {0}".format(self.vignettingPositions))
+        else:
+            print("  No losses to vignetting")
+
+    def display(self):  # pragma: no cover
+        """ Displays each ray from the source as a point (Irp/Iap, Iar/Iap),
+        for the transmitted, vignetted and blocked rays. """
+        fig, axis1 = plt.subplots(1)
+        fig.tight_layout(pad=4.0)
+        axis1.add_patch(patches.Rectangle((-1, -1), 2, 2, color=(0, 1.0, 0, 0.5), lw=3, fill=False,
+                                          transform=axis1.transData, clip_on=True))
+
+        plt.scatter(self.Irp[self.isTransmitted], self.Iar[self.isTransmitted], color=(0, 1, 0), marker='.',
+                    label="Transmitted")
+        if self.vignettedCount >= 2:
+            plt.scatter(self.Irp[self.isVignetted], self.Iar[self.isVignetted], color=(1, 0, 0), marker='.',
+                        label="Vignetted")
+        plt.scatter(self.Irp[self.isExpectedBlocked], self.Iar[self.isExpectedBlocked], color=(0.5, 0.5, 0.5),
+                    marker='.', label="Blocked")
+        axis1.set_xlabel("${I_{rp}}/{I_{ap}}$\n\nFigure: Each point is a ray emitted from the source.")
+        axis1.set_ylabel("${I_{ar}}/{I_{ap}}$")
+        axis1.set_xlim(-2, 2)
+        axis1.set_ylim(-2, 2)
+        axis1.set_aspect('equal')
+        axis1.legend(loc="upper right")
+        plt.show()
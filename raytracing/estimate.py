@@ -0,0 +1,202 @@
+from .detector import *
+
+import numpy as np
+import statistics
+
+
+class TransmissionEstimate:
+    """The fraction of the rays of a source (or of their weights) that go
+    through a path, estimated from the rays traced so far, with its
+    confidence interval.  The sums needed for the interval are updated
+    chunk by chunk with add(), so the estimate can be refined until it is
+    accurate enough: this is what Matrix.estimateTransmission() does.
+
+    For rays without weights, the Wilson score interval of a binomial
+    proportion is used: it remains valid for fractions close to 0 or 1.
+    For weighted rays, the interval is the normal interval of the weighted
+    mean, with its variance estimated from the weights.  Importance-sampled
+    rays (see ImportanceSampledRays) represent a known total weight, the
+    number of rays: their transmission is the transmitted weight divided by
+    this total, whose variance only comes from the transmitted rays.
+
+    If a detector is given, the same intervals are kept for the fraction
+    of the source that reaches each bin of its height histogram.
+
+    Parameters
+    ----------
+    confidence : float
+        The probability that the interval contains the transmission (default=0.95)
+    detector : Detector
+        An empty detector that receives the transmitted rays (Optional)
+
+    Examples
+    --------
+    >>> from raytracing import *
+    >>> estimate = TransmissionEstimate(confidence=0.95)
+    >>> estimate.add(isTransmitted=np.array([True] * 250 + [False] * 750))
+    >>> print("{0:.3f} [{1:.3f}, {2:.3f}]".format(estimate.transmission, *estimate.confidenceInterval))
+    0.250 [0.224, 0.278]
+    """
+
+    def __init__(self, confidence=0.95, detector=None):
+        if not 0 < confidence < 1:
+            raise ValueError("The confidence must be between 0 and 1.")
+        if detector is not None and detector.rayCount != 0:
+            raise ValueError("The detector must be empty.")
+
+        self.confidence = confidence
+        self.detector = detector
+        self.squaredWeightsDetector = None
+        if detector is not None:
+            self.squaredWeightsDetector = Detector(yBinCount=detector.yBinCount, yRange=detector.yRange,
+                                                   thetaBinCount=detector.thetaBinCount,
+                                                   thetaRange=detector.thetaRange)
+
+        self.rayCount = 0
+        self.isWeighted = False
+        self.isNormalized = False
+        self.totalWeight = 0.0
+        self.totalSquaredWeight = 0.0
+        self.transmittedWeight = 0.0
+        self.transmittedSquaredWeight = 0.0
+        self.elapsedTime = 0.0
+        self.stopReason = None
+
+    @property
+    def z(self):
+        """ The number of standard deviations of the two-sided interval """
+        return statistics.NormalDist().inv_cdf((1 + self.confidence) / 2)
+
+    def add(self, isTransmitted, weights=None, y=None, theta=None, totalWeight=None):
+        """ Adds traced rays to the estimate.
+
+        Parameters
+        ----------
+        isTransmitted : array of bool
+            For each ray, True if it went through
+        weights : array of float
+            The weights of the rays (Optional, 1 by default)
+        y, theta : array of float
+            The output heights and angles of the transmitted rays, for the
+            detector (only if there is a detector)
+        totalWeight : float
+            The weight of the source that the rays represent (default=None, the
+            sum of their weights). For importance-sampled rays, it is the
+            number of rays.
+        """
+        isTransmitted = np.asarray(isTransmitted, dtype=bool)
+        if weights is None:
+            weights = np.ones(len(isTransmitted))
+        weights = np.asarray(weights, dtype=float)
+        self.isWeighted = self.isWeighted or bool(np.any(weights != 1))
+
+        transmittedWeights = weights[isTransmitted]
+        if totalWeight is None:
+            totalWeight = np.sum(weights)
+        else:
+            self.isNormalized = True
+
+        self.rayCount += len(isTransmitted)
+        self.totalWeight += float(totalWeight)
+        self.totalSquaredWeight += float(np.sum(weights * weights))
+        self.transmittedWeight += float(np.sum(transmittedWeights))
+        self.transmittedSquaredWeight += float(np.sum(transmittedWeights * transmittedWeights))
+
+        if self.detector is not None:
+            self.detector.add(y, theta, weights=transmittedWeights)
+            self.squaredWeightsDetector.add(y, theta, weights=transmittedWeights * transmittedWeights)
+
+    def intervals(self, weights, squaredWeights):
+        """ The estimates and the bounds of their confidence intervals, for
+        the fractions of the source that have these sums of weights and of
+        squared weights (floats or arrays). """
+        weights = np.asarray(weights, dtype=float)
+        squaredWeights = np.asarray(squaredWeights, dtype=float)
+        if self.rayCount == 0 or self.totalWeight == 0:
+            return (np.zeros_like(weights), np.zeros_like(weights), np.ones_like(weights))
+
+        z = self.z
+        estimate = weights / self.totalWeight
+        if not self.isWeighted:
+            n = self.rayCount
+            center = (estimate + z * z / (2 * n)) / (1 + z * z / n)
+            halfWidth = z * np.sqrt(estimate * (1 - estimate) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+        elif self.isNormalized:
+            # Variance of the mean of w x over the rays, divided by the mean total weight per ray
+            variance = squaredWeights - weights * weights / self.rayCount
+            center = estimate
+            halfWidth = z * np.sqrt(np.maximum(variance, 0)) / self.totalWeight
+        else:
+            # Variance of the ratio sum(w x) / sum(w), with x = 0 or 1 (x * x = x)
+            variance = (squaredWeights * (1 - 2 * estimate) + estimate * estimate * self.totalSquaredWeight)
+            center = estimate
+            halfWidth = z * np.sqrt(np.maximum(variance, 0)) / self.totalWeight
+
+        return (estimate, np.clip(center - halfWidth, 0, 1), np.clip(center + halfWidth, 0, 1))
+
+    @staticmethod
+    def relativeErrors(estimate, low, high):
+        """ The half widths of the intervals relative to the estimates,
+        infinite when the estimate is 0 """
+        halfWidth = (high - low) / 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(estimate > 0, halfWidth / np.where(estimate > 0, estimate, 1), np.inf)
+
+    @property
+    def transmission(self):
+        """ The estimated fraction of the source that goes through """
+        if self.totalWeight == 0:
+            return 0.0
+        return self.transmittedWeight / self.totalWeight
+
+    @property
+    def confidenceInterval(self):
+        """ The (low, high) bounds of the confidence interval of the transmission """
+        (estimate, low, high) = self.intervals(self.transmittedWeight, self.transmittedSquaredWeight)
+        return (float(low), float(high))
+
+    @property
+    def relativeError(self):
+        """ The half width of the confidence interval relative to the
+        transmission, infinite if no ray went through """
+        (estimate, low, high) = self.intervals(self.transmittedWeight, self.transmittedSquaredWeight)
+        return float(self.relativeErrors(estimate, low, high))
+
+    def binConfidenceIntervals(self):
+        """ The fractions of the source in each bin of the height histogram of
+        the detector, and the bounds of their confidence intervals, as three
+        arrays (fraction, low, high). """
+        if self.detector is None:
+            raise ValueError("There is no detector.")
+        return self.intervals(self.detector.yHistogram, self.squaredWeightsDetector.yHistogram)
+
+    def binRelativeErrors(self, binThreshold=0.0):
+        """ The relative errors of the bins of the height histogram that
+        contain at least binThreshold times the content of the largest bin
+        (the other bins are ignored).
+
+        Parameters
+        ----------
+        binThreshold : float
+            The fraction of the largest bin below which bins are ignored (default=0)
+
+        Returns
+        -------
+        relativeErrors : array
+            The relative error of each bin that is considered
+        """
+        (estimate, low, high) = self.binConfidenceIntervals()
+        if len(estimate) == 0 or np.max(estimate) == 0:
+            return np.array([])
+        isConsidered = (estimate > 0) & (estimate >= binThreshold * np.max(estimate))
+        return self.relativeErrors(estimate, low, high)[isConsidered]
+
+    def __str__(self):
+        (low, high) = self.confidenceInterval
+        description = "Transmission: {0:.6g} ({1:.0f}% confidence interval [{2:.6g}, {3:.6g}], " \
+                      "relative error {4:.3g})\n".format(self.transmission, self.confidence * 100, low, high,
+                                                        self.relativeError)
+        description += "Rays traced: {0} in {1:.3g} s".format(self.rayCount, self.elapsedTime)
+        if self.stopReason is not None:
+            description += " (stopped: {0})".format(self.stopReason)
+        return description
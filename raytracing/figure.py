@@ -280,22 +280,22 @@ class Figure:
         colors = self.designParams['rayColors']
 
         linewidth = 0.5
-        manyRayTraces = self.path.traceMany(rays)
+        traces = self.path.traceMany(rays, asArray=True)
+
+        # A ray is drawn until it is blocked, or not at all if required
+        pointCounts = np.where(traces.firstBlockedIndex < 0, traces.nCheckpoints, traces.firstBlockedIndex)
+        if self.designParams['removeBlockedRaysCompletely']:
+            pointCounts[traces.firstBlockedIndex >= 0] = 0
+        isDrawn = pointCounts > 0
 
         maxHeight = 0
-        for rayTrace in manyRayTraces:
-            (x, y) = self.rearrangeRayTraceForPlotting(rayTrace)
-            if len(y) == 0:
-                continue
-            if abs(y[0]) > maxHeight:
-                maxHeight = abs(y[0])
+        if np.any(isDrawn):
+            maxHeight = np.max(np.abs(traces.y[isDrawn, 0]))
 
         lines = []
-        for rayTrace in manyRayTraces:
-            (x, y) = self.rearrangeRayTraceForPlotting(rayTrace)
-
-            if len(y) == 0:
-                continue  # nothing to plot, ray was fully blocked
+        for i in np.flatnonzero(isDrawn):
+            x = list(traces.z[i, :pointCounts[i]])
+            y = list(traces.y[i, :pointCounts[i]])
 
             if maxHeight == 0:  # only axial ray
                 colorIndex = 1
@@ -0,0 +1,226 @@
+from .gaussianbeam import *
+
+import numpy as np
+
+
+class GaussianBeams:
+    """Many gaussian laser beams at once, stored as NumPy arrays of their
+    complex beam parameters q, wavelengths, indices of refraction, positions
+    and clipping status.  They are propagated together with array
+    arithmetic (see Matrix.mul_beams() and Matrix.traceBeams()), which is
+    much faster than one GaussianBeam at a time for wavelength scans, waist
+    position scans or tolerance studies.
+
+    The arrays can have any shape: the beams traced through a path with
+    traceBeams() have the shape (number of beams, number of checkpoints),
+    so that w, R, waist and z give the beam size, the radius of curvature,
+    the waist and the position of every beam after every element.
+
+    Parameters
+    ----------
+    q : complex or array of complex
+        The complex beam parameters (default=None)
+    w : float or array of float
+        The 1/e beam sizes in electric field (default=None)
+    R : float or array of float
+        The radii of curvature (positive means diverging) (default=+Inf)
+    n : float or array of float
+        The indices of refraction in which the beams are (default=1.0)
+    wavelength : float or array of float
+        The wavelengths of the laser beams (default=632.8e-6)
+    z : float or array of float
+        The positions of the beams (default=0)
+
+    Examples
+    --------
+    >>> from raytracing import *
+    >>> beams = GaussianBeams(w=1, wavelength=[400e-6, 800e-6])
+    >>> path = LaserPath([Space(d=100), Lens(f=50), Space(d=50)])
+    >>> traces = path.traceBeams(beams)
+    >>> print(traces.shape)
+    (2, 4)
+    >>> print(traces.z[0])
+    [  0. 100. 100. 150.]
+    >>> print(np.round(traces.w[:, -1], 4))
+    [0.0064 0.0127]
+
+    See Also
+    --------
+    raytracing.GaussianBeam
+    raytracing.Matrix.traceBeams
+
+    Notes
+    -----
+    The beam parameters follow GaussianBeam exactly, except that the waist
+    wo of a beam that is not finite is NaN instead of None.
+    """
+
+    def __init__(self, q=None, w=None, R=float("+Inf"), n=1.0, wavelength=632.8e-6, z=0):
+        relTol = 0.5 / 100
+        if q is None and w is None:
+            raise ValueError("Please specify 'q' or 'w'.")
+
+        if w is not None:
+            w = np.asarray(w, dtype=float)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                computedQ = 1 / (1.0 / np.asarray(R, dtype=float)
+                                 - 1j * np.asarray(wavelength, dtype=float) / n / (np.pi * w * w))
+            if q is not None and not np.all(np.isclose(computedQ, q, rtol=relTol, atol=0)):
+                msg = f"Mismatch between the given q and the computed q ({relTol * 100}% tolerance)."
+                raise ValueError(msg)
+            q = computedQ
+
+        (q, wavelength, n, z) = np.broadcast_arrays(np.asarray(q, dtype=complex),
+                                                    np.asarray(wavelength, dtype=float),
+                                                    np.asarray(n, dtype=float),
+                                                    np.asarray(z, dtype=float))
+        self.q = q.copy()
+        self.wavelength = wavelength.copy()
+        self.n = n.copy()
+        self.z = z.copy()
+        self.isClipped = np.zeros(self.q.shape, dtype=bool)
+
+    @classmethod
+    def fromBeams(cls, beams):
+        """ The beams of a list of GaussianBeam (or a single GaussianBeam),
+        with their positions, indices and clipping status.
+
+        Parameters
+        ----------
+        beams : GaussianBeam or list of GaussianBeam
+            The beams
+        """
+        if isinstance(beams, GaussianBeam):
+            beams = [beams]
+        beams = list(beams)
+
+        newBeams = cls(q=[beam.q for beam in beams], wavelength=[beam.wavelength for beam in beams],
+                       n=[beam.n for beam in beams], z=[beam.z for beam in beams])
+        newBeams.isClipped = np.array([beam.isClipped for beam in beams], dtype=bool)
+        return newBeams
+
+    @classmethod
+    def fromCheckpoints(cls, checkpoints):
+        """ The beams at all the checkpoints of a trace (see
+        Matrix.beamCheckpoints()), stacked along a new last axis.
+
+        Parameters
+        ----------
+        checkpoints : list of GaussianBeams
+            The beams at each checkpoint, all with the same shape
+        """
+        beams = cls.__new__(cls)
+        beams.q = np.stack([checkpoint.q for checkpoint in checkpoints], axis=-1)
+        beams.wavelength = np.stack([checkpoint.wavelength for checkpoint in checkpoints], axis=-1)
+        beams.n = np.stack([checkpoint.n for checkpoint in checkpoints], axis=-1)
+        beams.z = np.stack([checkpoint.z for checkpoint in checkpoints], axis=-1)
+        beams.isClipped = np.stack([checkpoint.isClipped for checkpoint in checkpoints], axis=-1)
+        return beams
+
+    @property
+    def shape(self):
+        """ The shape of the arrays of the beams """
+        return self.q.shape
+
+    def __len__(self):
+        return len(self.q)
+
+    def __getitem__(self, index):
+        """ A single GaussianBeam, or the GaussianBeams of a part of the arrays """
+        q = self.q[index]
+        if np.ndim(q) == 0:
+            beam = GaussianBeam(q=complex(q), wavelength=float(self.wavelength[index]),
+                                n=float(self.n[index]), z=float(self.z[index]))
+            beam.isClipped = bool(self.isClipped[index])
+            return beam
+
+        beams = GaussianBeams.__new__(GaussianBeams)
+        beams.q = q
+        beams.wavelength = self.wavelength[index]
+        beams.n = self.n[index]
+        beams.z = self.z[index]
+        beams.isClipped = self.isClipped[index]
+        return beams
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def R(self):
+        """
+        The radii of curvature (positive means diverging) extracted from q.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            invQReal = (1 / np.where(self.q == 0, 1, self.q)).real
+            isInfinite = (self.q == 0) | (invQReal == 0)
+            return np.where(isInfinite, np.inf, 1 / np.where(isInfinite, 1, invQReal))
+
+    @property
+    def isFinite(self):
+        """
+        True for the beams with a finite size (see GaussianBeam.isFinite).
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (self.q != 0) & ((-1 / np.where(self.q == 0, 1, self.q)).imag > 0)
+
+    @property
+    def w(self):
+        """
+        The 1/e beam sizes in electric field extracted from q.
+        """
+        isFinite = self.isFinite
+        with np.errstate(divide='ignore', invalid='ignore'):
+            qInv = np.where(isFinite, (-1 / np.where(self.q == 0, 1, self.q)).imag, 1)
+            return np.where(isFinite, np.sqrt(self.wavelength / self.n / (np.pi * qInv)), np.inf)
+
+    @property
+    def wo(self):
+        """
+        The 1/e beam sizes in electric field at the waists of the beams
+        (NaN if the beam is not finite).
+        """
+        zo = self.zo
+        return np.where(zo > 0, np.sqrt(np.where(zo > 0, zo, 0) * self.wavelength / np.pi), np.nan)
+
+    @property
+    def waist(self):
+        """
+        The same as the wo.
+        """
+        return self.wo
+
+    @property
+    def waistPosition(self):
+        """The positions of the waists of the beams."""
+        return -self.q.real
+
+    @property
+    def zo(self):
+        """
+        The same as rayleighRange.
+        """
+        return self.q.imag
+
+    @property
+    def confocalParameter(self):
+        """
+        The same as rayleighRange.
+        """
+        return self.zo
+
+    @property
+    def rayleighRange(self):
+        """
+        Returns the rayleigh ranges of the beams.
+        """
+        return self.zo
+
+    def __str__(self):
+        """ String description that allows the use of print(GaussianBeams()) """
+        description = "{0} gaussian beams with shape {1}".format(self.q.size, self.shape)
+        if self.q.size != 0:
+            description += "\nw(z): [{0:.3f}, {1:.3f}], ".format(np.min(self.w), np.max(self.w))
+            description += "z: [{0:.3f}, {1:.3f}], ".format(np.min(self.z), np.max(self.z))
+            description += "clipped: {0}".format(int(np.count_nonzero(self.isClipped)))
+        return description
@@ -1,8 +1,46 @@
 from typing import Any, Union, List
 from .figure import Figure
 from .matrixgroup import *
+from .efficiency import *
+from .detector import *
 from .ray import *
 import numpy as np
+import functools
+
+
+def memoizedAnalysis(method):
+    """ Decorator for the methods of ImagingPath that analyse the path
+    (aperture stop, field stop, chief ray, etc...). When called without
+    arguments, the result is kept until the path changes (see
+    ImagingPath.analysisKey()). Results are numbers, tuples or None, which
+    are returned as they are, or rays, which are copied so that the caller
+    can modify them.
+    """
+
+    @functools.wraps(method)
+    def memoizedMethod(self, *args, **kwargs):
+        if len(args) != 0 or len(kwargs) != 0:
+            return method(self, *args, **kwargs)
+
+        if self.analysisKey() != self._analysisKey:
+            self._analysisKey = self.analysisKey()
+            self._analysis = {}
+
+        name = method.__name__
+        if name not in self._analysis:
+            self._analysis[name] = method(self)
+        return copyOfAnalysis(self._analysis[name])
+
+    return memoizedMethod
+
+
+def copyOfAnalysis(result):
+    """ The result of an analysis, with a copy of the rays it contains """
+    if isinstance(result, Ray):
+        return Ray(result.y, result.theta, result.z, result.isBlocked, result.wavelength, result.apertureDiameter)
+    if isinstance(result, list):
+        return [copyOfAnalysis(value) for value in result]
+    return result
 
 
 class ImagingPath(MatrixGroup):
@@ -32,7 +70,8 @@ class ImagingPath(MatrixGroup):
     fanNumber : int
         This value indicates the number of ray(s) in fan (default=9)
     precision : float
-        The accuracy to be considered when calculating the field stop (default=0.001)
+        The accuracy of the search for the field stop, when it cannot be calculated
+        exactly (see fieldLimit()). (default=0.000001)
     maxHeight : float
         The maximum height to be considered when calculating the field stop (default=10000.0)
     showObject : bool
@@ -84,6 +123,7 @@ class ImagingPath(MatrixGroup):
 
         # Constants when calculating field stop
         self.precision = 0.000001
+        self.maxRoundOffCorrections = 32
         self.maxHeight = 10000.0
 
         # Display properties
@@ -96,8 +136,30 @@ class ImagingPath(MatrixGroup):
         self.showPointsOfInterest = True
         self.showPointsOfInterestLabels = True
         self.showPlanesAcrossPointsOfInterest = True
+
+        # The results of the analysis of the path (see memoizedAnalysis)
+        self._analysisKey = None
+        self._analysis = {}
         super(ImagingPath, self).__init__(elements=elements, label=label)
 
+    def __setstate__(self, state):
+        """ Restores a pickled path. The paths pickled by older versions do
+        not have the results of the analysis, which are then empty. """
+        self.maxRoundOffCorrections = 32
+        self._analysisKey = None
+        self._analysis = {}
+        super(ImagingPath, self).__setstate__(state)
+
+    def analysisKey(self):
+        """ The values that identify the state of the path for its analysis:
+        the version of the path, which changes when the path or one of its
+        elements is modified (see Matrix.invalidate()), and the maximum
+        height and precision for the field stop. The results of the analysis
+        (aperture stop, field stop, chief ray, etc...) are kept until this
+        key changes.
+        """
+        return (self.version, self.maxHeight, self.precision)
+
     @property
     def objectHeight(self):
         """Get or set the object height, at the starting edge of the ImagingPath.
@@ -113,6 +175,7 @@ class ImagingPath(MatrixGroup):
         self._objectHeight = objectHeight
         self.figure.designParams['limitObjectToFieldOfView'] = False
 
+    @memoizedAnalysis
     def chiefRay(self, y=None):
         r"""This function returns the chief ray for a height y at object.
         The chief ray for height y is the ray that goes
@@ -179,6 +242,7 @@ class ImagingPath(MatrixGroup):
 
         return Ray(y=y, theta=-A * y / B)
 
+    @memoizedAnalysis
     def principalRay(self):
         """This function returns the principal ray, which is the chief ray 
         for the height y at the edge of the field of view. The chief ray
@@ -209,6 +273,7 @@ class ImagingPath(MatrixGroup):
         
         return self.chiefRay(y=objectEdge)
 
+    @memoizedAnalysis
     def marginalRays(self, y=0):
         r"""This function calculates the marginal rays for a height y at object.
         The marginal rays for height y are the rays that hit the upper and lower
@@ -290,6 +355,7 @@ class ImagingPath(MatrixGroup):
 
         return [Ray(y=y, theta=thetaUp), Ray(y=y, theta=thetaDown)]
 
+    @memoizedAnalysis
     def axialRay(self):
         """This function returns the axial ray of the system, also known as
         the marginal ray for a point on axis (y=0) at the object.
@@ -309,6 +375,7 @@ class ImagingPath(MatrixGroup):
         rayUp, rayDown = self.marginalRays()
         return rayUp
 
+    @memoizedAnalysis
     def fNumber(self):
         """This function returns the f-number of the component or system
         by dividing the diameter of the entrance pupil by the effective
@@ -342,6 +409,7 @@ class ImagingPath(MatrixGroup):
 
         return focalFront/pupilDiameter
 
+    @memoizedAnalysis
     def NA(self):
         """This function returns the numerical aperture of the component
         or imaging system, which is the sin of the axial ray angle, times 
@@ -371,6 +439,7 @@ class ImagingPath(MatrixGroup):
         axialRay = self.axialRay()
         return self.frontIndex * np.sin(axialRay.theta)
 
+    @memoizedAnalysis
     def apertureStop(self):
         """The "aperture stop" is an aperture in the system that limits
         the cone of angles originating from zero height at the object plane.
@@ -446,6 +515,7 @@ class ImagingPath(MatrixGroup):
 
             return (apertureStopPosition, apertureStopDiameter)
 
+    @memoizedAnalysis
     def entrancePupil(self):
         """The entrance pupil is the image of the aperture stop
         as seen from the object. To obtain this image, we simply
@@ -493,6 +563,7 @@ class ImagingPath(MatrixGroup):
         else:
             return (None, None)
 
+    @memoizedAnalysis
     def fieldStop(self):
         """ The field stop is the aperture that limits the image size (or field of view)
         It is possible to have finite diameter elements but
@@ -539,57 +610,142 @@ class ImagingPath(MatrixGroup):
 
         Notes
         -----
-        Strategy: We want to find the exact height from the object
-        where it is blocked by an aperture (which will become the
-        field stop). We look for the point that separates the
-        "unblocked" ray from the "blocked" ray.
-
-        To do so, we take a ray at various heights starting at y=0
-        from object with a finite increment "dy" and aim 
-        at center of pupil (i.e. chief ray from that height) 
-        until ray is blocked. If it is not blocked, increase
-        dy and increase y by dy. When it is blocked, we turn
-        around and increase by only half the dy, then we continue
-        until it is unblocked, turn around, divide dy by 2, etc...
-        This rapidly converges to the position at which the ray
-        is blocked, which is the field stop half diameter. This
-        strategy is better than linearly going through object heights
-        because the precision can be very high without a long calculation
-        time.
+        Strategy: the chief ray from a height y at the object reaches
+        each aperture at a height proportional to y.  We can therefore
+        calculate, for every aperture, the height at the object above which
+        the chief ray is blocked by it. The aperture with the smallest such
+        height is the field stop (see fieldLimit()).
+
+        """
+        (fieldStopPosition, fieldStopDiameter, halfFieldOfView) = self.fieldLimit()
+        return fieldStopPosition, fieldStopDiameter
+
+    @memoizedAnalysis
+    def fieldLimit(self):
+        """The field stop and the half field of view, calculated together
+        without searching: the chief ray height at every aperture is
+        proportional to the chief ray height y at the object.  If this ratio
+        is r for an aperture of diameter D, the chief ray is blocked by this
+        aperture when abs(r * y) > D/2. The smallest limit D/(2*abs(r)) over
+        all apertures is the half field of view, and the corresponding
+        aperture is the field stop. If the limit is larger than maxHeight,
+        there is no field stop.
+
+        The chief ray at this height is traced to make sure it goes through.
+        If it does not, even after a correction for round off errors (this
+        happens with elements that are not linear, such as Axicon), the
+        field stop is searched for instead (see fieldLimitBySearch()).
 
+        Returns
+        -------
+        fieldLimit : (float, float, float)
+            the position and diameter of the field stop, and the half
+            field of view.  Without a field stop, the position is None
+            and the diameter and half field of view are infinite.
+
+        See Also
+        --------
+        raytracing.ImagingPath.fieldStop
+        raytracing.ImagingPath.halfFieldOfView
         """
+        noFieldStop = (None, float('+Inf'), float('+Inf'))
+
         (apertureStopPosition, dummy) = self.apertureStop()
+        if not self.hasFiniteApertureDiameter() or apertureStopPosition == 0:
+            return noFieldStop
 
-        fieldStopPosition = None
-        fieldStopDiameter = float('+Inf')
-        if self.hasFiniteApertureDiameter() and apertureStopPosition != 0:
-            dy = self.precision * 100
-            y = 0.0
-            wasBlocked = False
-            chiefRayTrace = []
-            while abs(dy) > self.precision or not wasBlocked:
-                chiefRay = self.chiefRay(y=y)
-                chiefRayTrace = self.trace(chiefRay)
-                outputChiefRay = chiefRayTrace[-1]
-
-                if outputChiefRay.isBlocked != wasBlocked:
-                    dy = -dy / 2.0  # Go back, reduce increment
-                else:
-                    dy = dy * 1.5  # Keep going, go faster (different factor)
+        transferMatrixToApertureStop = self.transferMatrix(upTo=apertureStopPosition)
+        if transferMatrixToApertureStop.isImaging:
+            return noFieldStop
+        thetaPerHeight = -transferMatrixToApertureStop.A / transferMatrixToApertureStop.B
+
+        (positions, diameters, heights) = self.heightsAtApertures(y=1.0, theta=thetaPerHeight)
+        limits = np.full(len(heights), float('+Inf'))
+        isNotOnAxis = heights != 0
+        limits[isNotOnAxis] = diameters[isNotOnAxis] / 2 / np.abs(heights[isNotOnAxis])
+        if len(limits) == 0 or np.min(limits) > self.maxHeight:
+            return noFieldStop
+
+        index = np.argmin(limits)  # The first one if there are many
+        halfFieldOfView = limits[index]
+
+        # Because of round off errors, the chief ray at exactly that height
+        # could be blocked: we lower it until it goes through.
+        step = np.finfo(float).eps * halfFieldOfView
+        for i in range(self.maxRoundOffCorrections):
+            if not self.traceThrough(self.chiefRay(y=halfFieldOfView)).isBlocked:
+                return (float(positions[index]), float(diameters[index]), float(halfFieldOfView))
+            halfFieldOfView -= step
+            step *= 2
+
+        # This is not round off: the chief ray is not what the matrices predict
+        return self.fieldLimitBySearch()
+
+    def fieldLimitBySearch(self):
+        """The same as fieldLimit(), but found by tracing chief rays from
+        various heights at the object, until the height where they are
+        blocked is found within `precision`. This is only used when the
+        field stop cannot be calculated from the ABCD matrices.
 
-                y += dy
-                wasBlocked = outputChiefRay.isBlocked
-                if abs(y) > self.maxHeight and not wasBlocked:
-                    return (fieldStopPosition, fieldStopDiameter)
+        Returns
+        -------
+        fieldLimit : (float, float, float)
+            the position and diameter of the field stop, and the half
+            field of view.  Without a field stop, the position is None
+            and the diameter and half field of view are infinite.
 
-            for ray in chiefRayTrace:
-                if ray.isBlocked:
-                    fieldStopPosition = ray.z
-                    fieldStopDiameter = ray.apertureDiameter
-                    break
+        Notes
+        -----
+        Strategy: we take a chief ray at various heights starting at y=0,
+        with a finite increment dy, until the ray is blocked. If it is not
+        blocked, we increase dy and y. When it is blocked, we turn around
+        with half the increment, then continue until it is unblocked, turn
+        around, divide dy by 2, etc... This rapidly converges to the
+        height at which the ray is blocked, and the first aperture that
+        blocks it is the field stop.
+        """
+        noFieldStop = (None, float('+Inf'), float('+Inf'))
 
-        return fieldStopPosition, fieldStopDiameter
+        chiefRayTrace = self.trace(self.chiefRay(y=0))
+        if chiefRayTrace[-1].isBlocked:
+            # Even the chief ray on axis is blocked: there is no field of view
+            return self.firstBlockingAperture(chiefRayTrace) + (0.0,)
+
+        dy = self.precision * 100
+        y = 0.0
+        wasBlocked = False
+        lastUnblockedY = 0.0
+        lastBlockedTrace = None
+        while abs(dy) > self.precision or not wasBlocked:
+            chiefRayTrace = self.trace(self.chiefRay(y=y))
+            isBlocked = chiefRayTrace[-1].isBlocked
+            if isBlocked:
+                lastBlockedTrace = chiefRayTrace
+            else:
+                lastUnblockedY = max(lastUnblockedY, y)
+
+            if isBlocked != wasBlocked:
+                dy = -dy / 2.0  # Go back, reduce increment
+            else:
+                dy = dy * 1.5  # Keep going, go faster (don't use 2.0: could bounce forever)
+
+            y += dy
+            wasBlocked = isBlocked
+            if abs(y) > self.maxHeight and not wasBlocked:
+                return noFieldStop
+
+        return self.firstBlockingAperture(lastBlockedTrace) + (float(lastUnblockedY),)
+
+    @staticmethod
+    def firstBlockingAperture(rayTrace):
+        """ The position and diameter of the aperture that blocked the ray
+        of this ray trace """
+        for ray in rayTrace:
+            if ray.isBlocked:
+                return (float(ray.z), float(ray.apertureDiameter))
+        return (None, float('+Inf'))  # pragma: no cover
 
+    @memoizedAnalysis
     def fieldOfView(self):
         """The field of view is the length visible before the chief
         rays on either side are blocked by the field stop.
@@ -612,20 +768,21 @@ class ImagingPath(MatrixGroup):
         >>> path.append(Lens(f=10,diameter=10,label="f=10"))
         >>> path.append(Space(d=10))
         >>> print('field of view :', path.fieldOfView())
-        field of view : 6.666665124862807
+        field of view : 6.666666666666667
 
         Notes
         -----
-        Strategy: take ray at various heights from object and
-        aim at center of pupil (chief ray from that point)
-        until ray is blocked. It is possible to have finite
-        diameter elements but still an infinite field of view
-        and therefore no Field stop.
+        Strategy: the chief ray height at every aperture is
+        proportional to the height at the object, so the height
+        at which it is blocked is calculated directly (see fieldLimit()).
+        It is possible to have finite diameter elements but still an
+        infinite field of view and therefore no Field stop.
 
         """
 
         return 2*self.halfFieldOfView() 
 
+    @memoizedAnalysis
     def halfFieldOfView(self):
         """The half field of view is the maximum height
         visible before its chief ray is blocked by the field stop.
@@ -649,44 +806,20 @@ class ImagingPath(MatrixGroup):
         >>> path.append(Lens(f=10,diameter=10,label="f=10"))
         >>> path.append(Space(d=10))
         >>> print('field of view :', path.fieldOfView())
-        field of view : 6.666665124862807
+        field of view : 6.666666666666667
 
         Notes
         -----
-        Strategy: take ray at various heights from object and
-        aim at center of pupil (chief ray from that point)
-        until ray is blocked. It is possible to have finite
-        diameter elements but still an infinite field of view
-        and therefore no Field stop.
+        Strategy: the chief ray height at every aperture is
+        proportional to the height at the object, so the height
+        at which it is blocked is calculated directly (see fieldLimit()).
+        It is possible to have finite diameter elements but still an
+        infinite field of view and therefore no Field stop.
 
         """
 
-        (stopPosition, stopDiameter) = self.fieldStop()
-        if stopPosition is None:
-            return float('+Inf')
-
-        transferMatrixToFieldStop = self.transferMatrix(upTo=stopPosition)
-
-        dy = self.precision * 100
-        y = 0.0
-        chiefRay = Ray(y=0, theta=0)
-        wasBlocked = False
-        while abs(dy) > self.precision or wasBlocked:
-            chiefRay = self.chiefRay(y=y)
-            chiefRayTrace = self.trace(chiefRay)
-            outputChiefRay = chiefRayTrace[-1]
-
-            if outputChiefRay.isBlocked != wasBlocked:
-                dy = -dy / 2.0
-            else:
-                dy = dy * 1.5  # Don't use 2.0: could bounce forever
-
-            y += dy
-            wasBlocked = outputChiefRay.isBlocked
-            if abs(y) > self.maxHeight and not wasBlocked:
-                return float("+Inf")
-
-        return chiefRay.y
+        (fieldStopPosition, fieldStopDiameter, halfFieldOfView) = self.fieldLimit()
+        return halfFieldOfView
 
     def imageSize(self):
         """The image size is the object field of view multiplied by magnification.
@@ -708,7 +841,7 @@ class ImagingPath(MatrixGroup):
         >>> path.append(Lens(f=20,diameter=15,label="f=20"))
         >>> path.append(Space(d=20))
         >>> print('size of the image :', path.imageSize())
-        size of the image : 9.999998574656525
+        size of the image : 10.0
 
         """
         fieldOfView = self.fieldOfView()
@@ -719,6 +852,7 @@ class ImagingPath(MatrixGroup):
         magnification = conjugateMatrix.A
         return abs(fieldOfView * magnification)
 
+    @memoizedAnalysis
     def lagrangeInvariant(self):
         """
         The lagrange invariant is the optical invariant calculated
@@ -740,28 +874,298 @@ class ImagingPath(MatrixGroup):
 
         return self.opticalInvariant(ray1, ray2)
 
-    def reportEfficiency(self, objectDiameter=None, emissionHalfAngle=None, nRays=10000): #pragma: no cover
+    def acceptanceConstraints(self):
+        """The constraints that every aperture imposes on the input rays.
+        The height of an input ray (y, theta) at the entrance of an
+        element is a * y + b * theta, and the ray goes through the element
+        if abs(a * y + b * theta) <= D/2, where D is the diameter of the
+        element. The rays that go through the whole path satisfy all these
+        constraints.
+
+        Returns
+        -------
+        (positions, diameters, a, b) : tuple of arrays
+            The positions and diameters of all the elements of finite
+            diameter, and the coefficients a and b for each of them.
+
+        See Also
+        --------
+        raytracing.ImagingPath.acceptancePolygon
         """
-        The collection efficiency of the optical system is computed and a report is printed.
-        By default, it is computed across the field of view, but a specific object diameter 
-        can be provided as welll as an emission half angle.
-        The analysis is based on representing each ray as a linear combination
-        of the principal and axial rays. If the coefficients are more than 1.0, the rays will
-        be blocked.  If they are both less than 1.0, they should propagated unblocked to the 
-        image unless there is vignetting.
+        (positions, diameters, a) = self.heightsAtApertures(y=1.0, theta=0.0)
+        (positions, diameters, b) = self.heightsAtApertures(y=0.0, theta=1.0)
+        return (positions, diameters, a, b)
+
+    def acceptancePolygon(self, yMax=None, yMin=None, thetaMax=np.pi / 2, thetaMin=None):
+        """The region of the input rays (y, theta) that go through the path
+        without being blocked, within a range of heights and angles.
+        Each aperture keeps the rays inside a strip abs(a * y + b * theta) <= D/2
+        (see acceptanceConstraints()), therefore the region is a convex
+        polygon: the intersection of these strips with the range of
+        heights and angles.
+
+        Parameters
+        ----------
+        yMax : float
+            The maximum height of the input rays (default=None, maxHeight)
+        yMin : float
+            The minimum height of the input rays (default=None, -yMax)
+        thetaMax : float
+            The maximum angle of the input rays (default=pi/2)
+        thetaMin : float
+            The minimum angle of the input rays (default=None, -thetaMax)
+
+        Returns
+        -------
+        (vertices, limits) : (array, list)
+            The vertices (y, theta) of the polygon, counterclockwise, in an
+            array of shape (n, 2), and for each edge from vertex i to
+            vertex i+1, the (position, diameter) of the aperture that limits
+            it, or None if the edge is a limit of the range of the input rays.
+            If no ray goes through, there are no vertices.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=10), Aperture(diameter=2)])
+        >>> (vertices, limits) = path.acceptancePolygon(yMax=1, thetaMax=0.1)
+        >>> print(len(vertices))
+        6
+        >>> print([limit for limit in limits if limit is not None])
+        [(10.0, 2.0), (10.0, 2.0)]
+
+        See Also
+        --------
+        raytracing.ImagingPath.collectionEfficiency
+        """
+        if yMax is None:
+            yMax = self.maxHeight
+        if yMin is None:
+            yMin = -yMax
+        if thetaMin is None:
+            thetaMin = -thetaMax
+
+        vertices = [(yMin, thetaMin), (yMax, thetaMin), (yMax, thetaMax), (yMin, thetaMax)]
+        limits = [None, None, None, None]
+        for (position, diameter, a, b) in zip(*self.acceptanceConstraints()):
+            limit = (float(position), float(diameter))
+            (vertices, limits) = self.clipPolygon(vertices, limits, a, b, diameter / 2, limit)
+            (vertices, limits) = self.clipPolygon(vertices, limits, -a, -b, diameter / 2, limit)
+
+        return (np.array(vertices, dtype=float).reshape(-1, 2), limits)
+
+    @staticmethod
+    def clipPolygon(vertices, limits, a, b, c, limit):
+        """ The part of a convex polygon where a * y + b * theta <= c. The
+        edges along the line a * y + b * theta = c get the given limit.
+        See acceptancePolygon() for the description of vertices and limits.
+        """
+        clippedVertices = []
+        clippedLimits = []
+        count = len(vertices)
+        for i in range(count):
+            (y1, theta1) = vertices[i]
+            (y2, theta2) = vertices[(i + 1) % count]
+            excess1 = a * y1 + b * theta1 - c
+            excess2 = a * y2 + b * theta2 - c
+            if excess1 <= 0:
+                clippedVertices.append((y1, theta1))
+                clippedLimits.append(limits[i])
+            if (excess1 <= 0) != (excess2 <= 0):
+                fraction = excess1 / (excess1 - excess2)
+                clippedVertices.append((y1 + fraction * (y2 - y1), theta1 + fraction * (theta2 - theta1)))
+                if excess1 <= 0:
+                    clippedLimits.append(limit)  # From here, we follow the line
+                else:
+                    clippedLimits.append(limits[i])
+
+        # Edges of null length (from vertices exactly on the line) are removed
+        count = len(clippedVertices)
+        keep = [clippedVertices[i] != clippedVertices[(i + 1) % count] for i in range(count)]
+        clippedVertices = [vertex for vertex, isKept in zip(clippedVertices, keep) if isKept]
+        clippedLimits = [edgeLimit for edgeLimit, isKept in zip(clippedLimits, keep) if isKept]
+        if len(clippedVertices) < 3:
+            return ([], [])
+        return (clippedVertices, clippedLimits)
+
+    @staticmethod
+    def polygonIntegral(vertices, isLambertian=False):
+        """ The area of a polygon in (y, theta), or, if isLambertian, the
+        integral of cos(theta) over the polygon. With Green's theorem, both
+        are integrals along the edges that have a closed form.
+        """
+        if len(vertices) == 0:
+            return 0.0
+
+        (y1, theta1) = (vertices[:, 0], vertices[:, 1])
+        (y2, theta2) = (np.roll(y1, -1), np.roll(theta1, -1))
+        if not isLambertian:
+            return float(np.sum((y1 + y2) * (theta2 - theta1)) / 2)
+
+        dTheta = theta2 - theta1
+        slope = np.zeros(len(vertices))
+        isSloped = dTheta != 0
+        slope[isSloped] = (y2[isSloped] - y1[isSloped]) / dTheta[isSloped]
+        integrals = y1 * (np.sin(theta2) - np.sin(theta1)) + slope * (dTheta * np.sin(theta2)
+                                                                     + np.cos(theta2) - np.cos(theta1))
+        return float(np.sum(integrals))
+
+    def collectionEfficiency(self, source):
+        """The fraction of the light from a source that goes through the path,
+        calculated exactly from the acceptance polygon instead of tracing rays.
+        UniformRays and RandomUniformRays are considered uniform sources over
+        their range of heights and angles, and LambertianRays and
+        RandomLambertianRays are considered lambertian sources (intensity
+        proportional to cos(theta)) over their range of heights.  For any
+        other Rays, the fraction of the rays (or of their weights) that go
+        through is returned.
+
+        Parameters
+        ----------
+        source : Rays
+            The source of light at the front of the path
+
+        Returns
+        -------
+        collectionEfficiency : float
+            The fraction of the source that goes through, from 0 to 1.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=10), Aperture(diameter=2)])
+        >>> efficiency = path.collectionEfficiency(UniformRays(yMax=1, thetaMax=0.1))
+        >>> print("{0:.3f}".format(efficiency))
+        0.750
+
+        See Also
+        --------
+        raytracing.ImagingPath.acceptancePolygon
+        """
+        isLambertian = isinstance(source, (LambertianRays, RandomLambertianRays))
+        isUniform = isinstance(source, (UniformRays, RandomUniformRays))
+        if isLambertian or isUniform:
+            (vertices, limits) = self.acceptancePolygon(yMax=source.yMax, yMin=source.yMin,
+                                                        thetaMax=source.thetaMax, thetaMin=source.thetaMin)
+            sourceRange = np.array([(source.yMin, source.thetaMin), (source.yMax, source.thetaMin),
+                                    (source.yMax, source.thetaMax), (source.yMin, source.thetaMax)], dtype=float)
+            total = self.polygonIntegral(sourceRange, isLambertian)
+            if total != 0:
+                return self.polygonIntegral(vertices, isLambertian) / total
+
+        if not isinstance(source, Rays):
+            source = Rays(source)
+        (y, theta, z, isBlocked) = source.rayArrays()
+        isTransmitted = ~isBlocked
+        for (position, diameter, a, b) in zip(*self.acceptanceConstraints()):
+            isTransmitted &= np.abs(a * y + b * theta) <= diameter / 2
+
+        weights = source.weights
+        total = source.totalWeight
+        if total == 0:
+            return 0.0
+        return float(np.sum(weights[isTransmitted]) / total)
+
+    def importanceSampledRays(self, source, defensiveFraction=0.1, pilotCount=None, margin=0.1, maxCount=None,
+                              seed=None):
+        """Random rays of a source drawn preferentially where they go
+        through the path, with the importance weights that keep the
+        transmitted fraction and the histograms unbiased (see
+        ImportanceSampledRays).  By default, the region is the acceptance
+        polygon given by the apertures of the path.  With pilotCount, the
+        region is instead the range of heights and angles of the rays that go
+        through in a pilot run with pilotCount rays of the source, enlarged by
+        the margin.  If the region has no area, the rays are drawn from the
+        source.
+
+        Parameters
+        ----------
+        source : RandomUniformRays or RandomLambertianRays
+            The source of rays at the front of the path
+        defensiveFraction : float
+            The fraction of the rays drawn from the source itself (default=0.1)
+        pilotCount : int
+            The number of rays of the pilot run (default=None, no pilot run)
+        margin : float
+            For a pilot run, the fraction of the range of the transmitted rays
+            added on each side of the region (default=0.1)
+        maxCount : int
+            Number of rays (default=None, the maxCount of the source)
+        seed : int, SeedSequence or Generator
+            The seed of the random numbers (default=None, a new random seed)
+
+        Returns
+        -------
+        rays : ImportanceSampledRays
+            The weighted rays
+
+        See Also
+        --------
+        raytracing.ImportanceSampledRays
+        raytracing.ImagingPath.acceptancePolygon
+        """
+        if pilotCount is None:
+            (region, limits) = self.acceptancePolygon(yMax=source.yMax, yMin=source.yMin,
+                                                      thetaMax=source.thetaMax, thetaMin=source.thetaMin)
+        else:
+            pilotRays = source.chunk(0, pilotCount)
+            (y, theta, z, isBlocked) = self.compile().traceArraysThrough(*pilotRays.rayArrays())
+            (y, theta) = (pilotRays.yValues[~isBlocked], pilotRays.thetaValues[~isBlocked])
+            region = []
+            if len(y) != 0:
+                (yMargin, thetaMargin) = (margin * np.ptp(y), margin * np.ptp(theta))
+                (yMin, yMax) = (max(np.min(y) - yMargin, source.yMin), min(np.max(y) + yMargin, source.yMax))
+                (thetaMin, thetaMax) = (max(np.min(theta) - thetaMargin, source.thetaMin),
+                                        min(np.max(theta) + thetaMargin, source.thetaMax))
+                region = [(yMin, thetaMin), (yMax, thetaMin), (yMax, thetaMax), (yMin, thetaMax)]
+
+        if np.sum(ImportanceSampledRays.triangleAreas(np.array(region, dtype=float).reshape(-1, 2))) == 0:
+            # No ray goes through, or only along a line: there is nothing to favor
+            region = []
+
+        return ImportanceSampledRays(source, region, defensiveFraction=defensiveFraction, maxCount=maxCount,
+                                     seed=seed)
+
+    def efficiencyReport(self, objectDiameter=None, emissionHalfAngle=None, nRays=10000):
+        """
+        The collection efficiency of the optical system, computed with random
+        rays from a uniform source, without printing or displaying anything.
+        By default, it is computed across the field of view, but a specific
+        object diameter can be provided as well as an emission half angle.
+        The optical invariants of all rays with the principal and axial rays
+        are calculated at once, and all rays are traced at once.
 
         Parameters
         ----------
         objectDiameter : float
             The size of the object for the efficiency reference. Default: field of view
+        emissionHalfAngle : float
+            The half angle of emission of the source. Default: pi/2
         nRays : int
             Number of rays simulated to calculate efficiency.  Default: 10000
-        """
-        import matplotlib.patches as p
 
+        Returns
+        -------
+        report : EfficiencyReport
+            The counts of blocked, vignetted and transmitted rays, the
+            vignetting positions and the optical invariants of all rays.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath(System4f(f1=10, f2=10, diameter1=10, diameter2=20))
+        >>> report = path.efficiencyReport(emissionHalfAngle=0.5, nRays=1000)
+        >>> print(report.transmittedCount + report.vignettedCount + report.expectedBlockedCount)
+        1000
+
+        See Also
+        --------
+        raytracing.ImagingPath.reportEfficiency
+        raytracing.ImagingPath.collectionEfficiency
+        """
         principal = self.principalRay()
         axial = self.axialRay()
-        Iap = abs(self.lagrangeInvariant()) # corresponds to Zhe in the article
+        Iap = abs(self.lagrangeInvariant())  # corresponds to Zhe in the article
 
         if emissionHalfAngle is not None:
             maxAngle = emissionHalfAngle
@@ -773,75 +1177,205 @@ class ImagingPath(MatrixGroup):
         else:
             maxHeight = principal.y
 
-        sourceRays = RandomUniformRays(yMax=maxHeight, 
-                                 yMin=-maxHeight,
-                                 thetaMax=maxAngle,
-                                 thetaMin=-maxAngle,
-                                 maxCount=nRays)
-        Is = maxHeight * maxAngle
-
-        expectedBlocked = []
-        notBlocked = []
-        vignettedBlocked = []
-        vignettePositions = []
-        for ray in sourceRays:
-            Irp = self.opticalInvariant(ray, principal)
-            Iar = self.opticalInvariant(axial, ray)
-            outputRay = self.traceThrough(ray)
-
-            if abs(Irp) > Iap or abs(Iar) > Iap:
-                expectedBlocked.append((Irp/Iap, Iar/Iap))
-                continue
-
-            if outputRay.isBlocked:
-                vignettedBlocked.append((Irp/Iap, Iar/Iap))
-                vignettePositions.append(outputRay.z)
-            else:
-                notBlocked.append((Irp/Iap, Iar/Iap))
-
-        print("Optical System Properties for {0}".format(self.label))
-        print("---------------------------------------------------")
-        print(" Lagrange invariant: {0:.2f} mm = {1:.2f} mm ⨉ {2:.2f} ≈ 1/2 FOV ⨉ NA".format(Iap, principal.y, axial.theta))
-        print(" Object-side NA is {0:.2f}, and f/# is {1:.2f} ".format(self.NA(), self.fNumber()))
-        print(" Field of view is {0:.2f} mm".format(self.fieldOfView()))        
-        print("\nSource Properties")
-        print("-------------------")
-        print(" Object/source equivalent invariant: {0:.2f} mm = {1:.2f} mm ⨉ {2:.2f} ≈ height ⨉ half-angle".format(Is, maxHeight, maxAngle))
-        print("\nEfficiency")
-        print("----------")
-        print(" Collection efficiency from Monte Carlo: {0:.1f}% of ±{2:.2f} radian, over field diameter of {1:.1f} mm".format(100*len(notBlocked)/sourceRays.maxCount, 2*maxHeight, maxAngle))
-        print(" Collection efficiency from ratio of system to source invariants: {0:.1f}%".format(Iap/Is*100))
-        stopPosition, stopDiameter = self.apertureStop()
-        print(" Efficiency limited by {0:.1f} mm diameter of AS at z={1:.1f}".format(stopDiameter, stopPosition))
-        print(" For 100% efficiency, the system would require an increase of {0:.2f}⨉ in detection NA with same FOV".format(Is/Iap))
-        print("\nVignetting")
-        print("----------")
-        print("Relative efficiency: {0:.1f}% of maximum for this system".format(100*len(notBlocked)/(len(vignettedBlocked)+len(notBlocked))))
-        if len(vignettedBlocked) >= 2:
-            print("  Loss to vignetting: {0:.1f}%".format(100*len(vignettedBlocked)/(len(vignettedBlocked)+len(notBlocked))))
-            print("  Vignetting is due to blockers at positions: {0}".format(set(vignettePositions)))
-        else:
-            print("  No losses to vignetting")
-
-        fig, axis1 = plt.subplots(1)
-        fig.tight_layout(pad=4.0)
-        axis1.add_patch(p.Rectangle((-1,-1),2, 2, color=(0, 1.0, 0, 0.5), lw=3, fill=False,
-                              transform=axis1.transData, clip_on=True))
-
-        (x,y) = list(zip(*notBlocked))
-        plt.scatter(x,y, color=(0,1,0), marker='.',label="Transmitted")
-        if len(vignettedBlocked) >= 2:
-            (x,y) = list(zip(*vignettedBlocked))
-            plt.scatter(x,y, color=(1,0,0), marker='.',label="Vignetted")
-        (x,y) = list(zip(*expectedBlocked))
-        plt.scatter(x,y, color=(0.5,0.5,0.5), marker='.',label="Blocked")
-        axis1.set_xlabel("${I_{rp}}/{I_{ap}}$\n\nFigure: Each point is a ray emitted from the source.")
-        axis1.set_ylabel("${I_{ar}}/{I_{ap}}$")
-        axis1.set_xlim(-2,2)
-        axis1.set_ylim(-2,2)
-        axis1.set_aspect('equal')
-        axis1.legend(loc="upper right")
-        plt.show()
+        sourceRays = RandomUniformRays(yMax=maxHeight,
+                                       yMin=-maxHeight,
+                                       thetaMax=maxAngle,
+                                       thetaMin=-maxAngle,
+                                       maxCount=nRays)
+
+        # Same as opticalInvariant(ray, principal) and opticalInvariant(axial, ray), for all rays
+        (y, theta, z, isBlocked) = sourceRays.rayArrays()
+        matrix = self.transferMatrix(upTo=0)
+        (yRay, thetaRay) = (matrix.A * y + matrix.B * theta, matrix.C * y + matrix.D * theta)
+        (yPrincipal, thetaPrincipal) = (matrix.A * principal.y + matrix.B * principal.theta,
+                                        matrix.C * principal.y + matrix.D * principal.theta)
+        (yAxial, thetaAxial) = (matrix.A * axial.y + matrix.B * axial.theta,
+                                matrix.C * axial.y + matrix.D * axial.theta)
+        Irp = matrix.backIndex * (thetaRay * yPrincipal - yRay * thetaPrincipal)
+        Iar = matrix.backIndex * (thetaAxial * yRay - yAxial * thetaRay)
+
+        (yOut, thetaOut, zOut, isBlockedOut) = self.traceRayArraysThrough(sourceRays, progress=False)
+
+        return EfficiencyReport(label=self.label, lagrangeInvariant=Iap, principalRay=principal, axialRay=axial,
+                                NA=self.NA(), fNumber=self.fNumber(), fieldOfView=self.fieldOfView(),
+                                apertureStop=self.apertureStop(), maxHeight=maxHeight, maxAngle=maxAngle,
+                                Irp=Irp / Iap, Iar=Iar / Iap, isBlocked=isBlockedOut, blockedPositions=zOut)
+
+    def reportEfficiency(self, objectDiameter=None, emissionHalfAngle=None, nRays=10000): #pragma: no cover
+        """
+        The collection efficiency of the optical system is computed and a report is printed.
+        By default, it is computed across the field of view, but a specific object diameter 
+        can be provided as welll as an emission half angle.
+        The analysis is based on representing each ray as a linear combination
+        of the principal and axial rays. If the coefficients are more than 1.0, the rays will
+        be blocked.  If they are both less than 1.0, they should propagated unblocked to the 
+        image unless there is vignetting.
+
+        Parameters
+        ----------
+        objectDiameter : float
+            The size of the object for the efficiency reference. Default: field of view
+        nRays : int
+            Number of rays simulated to calculate efficiency.  Default: 10000
+
+        See Also
+        --------
+        raytracing.ImagingPath.efficiencyReport
+        """
+        report = self.efficiencyReport(objectDiameter=objectDiameter, emissionHalfAngle=emissionHalfAngle,
+                                       nRays=nRays)
+        report.printSummary()
+        report.display()
+
+    def rayDensityMap(self, inputRays, zBinCount=200, yBinCount=200, zRange=None, yRange=None, chunkSize=10000):
+        """
+        The density of rays along the path, as a 2D histogram over a grid
+        of positions z and heights y.  The rays are traced in chunks, and
+        the segments of the ray traces between checkpoints are rasterized
+        for all rays at once: in each column z, each ray contributes its
+        weight once to every bin of heights that its segments cross, until
+        it is blocked.
+
+        Parameters
+        ----------
+        inputRays : Rays or list of Ray
+            The rays to trace. Their weights are used if they have any.
+        zBinCount : int
+            The number of bins in z (default=200)
+        yBinCount : int
+            The number of bins in y (default=200)
+        zRange : (float, float)
+            The minimum and maximum positions (default=(0, L), the whole path)
+        yRange : (float, float)
+            The minimum and maximum heights (default: symmetric, from the
+            largest height of all the rays, which are then traced twice)
+        chunkSize : int
+            The number of rays traced at once (default=10000)
+
+        Returns
+        -------
+        (zValues, yValues, density) : tuple of arrays
+            The centers of the bins in z and in y, and the total weight of
+            the rays in each bin, an array of shape (zBinCount, yBinCount).
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10)])
+        >>> rays = UniformRays(yMax=2, thetaMax=0, M=5, N=1)
+        >>> (zValues, yValues, density) = path.rayDensityMap(rays, zBinCount=4, yBinCount=4, yRange=(-2, 2))
+        >>> print(zValues)
+        [ 2.5  7.5 12.5 17.5]
+        >>> print(density)
+        [[1. 1. 1. 2.]
+         [1. 1. 1. 2.]
+         [1. 2. 2. 2.]
+         [0. 2. 5. 1.]]
+
+        See Also
+        --------
+        raytracing.ImagingPath.columnSpans
+        raytracing.Detector
+        """
+        if not isinstance(inputRays, Rays):
+            inputRays = Rays(inputRays)
+
+        if zRange is None:
+            zRange = (0, self.L)
+        if zRange[1] <= zRange[0]:
+            raise ValueError("The range in z must be (minimum, maximum).")
+
+        zBinEdges = np.linspace(zRange[0], zRange[1], zBinCount + 1)
+        zValues = (zBinEdges[:-1] + zBinEdges[1:]) / 2
+
+        (y, theta, z, isBlocked) = inputRays.rayArrays()
+        weights = inputRays.weights
+        chunks = [(start, start + chunkSize) for start in range(0, len(y), chunkSize)]
+
+        if yRange is None:
+            yMax = 0
+            for (start, stop) in chunks:
+                (yLow, yHigh) = self.columnSpans(y[start:stop], theta[start:stop], z[start:stop],
+                                                 isBlocked[start:stop], zBinEdges)
+                isCrossed = yLow <= yHigh
+                if np.any(isCrossed):
+                    yMax = max(yMax, np.max(np.abs(yLow[isCrossed])), np.max(np.abs(yHigh[isCrossed])))
+            if yMax == 0:
+                yMax = 1
+            yRange = (-yMax, yMax)
+
+        density = np.zeros((zBinCount, yBinCount))
+        for (start, stop) in chunks:
+            (yLow, yHigh) = self.columnSpans(y[start:stop], theta[start:stop], z[start:stop],
+                                             isBlocked[start:stop], zBinEdges)
+
+            # Every bin from the lowest to the highest height of a ray in a
+            # column gets its weight: +weight at the first bin and -weight
+            # after the last one, summed along y.
+            isCounted = (yLow <= yHigh) & (yHigh >= yRange[0]) & (yLow <= yRange[1])
+            first = Detector.binIndices(np.maximum(yLow[isCounted], yRange[0]), yBinCount, yRange)
+            last = Detector.binIndices(np.minimum(yHigh[isCounted], yRange[1]), yBinCount, yRange)
+            columns = np.broadcast_to(np.arange(zBinCount), yLow.shape)[isCounted]
+            columnWeights = np.broadcast_to(weights[start:stop, np.newaxis], yLow.shape)[isCounted]
+            changes = np.bincount(columns * (yBinCount + 1) + first, weights=columnWeights,
+                                  minlength=zBinCount * (yBinCount + 1))
+            changes -= np.bincount(columns * (yBinCount + 1) + last + 1, weights=columnWeights,
+                                   minlength=zBinCount * (yBinCount + 1))
+            density += np.cumsum(changes.reshape(zBinCount, yBinCount + 1), axis=1)[:, :-1]
+
+        yBinEdges = np.linspace(yRange[0], yRange[1], yBinCount + 1)
+        yValues = (yBinEdges[:-1] + yBinEdges[1:]) / 2
+        return (zValues, yValues, density)
+
+    def columnSpans(self, y, theta, z, isBlocked, zBinEdges):
+        """
+        The lowest and highest heights of each ray in each column between
+        the positions zBinEdges, as used by rayDensityMap().  A ray trace is
+        a straight line between checkpoints, so the heights are those at
+        the edges of the column and at the checkpoints inside it, for the
+        part of the column that the ray reaches before it is blocked.
+
+        Parameters
+        ----------
+        y, theta, z, isBlocked : arrays
+            The input rays, as given by Rays.rayArrays()
+        zBinEdges : array of float
+            The edges of the columns, in increasing order
+
+        Returns
+        -------
+        (yLow, yHigh) : tuple of arrays
+            The lowest and highest heights, arrays of shape (number of rays,
+            number of columns). If a ray does not reach a column, yLow is
+            +inf and yHigh is -inf.
+        """
+        traces = TraceArray(self.traceArrays(y, theta, z, isBlocked))
+        columnCount = len(zBinEdges) - 1
+        yLow = np.full((traces.nRays, columnCount), np.inf)
+        yHigh = np.full((traces.nRays, columnCount), -np.inf)
+
+        # The heights at the edges of the columns (the same as Ray.along())
+        (yEdges, thetaEdges, zEdges, isBlockedEdges) = traces.sampleAt(zBinEdges)
+        for (yEdge, isReached) in [(yEdges[:, :-1], ~isBlockedEdges[:, :-1]), (yEdges[:, 1:], ~isBlockedEdges[:, 1:])]:
+            yLow = np.where(isReached, np.minimum(yLow, yEdge), yLow)
+            yHigh = np.where(isReached, np.maximum(yHigh, yEdge), yHigh)
+
+        # The checkpoints: a blocked checkpoint is still reached at the end
+        # of the segment that comes from a ray that is not blocked, but it
+        # does not go into the next column.
+        isNotBlocked = ~traces.isBlocked
+        isReachedAtEnd = isNotBlocked.copy()
+        isReachedAtEnd[:, 1:] |= isNotBlocked[:, :-1]
+        rows = np.broadcast_to(np.arange(traces.nRays)[:, np.newaxis], traces.z.shape)
+        with np.errstate(invalid='ignore'):
+            positions = (traces.z - zBinEdges[0]) / (zBinEdges[-1] - zBinEdges[0]) * columnCount
+        for (columns, isReached) in [(np.floor(positions), isNotBlocked), (np.ceil(positions) - 1, isReachedAtEnd)]:
+            isInside = isReached & (columns >= 0) & (columns < columnCount)
+            index = (rows[isInside], columns[isInside].astype(int))
+            np.minimum.at(yLow, index, traces.y[isInside])
+            np.maximum.at(yHigh, index, traces.y[isInside])
+
+        return (yLow, yHigh)
 
     def display(self, rays=None, raysList=None, removeBlocked=True, comments=None,
                 onlyPrincipalAndAxialRays=None, limitObjectToFieldOfView=None, filePath=None):
@@ -1,13 +1,20 @@
 from .ray import *
 from .gaussianbeam import *
+from .gaussianbeams import *
 from .rays import *
 from .interface import *
+from .parallel import *
+from .tracearray import *
+from .estimate import *
 
 from typing import List
+import numpy as np
 import multiprocessing
 import sys
 import math
+import time
 import warnings
+import weakref
 
 
 def warningLineFormat(message, category, filename, lineno, line=None):
@@ -99,6 +106,9 @@ class Matrix(object):
 
     __epsilon__ = 1e-5  # Anything smaller is zero
 
+    # Weak references to the groups that contain the element (see invalidate())
+    _groupReferences = ()
+
     def __init__(
             self,
             A: float = 1,
@@ -142,6 +152,43 @@ class Matrix(object):
             raise ValueError("The matrix has inconsistent values: \
                 determinant is incorrect considering front and back indices.")
 
+    def __getstate__(self):
+        """ The attributes of the element, to pickle or copy it, without the
+        references to the groups that contain it (see invalidate()). """
+        state = self.__dict__.copy()
+        state.pop('_groupReferences', None)
+        return state
+
+    def invalidate(self):
+        """ Tells the groups that contain this element that it was modified
+        in place (for instance, after `lens.C = -0.2`). A MatrixGroup keeps
+        the products of its elements (see MatrixGroup.transferMatrix()) and
+        the analysis of an ImagingPath is kept until the path changes: they
+        are only computed again after this call.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> lens = Lens(f=10)
+        >>> path = MatrixGroup([Space(d=10), lens, Space(d=10)])
+        >>> lens.C = -0.2
+        >>> lens.invalidate()
+        >>> print(path.C)
+        -0.2
+        """
+        for reference in self._groupReferences:
+            group = reference()
+            if group is not None:
+                group.elementModified(self)
+
+    def addGroupReference(self, group):
+        """ Remembers that the element is in `group`, to tell it when the
+        element is modified (see invalidate()). """
+        if any(reference() is group for reference in self._groupReferences):
+            return
+        self._groupReferences = [reference for reference in self._groupReferences if reference() is not None]
+        self._groupReferences.append(weakref.ref(group))
+
     @property
     def isIdentity(self):
         return self.A == 1 and self.D == 1 and self.B == 0 and self.C == 0
@@ -348,21 +395,26 @@ class Matrix(object):
         as "isBlocked = True" but the propagation can still be calculated.
         """
 
-        outputRay = Ray()
+        if rightSideRay.isBlocked:
+            return rightSideRay
 
-        if rightSideRay.isNotBlocked:
-            outputRay.y = self.A * rightSideRay.y + self.B * rightSideRay.theta
-            outputRay.theta = self.C * rightSideRay.y + self.D * rightSideRay.theta
-            outputRay.z = self.L + rightSideRay.z
-            outputRay.apertureDiameter = self.apertureDiameter
-
-            if abs(rightSideRay.y) > abs(self.apertureDiameter / 2.0):
-                outputRay.isBlocked = True
-            else:
-                outputRay.isBlocked = rightSideRay.isBlocked
-        else:
-            outputRay = rightSideRay
+        return self.propagatedRay(rightSideRay)
 
+    def propagatedRay(self, ray):
+        """ The ray after the matrix, for a ray that is not blocked. The
+        output ray is created without Ray.__init__(): its attributes are
+        set once, directly with their final values.
+        """
+        y = ray.y
+        theta = ray.theta
+        apertureDiameter = self.apertureDiameter
+        outputRay = Ray.__new__(Ray)
+        outputRay.y = self.A * y + self.B * theta
+        outputRay.theta = self.C * y + self.D * theta
+        outputRay.z = self.L + ray.z
+        outputRay.isBlocked = abs(y) > abs(apertureDiameter / 2.0)
+        outputRay.apertureDiameter = apertureDiameter
+        outputRay.wavelength = None
         return outputRay
 
     def mul_beam(self, rightSideBeam):
@@ -417,6 +469,58 @@ class Matrix(object):
 
         return outputBeam
 
+    def mul_beams(self, rightSideBeams):
+        """The same as mul_beam(), but for many beams at once: the complex
+        radii q of all the beams are transformed together with NumPy.
+
+        Parameters
+        ----------
+        rightSideBeams : GaussianBeams
+            The beams
+
+        Returns
+        -------
+        outputBeams : GaussianBeams
+            The beams at the output of the system with the defined ABCD matrix
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> M1= Matrix(A=1,B=0,C=-1/10,D=1,physicalLength=5,label='Lens')
+        >>> beams = GaussianBeams(q=[5j, 10j], wavelength=1e-3)
+        >>> outputBeams = M1.mul_beams(beams)
+        >>> print(outputBeams.q, outputBeams.z)
+        [-2.+4.j -5.+5.j] [5. 5.]
+
+        See Also
+        --------
+        raytracing.Matrix.mul_beam
+        raytracing.Matrix.traceBeams
+        raytracing.GaussianBeams
+
+        Notes
+        -----
+        Subclasses that override mul_beam() without providing their own
+        mul_beams() are handled one beam at a time with mul_beam().
+        """
+        subclass = type(self)
+        if subclass.mul_beams is Matrix.mul_beams and subclass.mul_beam is not Matrix.mul_beam:
+            return GaussianBeams.fromBeams([self.mul_beam(beam) for beam in rightSideBeams])
+
+        q = rightSideBeams.q
+        if np.any(rightSideBeams.n != self.frontIndex):
+            msg = "The gaussian beams are not tracking the index of refraction properly {0} {1}".format(
+                np.unique(rightSideBeams.n), self.frontIndex)
+            warnings.warn(msg, UserWarning)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            qprime = (self.A * q + self.B) / (self.C * q + self.D)
+
+        outputBeams = GaussianBeams(q=qprime, wavelength=rightSideBeams.wavelength,
+                                    n=self.backIndex, z=self.L + rightSideBeams.z)
+        outputBeams.isClipped = (np.abs(outputBeams.w) > self.apertureDiameter / 2) | rightSideBeams.isClipped
+        return outputBeams
+
     @property
     def largestDiameter(self):
         """ Largest diameter for a group of elements
@@ -607,15 +711,42 @@ class Matrix(object):
         """
 
         rayTrace = []
+        self.appendTrace(ray, rayTrace)
+        return rayTrace
+
+    def appendTrace(self, ray, rayTrace):
+        """The same as trace(), but the rays are appended to an existing ray
+        trace instead of a new list: groups use it to trace a ray through
+        their elements without creating a list for each element.
+
+        Parameters
+        ----------
+        ray : object of Ray class
+            A ray at height y and angle theta
+        rayTrace : list of Ray
+            The ray trace where the rays are appended
+
+        Returns
+        -------
+        outputRay : object of Ray class
+            The last ray appended, after the element
+        """
         if isinstance(ray, Ray):
             if self.L > 0:
                 if abs(ray.y) > self.apertureDiameter / 2:
                     ray.isBlocked = True
                 rayTrace.append(ray)
+            if ray.isBlocked:
+                outputRay = ray
+            elif type(self).mul_ray is Matrix.mul_ray:
+                outputRay = self.propagatedRay(ray)
+            else:
+                outputRay = self.mul_ray(ray)
+        else:
+            outputRay = self * ray
 
-        rayTrace.append(self * ray)
-
-        return rayTrace
+        rayTrace.append(outputRay)
+        return outputRay
 
     def traceThrough(self, inputRay):
         """Contrary to trace(), this only returns the last ray.
@@ -658,7 +789,256 @@ class Matrix(object):
         rayTrace = self.trace(inputRay)
         return rayTrace[-1]
 
-    def traceMany(self, inputRays):
+    def compile(self):
+        """ Returns the element itself: an element is already the simplest
+        plan to trace rays (see MatrixGroup.compile()). """
+        return self
+
+    def traceArraysThrough(self, y, theta, z=0.0, isBlocked=False):
+        r"""The same as traceThrough(), but for many rays at once: the rays are
+        given as arrays of heights and angles and are all propagated together
+        with NumPy. The aperture rules are exactly those of trace(): a ray is
+        blocked if its height is beyond the aperture when it reaches the
+        element, and a blocked ray is not propagated any further.
+
+        Parameters
+        ----------
+        y : array of float
+            Heights of the input rays
+        theta : array of float
+            Angles of the input rays
+        z : float or array of float
+            Positions of the input rays (default=0)
+        isBlocked : bool or array of bool
+            Whether the input rays were already blocked (default=False)
+
+        Returns
+        -------
+        (y, theta, z, isBlocked) : tuple of arrays
+            The heights, angles, positions and blocked status of the rays
+            after the element (i.e. the last ray of each ray trace).
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> # M is an ABCD matrix of a lens (f=10)
+        >>> M= Matrix(A=1,B=0,C=-1/10,D=1,physicalLength=2,apertureDiameter=10,label='Lens')
+        >>> (y, theta, z, isBlocked) = M.traceArraysThrough(y=[1, 2, 6], theta=[0, 0, 0])
+        >>> print(theta, isBlocked)
+        [-0.1 -0.2  0. ] [False False  True]
+
+        See Also
+        --------
+        raytracing.Matrix.traceThrough
+        raytracing.Matrix.traceManyThrough
+
+        Notes
+        -----
+        Subclasses that override mul_ray() or trace() without providing
+        their own traceArraysThrough() are traced one ray at a time with
+        traceThrough(), which is slower but always correct.
+        """
+        (y, theta, z, isBlocked) = self.asRayArrays(y, theta, z, isBlocked)
+
+        subclass = type(self)
+        if subclass.traceArraysThrough is Matrix.traceArraysThrough:
+            if subclass.mul_ray is not Matrix.mul_ray or subclass.trace is not Matrix.trace:
+                return self.traceArraysThroughOneByOne(y, theta, z, isBlocked)
+
+        # Exactly as in trace() and mul_ray(): the height when reaching the
+        # element is compared to the aperture.  With a physical length, a
+        # blocked ray stays at the entrance, otherwise it is still propagated.
+        # Rays that were already blocked are left untouched.
+        isNotBlocked = ~isBlocked
+        if self.L > 0:
+            isNotBlocked = isNotBlocked & ~(np.abs(y) > self.apertureDiameter / 2)
+        isBlockedHere = isNotBlocked & (np.abs(y) > abs(self.apertureDiameter / 2.0))
+
+        with np.errstate(invalid='ignore', over='ignore'):
+            outputY = np.where(isNotBlocked, self.A * y + self.B * theta, y)
+            outputTheta = np.where(isNotBlocked, self.C * y + self.D * theta, theta)
+        outputZ = np.where(isNotBlocked, self.L + z, z)
+
+        return (outputY, outputTheta, outputZ, ~isNotBlocked | isBlockedHere)
+
+    def traceArraysThroughOneByOne(self, y, theta, z=0.0, isBlocked=False):
+        """ The slow but general version of traceArraysThrough(): each ray
+        is created and traced individually with traceThrough().
+        """
+        (y, theta, z, isBlocked) = self.asRayArrays(y, theta, z, isBlocked)
+
+        outputY = np.empty_like(y)
+        outputTheta = np.empty_like(theta)
+        outputZ = np.empty_like(z)
+        outputIsBlocked = np.empty_like(isBlocked)
+        for i in range(len(y)):
+            ray = Ray(y=y[i], theta=theta[i], z=z[i], isBlocked=bool(isBlocked[i]))
+            lastRay = self.traceThrough(ray)
+            outputY[i] = lastRay.y
+            outputTheta[i] = lastRay.theta
+            outputZ[i] = lastRay.z
+            outputIsBlocked[i] = lastRay.isBlocked
+
+        return (outputY, outputTheta, outputZ, outputIsBlocked)
+
+    def traceArrays(self, y, theta, z=0.0, isBlocked=False):
+        """The same as trace(), but for many rays at once: instead of a list
+        of Ray for one ray, it returns the list of checkpoints of all the rays,
+        each checkpoint being the arrays (y, theta, z, isBlocked).  There are
+        as many checkpoints as there are rays in the ray trace from trace().
+
+        Parameters
+        ----------
+        y : array of float
+            Heights of the input rays
+        theta : array of float
+            Angles of the input rays
+        z : float or array of float
+            Positions of the input rays (default=0)
+        isBlocked : bool or array of bool
+            Whether the input rays were already blocked (default=False)
+
+        Returns
+        -------
+        checkpoints : list of (y, theta, z, isBlocked)
+            The arrays of the rays at each checkpoint of the ray trace.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> M= Matrix(A=1,B=0,C=-1/10,D=1,physicalLength=2,apertureDiameter=10,label='Lens')
+        >>> checkpoints = M.traceArrays(y=[1, 6], theta=[0, 0])
+        >>> for (y, theta, z, isBlocked) in checkpoints:
+        ...     print(z, isBlocked)
+        [0. 0.] [False  True]
+        [2. 0.] [False  True]
+
+        See Also
+        --------
+        raytracing.Matrix.trace
+        raytracing.Matrix.traceArraysThrough
+        raytracing.TraceArray
+        """
+        (y, theta, z, isBlocked) = self.asRayArrays(y, theta, z, isBlocked)
+
+        subclass = type(self)
+        if subclass.traceArrays is Matrix.traceArrays and subclass.trace is not Matrix.trace:
+            return self.traceArraysOneByOne(y, theta, z, isBlocked)
+
+        checkpoints = []
+        if self.L > 0:
+            isBlocked = isBlocked | (np.abs(y) > self.apertureDiameter / 2)
+            checkpoints.append((y, theta, z, isBlocked))
+
+        checkpoints.append(self.traceArraysThrough(y, theta, z, isBlocked))
+        return checkpoints
+
+    def traceArraysOneByOne(self, y, theta, z=0.0, isBlocked=False):
+        """ The slow but general version of traceArrays(): each ray is
+        created and traced individually with trace().
+        """
+        (y, theta, z, isBlocked) = self.asRayArrays(y, theta, z, isBlocked)
+
+        rayTraces = []
+        for i in range(len(y)):
+            ray = Ray(y=y[i], theta=theta[i], z=z[i], isBlocked=bool(isBlocked[i]))
+            rayTraces.append([(ray.y, ray.theta, ray.z, ray.isBlocked) for ray in self.trace(ray)])
+
+        if len(rayTraces) == 0:
+            # Without rays, the number of checkpoints comes from any ray
+            nCheckpoints = len(self.trace(Ray()))
+            return [(y, theta, z, isBlocked)] * nCheckpoints
+
+        values = np.array(rayTraces, dtype=float)
+        return [(values[:, k, 0], values[:, k, 1], values[:, k, 2], values[:, k, 3] != 0)
+                for k in range(values.shape[1])]
+
+    def traceBeams(self, beams):
+        """The same as trace(), but for many gaussian beams at once: the beams
+        are propagated together with array arithmetic, and the beams at
+        every checkpoint of the trace are returned together.
+
+        Parameters
+        ----------
+        beams : GaussianBeams, GaussianBeam or list of GaussianBeam
+            The input beams
+
+        Returns
+        -------
+        traces : GaussianBeams
+            The beams with the shape (number of beams, number of checkpoints):
+            element [i, k] is the beam i at checkpoint k, and the properties
+            w, R, waist, waistPosition, z and isClipped are arrays with this shape.
+            The checkpoints are the same as the beams that trace() returns.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = LaserPath([Space(d=10), Lens(f=10, diameter=1), Space(d=10)])
+        >>> traces = path.traceBeams(GaussianBeams(w=[0.1, 0.6]))
+        >>> print(traces.z[0], traces.isClipped[:, -1])
+        [ 0. 10. 10. 20.] [False  True]
+
+        See Also
+        --------
+        raytracing.Matrix.trace
+        raytracing.Matrix.beamCheckpoints
+        raytracing.GaussianBeams
+        """
+        if not isinstance(beams, GaussianBeams):
+            beams = GaussianBeams.fromBeams(beams)
+        return GaussianBeams.fromCheckpoints(self.beamCheckpoints(beams))
+
+    def beamCheckpoints(self, beams):
+        """ The beams at each checkpoint of the trace of the beams through
+        the element, as a list of GaussianBeams: for a single element, it
+        is the beams after the element.
+
+        Parameters
+        ----------
+        beams : GaussianBeams
+            The input beams
+
+        Returns
+        -------
+        checkpoints : list of GaussianBeams
+            The beams at each checkpoint of the trace.
+        """
+        subclass = type(self)
+        if subclass.beamCheckpoints is Matrix.beamCheckpoints and subclass.trace is not Matrix.trace:
+            return self.beamCheckpointsOneByOne(beams)
+
+        return [self.mul_beams(beams)]
+
+    def beamCheckpointsOneByOne(self, beams):
+        """ The slow but general version of beamCheckpoints(): each beam is
+        traced individually with trace().
+        """
+        beamTraces = [self.trace(beam) for beam in beams]
+        if len(beamTraces) == 0:
+            # Without beams, the number of checkpoints comes from any beam
+            nCheckpoints = len(self.trace(GaussianBeam(w=1)))
+            return [beams] * nCheckpoints
+
+        return [GaussianBeams.fromBeams([beamTrace[k] for beamTrace in beamTraces])
+                for k in range(len(beamTraces[0]))]
+
+    @staticmethod
+    def asRayArrays(y, theta, z=0.0, isBlocked=False):
+        """ Converts heights, angles, positions and blocked status to four
+        one-dimensional arrays of the same length, as used by
+        traceArraysThrough(). Scalar z and isBlocked apply to all rays.
+        """
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        theta = np.atleast_1d(np.asarray(theta, dtype=float))
+        if y.shape != theta.shape:
+            raise ValueError("'y' and 'theta' must have the same length.")
+
+        z = np.broadcast_to(np.asarray(z, dtype=float), y.shape)
+        isBlocked = np.broadcast_to(np.asarray(isBlocked, dtype=bool), y.shape)
+        return (y, theta, z, isBlocked)
+
+    def traceMany(self, inputRays, asArray=False):
         r"""This function trace each ray from a group of rays from front edge of element to
         the back edge. It can be either a list of Ray(), or a Rays() object:
         the Rays() object is an iterator and can be used like a list.
@@ -668,11 +1048,15 @@ class Matrix(object):
         inputRays : list of object of Ray class
             A List of rays, each object includes two ray. The fisr is the properties
             of the input ray and the second is the properties of the output ray.
+        asArray : bool
+            If True, all the rays are traced at once with traceArrays() and
+            a TraceArray is returned instead of lists of Ray (default=False)
 
         Returns
         -------
         rayTrace : object of Ray class
-            List of Ray() (i,e. a raytrace), one for each input ray.
+            List of Ray() (i,e. a raytrace), one for each input ray,
+            or a TraceArray if asArray is True.
 
         Examples
         --------
@@ -706,7 +1090,15 @@ class Matrix(object):
         raytracing.Matrix.trace
         raytracing.Matrix.traceThrough
         raytracing.Matrix.traceManyThrough
+        raytracing.TraceArray
         """
+        if asArray:
+            inputRays = Rays(inputRays)
+            weights = None
+            if inputRays.isWeighted:
+                weights = inputRays.weights
+            return TraceArray(self.traceArrays(*inputRays.rayArrays()), weights=weights)
+
         manyRayTraces = []
         for inputRay in inputRays:
             rayTrace = self.trace(inputRay)
@@ -714,7 +1106,7 @@ class Matrix(object):
 
         return manyRayTraces
 
-    def traceManyThrough(self, inputRays, progress=True):
+    def traceManyThrough(self, inputRays, progress=True, pool=None):
         """This function trace each ray from a list or a Rays() distribution from
         front edge of element to the back edge.
         Input can be either a list of Ray(), or a Rays() object:
@@ -727,7 +1119,9 @@ class Matrix(object):
             A group of rays
         progress : bool
             if True, the progress of the raceTrough is shown (default=Trye)
-
+        pool : TracingPool
+            If provided, the rays are traced in parallel with this pool of
+            processes (default=None)
 
         Returns
         -------
@@ -746,10 +1140,10 @@ class Matrix(object):
         >>> inputRays = RandomUniformRays(yMax=5, yMin=0, maxCount=nRays)
         >>> Tr=M.traceManyThrough(inputRays)
         >>> print('heights of the output rays:', Tr.yValues)
-        heights of the output rays: [4.323870378874155, 2.794064779525441, 0.7087442942835853]
+        heights of the output rays: [4.32387038 2.79406478 0.70874429]
 
         >>> print('angles of the output rays:', Tr.thetaValues)
-        angles of the output rays: [-1.499826089814585, 0.7506850963379516, -0.44348989046728904]
+        angles of the output rays: [-1.49982609  0.7506851  -0.44348989]
 
         See Also
         --------
@@ -767,22 +1161,312 @@ class Matrix(object):
         except TypeError:
             raise TypeError("'inputRays' argument is not iterable.")
 
+        if pool is not None:
+            return pool.traceManyThrough(self, inputRays, progress=progress)
+
         if not isinstance(inputRays, Rays):
             inputRays = Rays(inputRays)
 
+        (y, theta, z, isBlocked) = self.traceRayArraysThrough(inputRays, progress=progress)
+
+        isNotBlocked = ~isBlocked
+        weights = None
+        if inputRays.isWeighted:
+            weights = inputRays.weights[isNotBlocked]
+
         outputRays = Rays()
+        outputRays.appendArrays(y[isNotBlocked], theta[isNotBlocked], z[isNotBlocked], weights=weights)
+        return outputRays
 
-        for ray in inputRays:
-            lastRay = self.traceThrough(ray)
-            if lastRay.isNotBlocked:
-                outputRays.append(lastRay)
+    def traceRayArraysThrough(self, inputRays, progress=True):
+        """Traces all the rays of a Rays object with traceArraysThrough() and
+        shows the progress as if the rays were traced one by one.
 
+        Parameters
+        ----------
+        inputRays : Rays
+            The rays to trace
+        progress : bool
+            If True, the progress of the tracing is shown (default=True)
+
+        Returns
+        -------
+        (y, theta, z, isBlocked) : tuple of arrays
+            The output rays, including the blocked ones, in the same order
+            as the input rays.
+
+        See Also
+        --------
+        raytracing.Matrix.traceArraysThrough
+        raytracing.Matrix.traceManyThrough
+        """
+        (y, theta, z, isBlocked) = inputRays.rayArrays()
+        outputY = np.empty(len(y))
+        outputTheta = np.empty(len(y))
+        outputZ = np.empty(len(y))
+        outputIsBlocked = np.empty(len(y), dtype=bool)
+
+        # All rays are traced together, in chunks that end where
+        # displayProgress() reports progress.
+        inputRays.iteration = 0
+        inputRays.progressLog = 10000
+        nRays = len(y)
+        start = 0
+        while start < nRays:
+            stop = min((start // inputRays.progressLog + 1) * inputRays.progressLog, nRays)
+            (outputY[start:stop], outputTheta[start:stop],
+             outputZ[start:stop], outputIsBlocked[start:stop]) = self.traceArraysThrough(y[start:stop],
+                                                                                        theta[start:stop],
+                                                                                        z[start:stop],
+                                                                                        isBlocked[start:stop])
+            inputRays.iteration = stop
             if progress:
                 inputRays.displayProgress()
+            start = stop
 
-        return outputRays
+        return (outputY, outputTheta, outputZ, outputIsBlocked)
+
+    def detectManyThrough(self, inputRays, detector, chunkSize=100000, pool=None):
+        """Traces the rays chunk by chunk and adds the output rays that are
+        not blocked to a detector. The output rays are never kept, so any
+        number of rays can be traced with a constant amount of memory.
+
+        Parameters
+        ----------
+        inputRays : Rays or iterable of Rays
+            The rays to trace, or chunks of rays (a generator for instance)
+        detector : Detector
+            The detector that receives the output rays
+        chunkSize : int
+            The number of rays traced at once (default=100000)
+        pool : TracingPool
+            If provided, each chunk is traced in parallel with this pool of
+            processes (default=None)
+
+        Returns
+        -------
+        detector : Detector
+            The detector, with the output rays added
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10)])
+        >>> detector = Detector(yBinCount=10, yRange=(-5, 5))
+        >>> chunks = (RandomUniformRays(yMax=1, thetaMax=0.1, maxCount=1000) for i in range(5))
+        >>> detector = path.detectManyThrough(chunks, detector)
+        >>> print(detector.rayCount)
+        5000
+
+        See Also
+        --------
+        raytracing.Detector
+        raytracing.Matrix.traceManyThrough
+        """
+        if isinstance(inputRays, Rays):
+            inputRays = [inputRays]
+
+        plan = self.compile()
+        for rays in inputRays:
+            if not isinstance(rays, Rays):
+                rays = Rays(rays)
+
+            (y, theta, z, isBlocked) = rays.rayArrays()
+            weights = rays.weights
+            for start in range(0, len(y), chunkSize):
+                stop = start + chunkSize
+                chunk = (y[start:stop], theta[start:stop], z[start:stop], isBlocked[start:stop])
+                if pool is not None:
+                    (outputY, outputTheta, outputZ, outputIsBlocked) = pool.traceArraysThrough(self, *chunk)
+                else:
+                    (outputY, outputTheta, outputZ, outputIsBlocked) = plan.traceArraysThrough(*chunk)
+                isNotBlocked = ~outputIsBlocked
+                detector.add(outputY[isNotBlocked], outputTheta[isNotBlocked],
+                             weights=weights[start:stop][isNotBlocked])
+
+        return detector
+
+    def traceFileThrough(self, inputFilePath, outputFilePath=None, detector=None, chunkSize=100000, start=0,
+                         stop=None, pool=None):
+        """Traces the rays of a file saved with Rays.save() chunk by chunk,
+        without ever loading all the rays in memory. The rays that are not
+        blocked are written to an output file, added to a detector, or both.
+        The memory used only depends on the chunk size.
+
+        Parameters
+        ----------
+        inputFilePath : str or PathLike
+            The file of the input rays (see RayFile)
+        outputFilePath : str or PathLike
+            The file where the output rays are written (Optional)
+        detector : Detector
+            The detector that receives the output rays (Optional)
+        chunkSize : int
+            The number of rays traced at once (default=100000)
+        start, stop : int
+            The range of rays of the input file to trace (default: all the rays).
+            Different processes can trace different ranges of the same file.
+        pool : TracingPool
+            If provided, the rays are traced in parallel with this pool of
+            processes (default=None)
+
+        Returns
+        -------
+        outputCount : int
+            The number of rays that were not blocked
+
+        Examples
+        --------
+        >>> import os, tempfile
+        >>> from raytracing import *
+        >>> directory = tempfile.mkdtemp()
+        >>> RandomUniformRays(yMax=10, thetaMax=0.1, maxCount=10000).save(os.path.join(directory, "input.dat"))
+        >>> path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10)])
+        >>> count = path.traceFileThrough(os.path.join(directory, "input.dat"), os.path.join(directory, "output.dat"))
+        >>> outputRays = Rays()
+        >>> outputRays.load(os.path.join(directory, "output.dat"))
+        >>> print(len(outputRays) == count)
+        True
 
-    def traceManyThroughInParallel(self, inputRays, progress=True, processes=None):
+        See Also
+        --------
+        raytracing.RayFile
+        raytracing.Matrix.detectManyThrough
+        """
+        if pool is not None:
+            return pool.traceFileThrough(self, inputFilePath, outputFilePath=outputFilePath, detector=detector,
+                                         chunkSize=chunkSize, start=start, stop=stop)
+
+        inputFile = RayFile(inputFilePath)
+        if inputFile.kind != 'rays':
+            raise IOError(f"{inputFilePath} does not contain rays but {inputFile.kind}.")
+        if stop is None or stop > inputFile.count:
+            stop = inputFile.count
+        start = min(max(start, 0), stop)
+
+        columns = {name: inputFile.column(name) for name in inputFile.columnNames}
+        outputFile = None
+        if outputFilePath is not None:
+            outputFile = RayFile.create(outputFilePath, 'rays',
+                                        {name: (values.dtype, values.shape[1:]) for name, values in columns.items()},
+                                        capacity=stop - start)
+
+        plan = self.compile()
+        outputCount = 0
+        for chunkStart in range(start, stop, chunkSize):
+            chunkStop = min(chunkStart + chunkSize, stop)
+            chunk = {name: np.array(values[chunkStart:chunkStop]) for name, values in columns.items()}
+            (y, theta, z, isBlocked) = plan.traceArraysThrough(chunk['y'], chunk['theta'], chunk['z'],
+                                                               chunk['isBlocked'])
+            (chunk['y'], chunk['theta'], chunk['z'], chunk['isBlocked']) = (y, theta, z, isBlocked)
+
+            isNotBlocked = ~isBlocked
+            outputChunk = {name: values[isNotBlocked] for name, values in chunk.items()}
+            if outputFile is not None:
+                outputFile.append(outputChunk)
+            if detector is not None:
+                detector.add(outputChunk['y'], outputChunk['theta'], weights=outputChunk.get('weight'))
+            outputCount += len(outputChunk['y'])
+
+        return outputCount
+
+    def estimateTransmission(self, source, relativeError=0.01, confidence=0.95, detector=None, binThreshold=0.1,
+                             chunkSize=10000, maxRayCount=None, maxTime=None, pool=None):
+        """Estimates the fraction of a source that goes through, tracing
+        only as many rays as needed: the rays are traced chunk by chunk until
+        the confidence interval of the transmission (and of the bins of the
+        detector, if any) is narrow enough, or until the budget of rays or
+        time is spent.  A transmission close to 1 needs few rays, a very small
+        one needs many more.
+
+        Parameters
+        ----------
+        source : Rays
+            The source of rays. Random rays are generated chunk by chunk, up to
+            their maximum count: use a large maxCount and let the precision
+            decide when to stop. With ImportanceSampledRays, the transmission
+            is normalized by the number of rays (see TransmissionEstimate).
+        relativeError : float
+            The target half width of the confidence interval, relative to the
+            transmission (default=0.01)
+        confidence : float
+            The probability that the confidence intervals contain the values (default=0.95)
+        detector : Detector
+            An empty detector that receives the transmitted rays (Optional). If
+            provided, the bins of its height histogram that contain at least
+            binThreshold times the content of the largest bin must also reach
+            the relative error.
+        binThreshold : float
+            The fraction of the largest bin below which bins are ignored (default=0.1)
+        chunkSize : int
+            The number of rays traced at once (default=10000)
+        maxRayCount : int
+            The maximum number of rays to trace (default=None, all the rays of the source)
+        maxTime : float
+            The maximum time, in seconds, after which no chunk is started (default=None)
+        pool : TracingPool
+            If provided, each chunk is traced in parallel with this pool of
+            processes (default=None). The chunks should then be larger.
+
+        Returns
+        -------
+        estimate : TransmissionEstimate
+            The transmission, its confidence interval, the relative error that
+            was reached and the reason why the tracing stopped: 'converged',
+            'maxRayCount', 'maxTime' or 'sourceExhausted'.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=10), Aperture(diameter=2)])
+        >>> source = RandomUniformRays(yMax=1, thetaMax=0.1, maxCount=10000000, seed=1)
+        >>> estimate = path.estimateTransmission(source, relativeError=0.01)
+        >>> print(estimate.stopReason, estimate.rayCount, estimate.relativeError <= 0.01)
+        converged 20000 True
+
+        See Also
+        --------
+        raytracing.TransmissionEstimate
+        raytracing.Matrix.detectManyThrough
+        """
+        estimate = TransmissionEstimate(confidence=confidence, detector=detector)
+        plan = self.compile()
+        startTime = time.time()
+        if not isinstance(source, Rays):
+            source = Rays(source)
+
+        estimate.stopReason = 'sourceExhausted'
+        for rays in source.chunks(chunkSize):
+            if maxRayCount is not None:
+                if estimate.rayCount >= maxRayCount:
+                    estimate.stopReason = 'maxRayCount'
+                    break
+                rays = rays.chunk(0, maxRayCount - estimate.rayCount)
+
+            totalWeight = source.normalizedTotalWeight(rays)
+            if pool is not None:
+                (y, theta, z, isBlocked) = pool.traceArraysThrough(self, *rays.rayArrays())
+            else:
+                (y, theta, z, isBlocked) = plan.traceArraysThrough(*rays.rayArrays())
+            isTransmitted = ~isBlocked
+            estimate.add(isTransmitted, weights=rays.weights if rays.isWeighted else None,
+                         y=y[isTransmitted], theta=theta[isTransmitted], totalWeight=totalWeight)
+            estimate.elapsedTime = time.time() - startTime
+
+            if estimate.relativeError <= relativeError:
+                if detector is None or np.all(estimate.binRelativeErrors(binThreshold) <= relativeError):
+                    estimate.stopReason = 'converged'
+                    break
+            if maxTime is not None and estimate.elapsedTime >= maxTime:
+                estimate.stopReason = 'maxTime'
+                break
+        else:
+            if maxRayCount is not None and estimate.rayCount >= maxRayCount:
+                estimate.stopReason = 'maxRayCount'
+
+        return estimate
+
+    def traceManyThroughInParallel(self, inputRays, progress=True, processes=None, pool=None):
         """ This is an advanced technique to gain from parallel computation:
         it is the same as traceManyThrough(), but splits this call in
         several other parallel processes using the `multiprocessing` module,
@@ -801,6 +1485,10 @@ class Matrix(object):
             A group of rays
         progress : bool
             If True, the progress in percentage of the traceTrough is shown (default=True)
+        processes : int
+            The number of processes (default=None, the number of CPUs)
+        pool : TracingPool
+            A pool of processes to reuse instead of starting new processes (default=None)
 
         Returns
         -------
@@ -816,33 +1504,103 @@ class Matrix(object):
         -----
         One important technical issue: Pool accesses the array in multiple processes
         and cannot be dynamically generated (because it is not thread-safe).
-        We explicitly generate the list before the computation, then we split
-        the array in #processes different lists.
+        We explicitly generate the rays before the computation.  The rays are
+        then placed in shared memory (see SharedRayArrays) and each process
+        receives the compiled path and a range of rays to trace in place,
+        so that no ray is sent to or from the processes.
         """
 
+        try:
+            iter(inputRays)
+        except TypeError:
+            raise TypeError("'inputRays' argument is not iterable.")
+
         if processes is None:
             processes = multiprocessing.cpu_count()
 
-        theExplicitList = list(inputRays)
-        manyInputRays = [(theExplicitList[i::processes], progress) for i in range(processes)]
+        if not isinstance(inputRays, Rays):
+            inputRays = Rays(inputRays)
 
-        with multiprocessing.Pool(processes=processes) as pool:
-            outputRays = pool.starmap(self.traceManyThrough, manyInputRays)
+        if pool is not None:
+            return pool.traceManyThrough(self, inputRays, progress=progress)
 
-        outputRaysList = []
-        for rays in outputRays:
-            outputRaysList += rays.rays
+        if shared_memory is None:  # pragma: no cover
+            # Python < 3.8: no shared memory, we trace in this process
+            return self.traceManyThrough(inputRays, progress=progress)
 
-        return Rays(rays=outputRaysList)
+        with TracingPool(processes=processes) as pool:
+            return pool.traceManyThrough(self, inputRays, progress=progress)
 
     def profileFromRayTraces(self, rayTraces, z=float("+inf")):
-        outputRays = Rays()
-        for rayTrace in rayTraces:
-            ray = Ray.along(rayTrace, z=z)
-            if ray.isNotBlocked:
-                outputRays.append(ray)
+        """The rays that are not blocked at position z along the ray traces,
+        as obtained with Ray.along() for each ray trace.
 
-        return outputRays
+        Parameters
+        ----------
+        rayTraces : TraceArray or list of list of Ray
+            The ray traces, from traceMany()
+        z : float
+            The position of the plane (default=+inf, the end of the ray traces)
+
+        Returns
+        -------
+        outputRays : Rays
+            The rays not blocked at position z
+
+        See Also
+        --------
+        raytracing.Matrix.profilesFromRayTraces
+        """
+        return self.profilesFromRayTraces(rayTraces, [z])[0]
+
+    def profilesFromRayTraces(self, rayTraces, z):
+        """The rays that are not blocked at many positions z along the ray
+        traces. All the planes are sampled at once with TraceArray.sampleAt().
+
+        Parameters
+        ----------
+        rayTraces : TraceArray or list of list of Ray
+            The ray traces, from traceMany()
+        z : array of float
+            The positions of the planes
+
+        Returns
+        -------
+        profiles : list of Rays
+            For each plane, the rays not blocked at this position
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10)])
+        >>> traces = path.traceMany(UniformRays(yMax=4, thetaMax=0, M=5, N=1), asArray=True)
+        >>> for profile in path.profilesFromRayTraces(traces, z=[0, 15, 20]):
+        ...     print(profile.yValues)
+        [-4. -2.  0.  2.  4.]
+        [-2. -1.  0.  1.  2.]
+        [0. 0. 0. 0. 0.]
+
+        See Also
+        --------
+        raytracing.TraceArray.sampleAt
+        """
+        if not isinstance(rayTraces, TraceArray):
+            rayTraces = TraceArray.fromRayTraces(rayTraces)
+
+        (y, theta, z, isBlocked) = rayTraces.sampleAt(z)
+        profiles = []
+        for plane in range(y.shape[1]):
+            isNotBlocked = ~isBlocked[:, plane]
+            weights = None
+            if rayTraces.weights is not None:
+                weights = rayTraces.weights[isNotBlocked]
+
+            outputRays = Rays()
+            outputRays.appendArrays(y[isNotBlocked, plane], theta[isNotBlocked, plane], z[isNotBlocked, plane],
+                                    weights=weights)
+            profiles.append(outputRays)
+
+        return profiles
 
     @property
     def isImaging(self):
@@ -1340,6 +2098,7 @@ class Matrix(object):
         self.frontIndex = self.backIndex
         self.backIndex = tempIndex
 
+        self.invalidate()
         return self
 
     def displayHalfHeight(self):
@@ -1383,7 +2142,7 @@ class Matrix(object):
 
     def __eq__(self, other):
         if isinstance(other, Matrix):
-            return self.__dict__ == other.__dict__
+            return self.__getstate__() == other.__getstate__()
         return False
 
 
@@ -1565,6 +2324,7 @@ in version 1.2.8 to maintain the sign convention", UserWarning)
         super(CurvedMirror, self).flipOrientation()
 
         self.C = - self.C
+        self.invalidate()
         return self
 
 
@@ -1690,6 +2450,7 @@ class DielectricInterface(Matrix):
         self.C = - (self.n2 - self.n1) / (self.n2 * self.R)
         self.D = self.n1 / self.n2
 
+        self.invalidate()
         return self
 
 
@@ -1821,6 +2582,7 @@ class ThickLens(Matrix):
         self.B = t / n
         self.C = - (n - 1.0) * (1.0 / R1 - 1.0 / R2 + t * (n - 1.0) / (n * R1 * R2))
         self.D = t * (n - 1.0) / (n * R2) + 1
+        self.invalidate()
         return self
 
 
@@ -1,6 +1,8 @@
 from .matrix import *
 
 import collections.abc as collections
+import bisect
+import copy
 
 
 class MatrixGroup(Matrix):
@@ -14,6 +16,12 @@ class MatrixGroup(Matrix):
         A list of ABCD matrices in the imaging path
     label : string
         the label for the imaging path (Optional)
+
+    Notes
+    -----
+    The group keeps the products of its elements. An element that is
+    modified in place after it was added must call its invalidate()
+    method, so that they are computed again.
     """
 
     def __init__(self, elements=None, label=""):
@@ -21,6 +29,12 @@ class MatrixGroup(Matrix):
         super(MatrixGroup, self).__init__(1, 0, 0, 1, label=label)
 
         self.elements = []
+        self.version = 0
+        self._compiledPath = None
+        self._compiledVersion = None
+        self._rayTraceSteps = None
+        self._rayTraceStepsVersion = None
+        self.clearPrefixMatrices()
 
         if elements is not None:
             if not isinstance(elements, collections.Iterable):
@@ -35,6 +49,22 @@ class MatrixGroup(Matrix):
         self._lastRayToBeTraced = None
         self._lastRayTrace = None
 
+    def __setstate__(self, state):
+        """ Restores a pickled group. The groups pickled by older versions
+        do not have the cached products and compiled path, which are then
+        empty. """
+        self.version = 0
+        self._compiledPath = None
+        self._compiledVersion = None
+        self._rayTraceSteps = None
+        self._rayTraceStepsVersion = None
+        self.clearPrefixMatrices()
+        self._lastRayToBeTraced = None
+        self._lastRayTrace = None
+        self.__dict__.update(state)
+        for element in self.elements:
+            element.addGroupReference(self)
+
     def append(self, matrix):
         r"""This function adds an element at the end of the path.
 
@@ -80,7 +110,76 @@ class MatrixGroup(Matrix):
                     raise ValueError(msg)
 
         self.elements.append(matrix)
-        transferMatrix = self.transferMatrix()
+        self.updateTransferMatrix()
+
+    def clearPrefixMatrices(self):
+        """ Forgets the cached products of the first elements of the group
+        (see updatePrefixMatrices()). """
+        self._prefixElements = []
+        self._prefixMatrices = [Matrix(A=1, B=0, C=0, D=1)]
+        self._prefixPositions = [0]
+        self._prefixArrays = None
+
+    def forgetPrefixMatrices(self, index):
+        """ Forgets the cached products that include the elements from `index`
+        to the end of the group (see updatePrefixMatrices()). """
+        if index < len(self._prefixElements):
+            del self._prefixElements[index:]
+            del self._prefixMatrices[index + 1:]
+            del self._prefixPositions[index + 1:]
+            self._prefixArrays = None
+
+    def updatePrefixMatrices(self):
+        """ Computes the products of the first k elements of the group for every
+        k (the prefix products) and the positions where each element starts.
+        They are kept between calls, so only the elements added at the end
+        since the last call are multiplied. If the list of elements was
+        modified directly, the products are all computed again. The
+        elements keep a reference to the group, to tell it when they are
+        modified in place (see Matrix.invalidate()).
+        """
+        cachedCount = len(self._prefixElements)
+        if cachedCount > len(self.elements):
+            self.clearPrefixMatrices()
+        elif cachedCount != 0 and self.elements[cachedCount - 1] is not self._prefixElements[-1]:
+            self.clearPrefixMatrices()
+
+        newElements = self.elements[len(self._prefixElements):]
+        if len(newElements) != 0:
+            self._prefixArrays = None
+
+        for element in newElements:
+            transferMatrix = element * self._prefixMatrices[-1]
+            self._prefixMatrices.append(transferMatrix)
+            self._prefixPositions.append(transferMatrix.L)
+            self._prefixElements.append(element)
+            element.addGroupReference(self)
+
+    def elementModified(self, element):
+        """ Computes the products again from the first position of an element
+        that was modified in place, which changes the version of the group
+        (see Matrix.invalidate()). Nothing is done if the element is not in
+        the group anymore.
+        """
+        for index, prefixElement in enumerate(self._prefixElements):
+            if prefixElement is element:
+                self.forgetPrefixMatrices(index)
+                self.updateTransferMatrix()
+                return
+
+    def updateTransferMatrix(self):
+        """ Updates the ABCD matrix, length and vertices of the group after
+        elements were added at the end. Thanks to the prefix products (see
+        updatePrefixMatrices()), appending an element is a single product.
+        This is called after every change to the group, which increments
+        the version of the group and tells the groups that contain it.
+        """
+        self.updatePrefixMatrices()
+        self.version += 1
+        self._lastRayToBeTraced = None
+        self._lastRayTrace = None
+
+        transferMatrix = self._prefixMatrices[-1]
         self.A = transferMatrix.A
         self.B = transferMatrix.B
         self.C = transferMatrix.C
@@ -88,6 +187,69 @@ class MatrixGroup(Matrix):
         self.L = transferMatrix.L
         self.frontVertex = transferMatrix.frontVertex
         self.backVertex = transferMatrix.backVertex
+        self.invalidate()
+
+    def heightsAtApertures(self, y, theta, z=0.0):
+        """ The heights of a ray at the entrance of every element of finite
+        diameter, including the elements of nested groups, as if the ray
+        was never blocked. These are the heights that are compared to the
+        diameters when a ray is traced.
+
+        Parameters
+        ----------
+        y : float
+            The height of the ray at the front edge of the group
+        theta : float
+            The angle of the ray at the front edge of the group
+        z : float
+            The position of the front edge of the group (default=0)
+
+        Returns
+        -------
+        (positions, diameters, heights) : tuple of arrays
+            The positions and diameters of the elements of finite
+            diameter, and the heights of the ray at their entrance.
+        """
+        positions = []
+        diameters = []
+        heights = []
+        for element in self.elements:
+            if isinstance(element, MatrixGroup):
+                (groupPositions, groupDiameters, groupHeights) = element.heightsAtApertures(y, theta, z)
+                positions.extend(groupPositions)
+                diameters.extend(groupDiameters)
+                heights.extend(groupHeights)
+            elif element.hasFiniteApertureDiameter():
+                positions.append(z)
+                diameters.append(element.apertureDiameter)
+                heights.append(y)
+
+            (y, theta) = (element.A * y + element.B * theta, element.C * y + element.D * theta)
+            z += element.L
+
+        return (np.array(positions, dtype=float), np.array(diameters, dtype=float), np.array(heights, dtype=float))
+
+    def truncate(self, index):
+        """ Removes all the elements from `index` to the end of the group,
+        and returns them. The products of the elements that are kept do
+        not need to be computed again.
+
+        Parameters
+        ----------
+        index : int
+            Index of the first element removed.
+
+        Returns
+        -------
+        removedElements : list of Matrix
+            The removed elements, in order.
+        """
+        index = slice(index, None).indices(len(self.elements))[0]
+        removedElements = self.elements[index:]
+        del self.elements[index:]
+        self.forgetPrefixMatrices(index)
+        self.updateTransferMatrix()
+        return removedElements
 
     def __len__(self):
         """
@@ -167,11 +329,10 @@ class MatrixGroup(Matrix):
         >>> print(f"Has finite diameter? {system.hasFiniteApertureDiameter()}")
         Has finite diameter? False
         """
-        poppedElement = self.elements.pop(index)  # We pop the matrix in the list
-        tempElements = self.elements[:]  # We "copy" the list
-        self.elements.clear()  # We clear the attribute
-        for element in tempElements:
-            self.append(element)  # We rebuild the attribute (check indices, compute ABCD, etc)
+        index = range(len(self.elements))[index]
+        poppedElement, *followingElements = self.truncate(index)
+        for element in followingElements:
+            self.append(element)  # We rebuild the end (check indices, compute ABCD, etc)
         return poppedElement
 
     def insert(self, index: int, element: Matrix):
@@ -215,10 +376,8 @@ class MatrixGroup(Matrix):
             element = MatrixGroup([element])
         else:
             element = MatrixGroup(element)
-        self.elements = self.elements[:index] + element.elements + self.elements[index:]
-        tempElements = self.elements[:]
-        self.elements.clear()
-        for matrix in tempElements:
+        followingElements = self.truncate(index)
+        for matrix in element.elements + followingElements:
             self.append(matrix)
 
     def __setitem__(self, key, element: Matrix):
@@ -258,15 +417,16 @@ class MatrixGroup(Matrix):
         if isinstance(key, slice):
             if key.step is not None and key.step != 1:
                 warnings.warn("Not using the step of the slice.", UserWarning)
-            if key.start is None:
-                key = slice(0, key.stop)
-            if key.stop is None:
-                key = slice(key.start, len(self))
-            self.elements = self.elements[:key.start] + self.elements[key.stop:]  # "Cut" the original list
-            self.insert(key.start, element)
+            start, stop, _ = key.indices(len(self))
+            followingElements = self.truncate(max(start, stop))
+            self.truncate(start)  # "Cut" the original list
+            self.insert(start, element)
+            for matrix in followingElements:
+                self.append(matrix)
         else:
-            self.pop(key)
-            self.insert(key, element)
+            index = range(len(self))[key]
+            self.pop(index)
+            self.insert(index, element)
 
     def transferMatrix(self, upTo=float('+Inf')):
         r""" The transfer matrix between front edge and distance=upTo
@@ -303,23 +463,97 @@ class MatrixGroup(Matrix):
         for a fraction of the length.  It is up to the Matrix() or 
         MatrixGroup() to define such partial transfer matrix when possible.
         Quite simply, Space() defines a partial matrix as Space(d=upTo).
+        The transfer matrix of an empty group is the identity.
 
         When using this transfer matrix, any information related to rays
         that have been blocked is lost: apertures are not part of the 
         ray formalism.  To find out if a ray has been blocked, you must
         use trace().
         """
-        transferMatrix = Matrix(A=1, B=0, C=0, D=1)
-        distance = upTo
-        for element in self.elements:
-            if element.L <= distance:
-                transferMatrix = element * transferMatrix
-                distance -= element.L
+        self.updatePrefixMatrices()
+
+        # The cached products are copied: the caller may modify the matrix
+        count = len(self.elements)
+        index = bisect.bisect_right(self._prefixPositions, upTo) - 1
+        if index >= count:
+            return copy.copy(self._prefixMatrices[count])
+        if count == 0:
+            return copy.copy(self._prefixMatrices[0])
+
+        index = max(index, 0)
+        distance = upTo - self._prefixPositions[index]
+        return self.elements[index].transferMatrix(upTo=distance) * self._prefixMatrices[index]
+
+    def transferMatrixArrays(self, upTo):
+        r""" The transfer matrices between front edge and many distances,
+        as arrays of the A, B, C and D values.  This gives the same
+        values as transferMatrix(upTo=z) for each z, but the elements
+        containing the positions are found all at once.
+
+        Parameters
+        ----------
+        upTo : array of float
+            The axial distances from the front edge of the first element
+
+        Returns
+        -------
+        (A, B, C, D) : tuple of arrays
+            The values of the transfer matrices, with the shape of upTo
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> matGrp = MatrixGroup([Space(d=10), Lens(f=10), Space(d=10)])
+        >>> (A, B, C, D) = matGrp.transferMatrixArrays(upTo=[5, 15, 20])
+        >>> print(A)
+        [1.  0.5 0. ]
+        >>> print(B)
+        [ 5. 10. 10.]
+
+        See Also
+        --------
+        raytracing.MatrixGroup.transferMatrix
+
+        Notes
+        -----
+        Positions inside a Space() are computed with arrays. Positions
+        inside any other element of finite length are computed with
+        the element's own transferMatrix(), one at a time.
+        """
+        z = np.asarray(upTo, dtype=float)
+        self.updatePrefixMatrices()
+        if self._prefixArrays is None:
+            self._prefixArrays = (np.array(self._prefixPositions, dtype=float),
+                                  np.array([matrix.A for matrix in self._prefixMatrices], dtype=float),
+                                  np.array([matrix.B for matrix in self._prefixMatrices], dtype=float),
+                                  np.array([matrix.C for matrix in self._prefixMatrices], dtype=float),
+                                  np.array([matrix.D for matrix in self._prefixMatrices], dtype=float))
+        (positions, prefixA, prefixB, prefixC, prefixD) = self._prefixArrays
+
+        count = len(self.elements)
+        indices = np.searchsorted(positions, z, side='right') - 1
+        indices = np.clip(indices, 0, count)
+        A = prefixA[indices]
+        B = prefixB[indices]
+        C = prefixC[indices]
+        D = prefixD[indices]
+
+        isInside = indices < count
+        for index in np.unique(indices[isInside]):
+            element = self.elements[index]
+            isInElement = indices == index
+            distance = z[isInElement] - positions[index]
+            if isinstance(element, Space) and type(element).transferMatrix is Space.transferMatrix:
+                A[isInElement] = prefixA[index] + distance * prefixC[index]
+                B[isInElement] = prefixB[index] + distance * prefixD[index]
             else:
-                transferMatrix = element.transferMatrix(upTo=distance) * transferMatrix
-                break
+                partialMatrices = [element.transferMatrix(upTo=d) * self._prefixMatrices[index] for d in distance]
+                A[isInElement] = [matrix.A for matrix in partialMatrices]
+                B[isInElement] = [matrix.B for matrix in partialMatrices]
+                C[isInElement] = [matrix.C for matrix in partialMatrices]
+                D[isInElement] = [matrix.D for matrix in partialMatrices]
 
-        return transferMatrix
+        return (A, B, C, D)
 
     def transferMatrices(self):
         r""" The list of Matrix() that corresponds to the propagation through
@@ -430,10 +664,13 @@ class MatrixGroup(Matrix):
         ray = inputRay
         if ray != self._lastRayToBeTraced:
             rayTrace = [ray]
-            for element in self.elements:
-                rayTraceInElement = element.trace(ray)
-                rayTrace.extend(rayTraceInElement)
-                ray = rayTraceInElement[-1]  # last
+            if isinstance(ray, Ray):
+                ray = self.appendRayTrace(ray, rayTrace)
+            else:
+                for element in self.elements:
+                    rayTraceInElement = element.trace(ray)
+                    rayTrace.extend(rayTraceInElement)
+                    ray = rayTraceInElement[-1]  # last
             self._lastRayToBeTraced = inputRay
             self._lastRayTrace = rayTrace
         else:
@@ -441,6 +678,197 @@ class MatrixGroup(Matrix):
 
         return rayTrace
 
+    def appendRayTrace(self, ray, rayTrace):
+        """Traces a ray through the elements and appends the rays after each
+        element to the ray trace, as trace() does.  The elements that only
+        multiply the rays by their ABCD matrix are traced right here, with
+        the values of rayTraceSteps(), as Matrix.appendTrace() would: the
+        calls and the default attributes of Ray() take most of the time to
+        trace a single ray.
+
+        Parameters
+        ----------
+        ray : object of Ray class
+            A ray at height y and angle theta
+        rayTrace : list of Ray
+            The ray trace where the rays are appended
+
+        Returns
+        -------
+        outputRay : object of Ray class
+            The last ray appended, after the last element
+        """
+        newRay = Ray.__new__
+        append = rayTrace.append
+        for (element, isLinear, A, B, C, D, L, apertureDiameter, halfDiameter) in self.rayTraceSteps():
+            if not isLinear:
+                if type(element).trace is Matrix.trace:
+                    ray = element.appendTrace(ray, rayTrace)
+                else:
+                    rayTraceInElement = element.trace(ray)
+                    rayTrace.extend(rayTraceInElement)
+                    ray = rayTraceInElement[-1]  # last
+                continue
+
+            if L > 0:
+                if abs(ray.y) > apertureDiameter / 2:
+                    ray.isBlocked = True
+                append(ray)
+            if not ray.isBlocked:
+                y = ray.y
+                theta = ray.theta
+                outputRay = newRay(Ray)
+                outputRay.y = A * y + B * theta
+                outputRay.theta = C * y + D * theta
+                outputRay.z = L + ray.z
+                outputRay.isBlocked = abs(y) > halfDiameter
+                outputRay.apertureDiameter = apertureDiameter
+                outputRay.wavelength = None
+                ray = outputRay
+            append(ray)
+
+        return ray
+
+    def rayTraceSteps(self):
+        """ The elements with the values used by appendRayTrace(), as tuples
+        (element, isLinear, A, B, C, D, L, apertureDiameter, halfDiameter):
+        isLinear is True if the element only multiplies the rays by its ABCD
+        matrix. The values are kept until the group or its elements change
+        (see Matrix.invalidate()), as for compile().
+        """
+        if self._rayTraceSteps is None or self._rayTraceStepsVersion != self.version:
+            steps = []
+            for element in self.elements:
+                elementClass = type(element)
+                isLinear = elementClass.trace is Matrix.trace and elementClass.mul_ray is Matrix.mul_ray
+                steps.append((element, isLinear, element.A, element.B, element.C, element.D, element.L,
+                              element.apertureDiameter, abs(element.apertureDiameter / 2.0)))
+            self._rayTraceSteps = steps
+            self._rayTraceStepsVersion = self.version
+        return self._rayTraceSteps
+
+    def traceArraysThrough(self, y, theta, z=0.0, isBlocked=False):
+        """The same as traceThrough() for many rays at once: the arrays of rays
+        are traced through each element of the group in turn.
+
+        See Also
+        --------
+        raytracing.Matrix.traceArraysThrough
+        """
+        return self.compile().traceArraysThrough(y, theta, z, isBlocked)
+
+    def traceArrays(self, y, theta, z=0.0, isBlocked=False):
+        """The same as trace() for many rays at once: the checkpoints are the
+        input rays, followed by the checkpoints of each element in turn.
+
+        See Also
+        --------
+        raytracing.Matrix.traceArrays
+        raytracing.TraceArray
+        """
+        (y, theta, z, isBlocked) = self.asRayArrays(y, theta, z, isBlocked)
+
+        subclass = type(self)
+        if subclass.traceArrays is MatrixGroup.traceArrays and subclass.trace is not MatrixGroup.trace:
+            return self.traceArraysOneByOne(y, theta, z, isBlocked)
+
+        checkpoints = [(y, theta, z, isBlocked)]
+        for element in self.elements:
+            checkpoints.extend(element.traceArrays(*checkpoints[-1]))
+
+        return checkpoints
+
+    def beamCheckpoints(self, beams):
+        """The checkpoints of the gaussian beams, as in trace(): the input
+        beams, followed by the checkpoints of each element in turn.
+
+        See Also
+        --------
+        raytracing.Matrix.beamCheckpoints
+        raytracing.Matrix.traceBeams
+        """
+        subclass = type(self)
+        if subclass.beamCheckpoints is MatrixGroup.beamCheckpoints and subclass.trace is not MatrixGroup.trace:
+            return self.beamCheckpointsOneByOne(beams)
+
+        checkpoints = [beams]
+        for element in self.elements:
+            checkpoints.extend(element.beamCheckpoints(checkpoints[-1]))
+
+        return checkpoints
+
+    def compile(self):
+        """Returns an equivalent, flat execution plan of the group for tracing
+        many rays. Nested groups are replaced by their elements, and each run
+        of consecutive elements without apertures is fused into a single
+        transfer matrix. Only the elements with a finite aperture (which can
+        block rays) are kept as they are.
+
+        Returns
+        -------
+        compiledPath : CompiledPath
+            The plan, which traces rays exactly like the group does.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath()
+        >>> path.append(Space(d=10))
+        >>> path.append(Lens(f=10))
+        >>> path.append(Space(d=10))
+        >>> path.append(Lens(f=10, diameter=25))
+        >>> path.append(Space(d=10))
+        >>> print(len(path.compile().steps))
+        3
+
+        See Also
+        --------
+        raytracing.CompiledPath
+        raytracing.MatrixGroup.traceArraysThrough
+
+        Notes
+        -----
+        Elements with their own ray calculation (such as Axicon) cannot be
+        fused and are also kept as they are.
+
+        The plan is kept until the group or its elements change (see
+        Matrix.invalidate()), so the same plan is returned by successive calls.
+        """
+        if self._compiledPath is None or self._compiledVersion != self.version:
+            self._compiledPath = self.compileSteps()
+            self._compiledVersion = self.version
+        return self._compiledPath
+
+    def compileSteps(self):
+        """ Builds the plan returned by compile() """
+        steps = []
+        elementsToFuse = []
+        for element in self.flattenedElements():
+            if CompiledPath.canBeFused(element):
+                elementsToFuse.append(element)
+            else:
+                if len(elementsToFuse) != 0:
+                    steps.append(CompiledPath.fusedMatrix(elementsToFuse))
+                    elementsToFuse = []
+                steps.append(element)
+
+        if len(elementsToFuse) != 0:
+            steps.append(CompiledPath.fusedMatrix(elementsToFuse))
+
+        return CompiledPath(steps, label=self.label)
+
+    def flattenedElements(self):
+        """ All the elements of the group, with the elements of nested groups
+        in place of the groups themselves. Groups that trace rays in their own
+        way are not flattened. """
+        elements = []
+        for element in self.elements:
+            if isinstance(element, MatrixGroup) and CompiledPath.canBeFlattened(element):
+                elements.extend(element.flattenedElements())
+            else:
+                elements.append(element)
+        return elements
+
     def hasFiniteApertureDiameter(self):
         """ True if ImagingPath has at least one element of finite diameter """
         for element in self.elements:
@@ -472,6 +900,7 @@ class MatrixGroup(Matrix):
         allElements = self.elements
         allElements.reverse()
         self.elements = []
+        self.clearPrefixMatrices()
 
         for element in allElements:
             element.flipOrientation()
@@ -552,3 +981,138 @@ class MatrixGroup(Matrix):
                 self.elements = []
                 for element in loadedMatrices:
                     self.append(element)
+
+
+class CompiledPath(Matrix):
+    """A flat execution plan equivalent to a MatrixGroup, obtained with
+    MatrixGroup.compile().  The plan is a list of steps: matrices fused from
+    consecutive elements without apertures, and the elements that can block
+    rays.  Tracing through the plan gives the same rays as tracing through the
+    group, with far fewer multiplications per ray.
+
+    Parameters
+    ----------
+    steps : list of Matrix
+        The steps of the plan, in order.
+    label : string
+        the label of the plan (Optional)
+
+    See Also
+    --------
+    raytracing.MatrixGroup.compile
+    """
+
+    def __init__(self, steps, label=""):
+        super(CompiledPath, self).__init__(1, 0, 0, 1, label=label)
+        self.steps = list(steps)
+
+        if len(self.steps) != 0 and all([self.isLinear(step) for step in self.steps]):
+            transferMatrix = self.fusedMatrix(self.steps)
+            self.A = transferMatrix.A
+            self.B = transferMatrix.B
+            self.C = transferMatrix.C
+            self.D = transferMatrix.D
+            self.frontIndex = transferMatrix.frontIndex
+            self.backIndex = transferMatrix.backIndex
+        self.L = sum([step.L for step in self.steps])
+
+    @staticmethod
+    def canBeFlattened(group):
+        """ True if the elements of the group can be traced in place of the group """
+        groupClass = type(group)
+        return (groupClass.trace is MatrixGroup.trace
+                and groupClass.traceArraysThrough is MatrixGroup.traceArraysThrough)
+
+    @staticmethod
+    def isLinear(element):
+        """ True if the element only multiplies rays by its ABCD matrix """
+        if isinstance(element, MatrixGroup):
+            return False
+
+        elementClass = type(element)
+        return (elementClass.mul_ray is Matrix.mul_ray
+                and elementClass.trace is Matrix.trace
+                and elementClass.traceArraysThrough is Matrix.traceArraysThrough)
+
+    @staticmethod
+    def canBeFused(element):
+        """ True if the element never blocks a ray and only multiplies rays by
+        its ABCD matrix, so it can be combined with its neighbours """
+        return CompiledPath.isLinear(element) and not element.hasFiniteApertureDiameter()
+
+    @staticmethod
+    def fusedMatrix(elements):
+        """ The product of the ABCD matrices of the elements, in order. A single
+        element is returned as is. """
+        if len(elements) == 1:
+            return elements[0]
+
+        A, B, C, D, L = 1.0, 0.0, 0.0, 1.0, 0.0
+        for element in elements:
+            (A, B, C, D) = (element.A * A + element.B * C, element.A * B + element.B * D,
+                            element.C * A + element.D * C, element.C * B + element.D * D)
+            L += element.L
+
+        # Fusing never fails: the indices of the elements are not required to
+        # be consistent, as for nested groups.
+        fused = Matrix(physicalLength=L, label="Fused")
+        (fused.A, fused.B, fused.C, fused.D) = (A, B, C, D)
+        fused.frontIndex = elements[0].frontIndex
+        fused.backIndex = elements[-1].backIndex
+        return fused
+
+    def compile(self):
+        return self
+
+    def trace(self, inputRay):
+        """Trace the input ray through each step of the plan.
+
+        Returns
+        -------
+        rayTrace : List of Ray
+            A ray trace starting with inputRay, followed by the ray after each step.
+
+        See Also
+        --------
+        raytracing.MatrixGroup.trace
+        """
+        if not isinstance(inputRay, Ray):
+            raise TypeError("'inputRay' must be a Ray {0}".format(inputRay))
+
+        ray = inputRay
+        rayTrace = [ray]
+        for step in self.steps:
+            if type(step).trace is Matrix.trace:
+                ray = step.appendTrace(ray, rayTrace)
+            else:
+                rayTraceInStep = step.trace(ray)
+                rayTrace.extend(rayTraceInStep)
+                ray = rayTraceInStep[-1]
+
+        return rayTrace
+
+    def traceArraysThrough(self, y, theta, z=0.0, isBlocked=False):
+        """The same as traceThrough() for many rays at once, step by step.
+
+        See Also
+        --------
+        raytracing.Matrix.traceArraysThrough
+        """
+        (y, theta, z, isBlocked) = self.asRayArrays(y, theta, z, isBlocked)
+        for step in self.steps:
+            (y, theta, z, isBlocked) = step.traceArraysThrough(y, theta, z, isBlocked)
+
+        return (y, theta, z, isBlocked)
+
+    def traceArrays(self, y, theta, z=0.0, isBlocked=False):
+        """The same as trace() for many rays at once, step by step.
+
+        See Also
+        --------
+        raytracing.Matrix.traceArrays
+        """
+        checkpoints = [self.asRayArrays(y, theta, z, isBlocked)]
+        for step in self.steps:
+            checkpoints.extend(step.traceArrays(*checkpoints[-1]))
+
+        return checkpoints
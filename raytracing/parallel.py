@@ -0,0 +1,451 @@
+from .rays import *
+
+import numpy as np
+import multiprocessing
+import hashlib
+import pickle
+import copy
+import os
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # pragma: no cover
+    # Python < 3.8
+    shared_memory = None
+
+
+class SharedRayArrays:
+    """The heights, angles, positions and blocked status of many rays, stored
+    in a block of shared memory that other processes can open by name.  This
+    allows tracing rays in parallel without sending them to each process:
+    each process traces a range of rays and writes the result in place.
+
+    Parameters
+    ----------
+    count : int
+        The number of rays
+    name : str
+        The name of an existing block of shared memory to open (Optional).
+        If None, a new block is created.
+
+    Examples
+    --------
+    >>> from raytracing import *
+    >>> shared = SharedRayArrays(3)
+    >>> shared.y[:] = [1, 2, 3]
+    >>> other = SharedRayArrays(3, name=shared.name)
+    >>> print(other.y)
+    [1. 2. 3.]
+    >>> other.close()
+    >>> shared.close()
+    >>> shared.unlink()
+
+    Notes
+    -----
+    This requires Python 3.8 or later (multiprocessing.shared_memory).
+    """
+
+    def __init__(self, count, name=None):
+        if shared_memory is None:  # pragma: no cover
+            raise RuntimeError("Shared memory requires Python 3.8 or later.")
+
+        self.count = count
+        size = max(self.sizeFor(count), 1)
+        if name is None:
+            self.sharedMemory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.sharedMemory = shared_memory.SharedMemory(name=name)
+
+        buffer = self.sharedMemory.buf
+        self.y = np.ndarray(count, dtype=float, buffer=buffer, offset=0)
+        self.theta = np.ndarray(count, dtype=float, buffer=buffer, offset=8 * count)
+        self.z = np.ndarray(count, dtype=float, buffer=buffer, offset=16 * count)
+        self.isBlocked = np.ndarray(count, dtype=bool, buffer=buffer, offset=24 * count)
+
+    @staticmethod
+    def sizeFor(count):
+        """ The number of bytes needed for `count` rays """
+        return 25 * count
+
+    @property
+    def name(self):
+        return self.sharedMemory.name
+
+    def arrays(self, start=0, stop=None):
+        """ The arrays (y, theta, z, isBlocked) for the rays in the range [start, stop) """
+        if stop is None:
+            stop = self.count
+        return (self.y[start:stop], self.theta[start:stop], self.z[start:stop], self.isBlocked[start:stop])
+
+    def close(self):
+        """ Closes the access to the shared memory from this object. """
+        # The arrays refer to the memory and must be released first
+        self.y = self.theta = self.z = self.isBlocked = None
+        self.sharedMemory.close()
+
+    def unlink(self):
+        """ Destroys the shared memory, once all processes have closed it. """
+        self.sharedMemory.unlink()
+
+
+def traceSharedRaysThrough(path, name, count, start, stop, progress=True):
+    """ Traces the rays [start, stop) of the shared ray arrays through the
+    path, and replaces them with the output rays. This is the function
+    called in each process by Matrix.traceManyThroughInParallel().
+
+    Parameters
+    ----------
+    path : Matrix
+        The element or the compiled path to trace through
+    name : str
+        The name of the shared memory with the rays (see SharedRayArrays)
+    count : int
+        The total number of rays in the shared memory
+    start, stop : int
+        The range of rays to trace
+    progress : bool
+        If True, the progress is shown for this range of rays (default=True)
+    """
+    shared = SharedRayArrays(count, name=name)
+    try:
+        (y, theta, z, isBlocked) = shared.arrays(start, stop)
+        rays = Rays()
+        rays.appendArrays(y, theta, z, isBlocked)
+        (y[:], theta[:], z[:], isBlocked[:]) = path.traceRayArraysThrough(rays, progress=progress)
+        del y, theta, z, isBlocked
+    finally:
+        shared.close()
+
+
+# The compiled paths already received by this worker process, by fingerprint
+workerPaths = {}
+
+
+def cachedWorkerPath(fingerprint, pathData=None):
+    """ The path with this fingerprint, if this process already received it.
+    The pickled path is only sent with a task when the process may not have
+    it yet: it is then unpickled and kept. Without the pickled path, None is
+    returned if the path is unknown, and the task is sent again with it. """
+    path = workerPaths.get(fingerprint)
+    if path is None and pathData is not None:
+        if len(workerPaths) >= TracingPool.maxCachedPaths:
+            workerPaths.clear()
+        path = pickle.loads(pathData)
+        workerPaths[fingerprint] = path
+
+    return path
+
+
+def traceSharedRaysThroughCachedPath(fingerprint, pathData, name, count, start, stop, progress=True):
+    """ Same as traceSharedRaysThrough(), but the path is identified by its
+    fingerprint (see cachedWorkerPath()). Returns True once the rays are
+    traced, or None if this process does not have the path.
+    """
+    path = cachedWorkerPath(fingerprint, pathData)
+    if path is None:
+        return None
+
+    traceSharedRaysThrough(path, name, count, start, stop, progress)
+    return True
+
+
+def traceFileThroughCachedPath(fingerprint, pathData, inputFilePath, outputFilePath, detector, chunkSize, start,
+                               stop):
+    """ Traces the rays [start, stop) of a ray file with
+    Matrix.traceFileThrough(). This is the function called in each process
+    by TracingPool.traceFileThrough(). The detector, if any, is returned
+    with the output rays of this range only. The path is identified by its
+    fingerprint, and None is returned if this process does not have it (see
+    cachedWorkerPath()).
+    """
+    path = cachedWorkerPath(fingerprint, pathData)
+    if path is None:
+        return None
+
+    outputCount = path.traceFileThrough(inputFilePath, outputFilePath, detector=detector, chunkSize=chunkSize,
+                                        start=start, stop=stop)
+    return (outputCount, detector)
+
+
+class TracingPool:
+    """A pool of processes that stays alive to trace rays in parallel many
+    times: the processes are started once, and each compiled path is
+    pickled once, sent once to the processes and kept by them, identified
+    by its fingerprint. The following tasks with the same path only send
+    the fingerprint.  Use it as a context manager and give it to any tracing
+    function with `pool=`.
+
+    Parameters
+    ----------
+    processes : int
+        The number of processes (default=None, the number of CPUs)
+
+    Examples
+    --------
+    >>> from raytracing import *
+    >>> with TracingPool(processes=2) as pool:
+    ...     for f in [5, 10, 20]:
+    ...         path = ImagingPath([Space(d=10), Lens(f=f, diameter=10), Space(d=f)])
+    ...         outputRays = path.traceManyThrough(UniformRays(M=10, N=10), progress=False, pool=pool)
+
+    See Also
+    --------
+    raytracing.Matrix.traceManyThrough
+    raytracing.Matrix.traceManyThroughInParallel
+    raytracing.Matrix.traceFileThrough
+    raytracing.Matrix.detectManyThrough
+    raytracing.Matrix.estimateTransmission
+
+    Notes
+    -----
+    Matrix.traceMany() does not take a pool: it returns the ray after
+    every element for each ray, which would all be sent back from the
+    processes, and the traces as lists of Ray are built in this process
+    anyway.
+    """
+
+    maxCachedPaths = 32
+
+    def __init__(self, processes=None):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.pool = None
+        # The pickled compiled paths, by path and version (see pickledPath())
+        self.pickledPaths = {}
+        # The fingerprints of the paths already sent to the processes
+        self.sentFingerprints = set()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        """ Starts the processes, if they are not running already. """
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(processes=self.processes)
+            self.sentFingerprints = set()
+
+    def close(self):
+        """ Stops the processes. """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    @staticmethod
+    def fingerprint(pathData):
+        """ The fingerprint identifying a pickled path """
+        return hashlib.sha1(pathData).hexdigest()
+
+    def pickledPath(self, path):
+        """ The fingerprint and the pickled data of the compiled path. For a
+        group, they are kept until the version of the group changes, so the
+        path is only pickled and hashed once.
+
+        Parameters
+        ----------
+        path : Matrix
+            The element or group of elements to trace through
+
+        Returns
+        -------
+        (fingerprint, pathData) : tuple
+            The fingerprint and the pickled compiled path
+        """
+        compiledPath = path.compile()
+        version = getattr(path, 'version', None)
+        if version is None:
+            pathData = pickle.dumps(compiledPath)
+            return (self.fingerprint(pathData), pathData)
+
+        entry = self.pickledPaths.get(id(path))
+        if entry is None or entry[0] is not path or entry[1] != version:
+            if len(self.pickledPaths) >= self.maxCachedPaths:
+                self.pickledPaths.clear()
+            pathData = pickle.dumps(compiledPath)
+            entry = (path, version, self.fingerprint(pathData), pathData)
+            self.pickledPaths[id(path)] = entry
+
+        (path, version, fingerprint, pathData) = entry
+        return (fingerprint, pathData)
+
+    def mapWithPath(self, function, fingerprint, pathData, tasks):
+        """ Calls function(fingerprint, pathData, *task) in the processes for
+        each task. The pickled path is only sent if the processes may not
+        have it yet: otherwise it is None, and the tasks for which the process
+        did not have the path (the function returned None) are sent again
+        with it.
+
+        Returns
+        -------
+        results : list
+            The result of the function for each task
+        """
+        isSent = fingerprint in self.sentFingerprints
+        results = self.pool.starmap(function, [(fingerprint, None if isSent else pathData) + tuple(task)
+                                               for task in tasks])
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if len(missing) != 0:
+            retried = self.pool.starmap(function, [(fingerprint, pathData) + tuple(tasks[i]) for i in missing])
+            for i, result in zip(missing, retried):
+                results[i] = result
+
+        if len(self.sentFingerprints) >= self.maxCachedPaths:
+            self.sentFingerprints.clear()
+        self.sentFingerprints.add(fingerprint)
+        return results
+
+    def traceManyThrough(self, path, inputRays, progress=True):
+        """Traces the rays through the path, like path.traceManyThrough(),
+        with the processes of the pool.  The rays are placed in shared memory
+        and each process traces a range of rays in place.
+
+        Parameters
+        ----------
+        path : Matrix
+            The element or group of elements to trace through
+        inputRays : Rays
+            The rays to trace
+        progress : bool
+            If True, the progress is shown by each process (default=True)
+
+        Returns
+        -------
+        outputRays : Rays
+            The rays that were not blocked, in the same order as the input rays.
+        """
+        if not isinstance(inputRays, Rays):
+            inputRays = Rays(inputRays)
+
+        (y, theta, z, isBlocked) = self.traceArraysThrough(path, *inputRays.rayArrays(), progress=progress)
+
+        isNotBlocked = ~isBlocked
+        weights = None
+        if inputRays.isWeighted:
+            weights = inputRays.weights[isNotBlocked]
+
+        outputRays = Rays()
+        outputRays.appendArrays(y[isNotBlocked], theta[isNotBlocked], z[isNotBlocked], weights=weights)
+        return outputRays
+
+    def traceArraysThrough(self, path, y, theta, z, isBlocked, progress=False):
+        """Traces the arrays of rays through the path, like
+        path.traceArraysThrough(), with the processes of the pool.  The rays
+        are placed in shared memory and each process traces a range of rays
+        in place.
+
+        Parameters
+        ----------
+        path : Matrix
+            The element or group of elements to trace through
+        y, theta, z, isBlocked : arrays
+            The input rays, as given by Rays.rayArrays()
+        progress : bool
+            If True, the progress is shown by each process (default=False)
+
+        Returns
+        -------
+        (y, theta, z, isBlocked) : tuple of arrays
+            The output rays, including the blocked ones, in the same order
+            as the input rays.
+        """
+        nRays = len(y)
+        if nRays == 0:
+            return (np.empty(0), np.empty(0), np.empty(0), np.empty(0, dtype=bool))
+
+        self.start()
+        (fingerprint, pathData) = self.pickledPath(path)
+
+        shared = SharedRayArrays(nRays)
+        try:
+            (shared.y[:], shared.theta[:], shared.z[:], shared.isBlocked[:]) = (y, theta, z, isBlocked)
+
+            bounds = [nRays * i // self.processes for i in range(self.processes + 1)]
+            ranges = [(shared.name, nRays, bounds[i], bounds[i + 1], progress) for i in range(self.processes)]
+            self.mapWithPath(traceSharedRaysThroughCachedPath, fingerprint, pathData, ranges)
+
+            outputRays = (shared.y.copy(), shared.theta.copy(), shared.z.copy(), shared.isBlocked.copy())
+        finally:
+            shared.close()
+            shared.unlink()
+
+        return outputRays
+
+    def traceFileThrough(self, path, inputFilePath, outputFilePath=None, detector=None, chunkSize=100000, start=0,
+                         stop=None):
+        """Traces the rays of a ray file through the path, like
+        path.traceFileThrough(), with the processes of the pool.  Each process
+        reads its own range of rays of the same file, and writes its output
+        rays to its own part of the output file. The parts are then
+        put together, and the detectors of all processes are merged.
+
+        Parameters
+        ----------
+        path : Matrix
+            The element or group of elements to trace through
+        inputFilePath : str or PathLike
+            The file of the input rays (see RayFile)
+        outputFilePath : str or PathLike
+            The file where the output rays are written (Optional)
+        detector : Detector
+            The detector that receives the output rays (Optional)
+        chunkSize : int
+            The number of rays traced at once by each process (default=100000)
+        start, stop : int
+            The range of rays of the input file to trace (default: all the rays)
+
+        Returns
+        -------
+        outputCount : int
+            The number of rays that were not blocked
+        """
+        inputFile = RayFile(inputFilePath)
+        if stop is None or stop > inputFile.count:
+            stop = inputFile.count
+        start = min(max(start, 0), stop)
+
+        self.start()
+        (fingerprint, pathData) = self.pickledPath(path)
+
+        workerDetector = None
+        if detector is not None:
+            workerDetector = copy.deepcopy(detector)
+            workerDetector.clear()
+
+        partFilePaths = [None] * self.processes
+        if outputFilePath is not None:
+            partFilePaths = ["{0}.part{1}".format(outputFilePath, i) for i in range(self.processes)]
+
+        bounds = [start + (stop - start) * i // self.processes for i in range(self.processes + 1)]
+        ranges = [(inputFilePath, partFilePaths[i], workerDetector, chunkSize, bounds[i], bounds[i + 1])
+                  for i in range(self.processes)]
+        results = self.mapWithPath(traceFileThroughCachedPath, fingerprint, pathData, ranges)
+
+        outputCount = sum([count for (count, partDetector) in results])
+        if detector is not None:
+            for (count, partDetector) in results:
+                detector.merge(partDetector)
+
+        if outputFilePath is not None:
+            try:
+                partFiles = [RayFile(partFilePath) for partFilePath in partFilePaths]
+                columns = {name: (RayFile.descriptionToDtype(description['dtype']), tuple(description['shape']))
+                           for name, description in partFiles[0].columns.items()}
+                outputFile = RayFile.create(outputFilePath, 'rays', columns, capacity=outputCount)
+                for partFile in partFiles:
+                    partColumns = {name: partFile.column(name) for name in partFile.columnNames}
+                    for chunkStart in range(0, partFile.count, chunkSize):
+                        outputFile.append({name: np.array(values[chunkStart:chunkStart + chunkSize])
+                                           for name, values in partColumns.items()})
+                    del partColumns
+            finally:
+                for partFilePath in partFilePaths:
+                    if os.path.exists(partFilePath):
+                        os.remove(partFilePath)
+
+        return outputCount
@@ -0,0 +1,148 @@
+import numpy as np
+
+
+class QuasiRandomSequence:
+    """A two-dimensional low-discrepancy (quasi-random) sequence of points
+    in the unit square [0, 1) x [0, 1).  The points fill the square much
+    more evenly than random points: an average over N points converges
+    almost as 1/N instead of 1/sqrt(N).  Point i only depends on i, so any
+    range of points can be computed on its own, in any order.
+
+    With scrambling, the digits of the points are randomly permuted (a
+    random digital shift for Sobol): every point is then uniformly
+    distributed, averages are unbiased and independent scramblings give an
+    estimate of their error, while the points keep their low discrepancy.
+
+    Parameters
+    ----------
+    kind : str
+        'sobol' (default) or 'halton' (bases 2 and 3)
+    scramble : bool
+        If True (default), the digits are randomly scrambled
+    seed : int, SeedSequence or Generator
+        The seed of the scrambling (default=None, a new random seed)
+
+    Examples
+    --------
+    >>> from raytracing import *
+    >>> sequence = QuasiRandomSequence(kind='sobol', scramble=False)
+    >>> (u, v) = sequence.points(0, 4)
+    >>> print(u, v)
+    [0.   0.5  0.75 0.25] [0.   0.5  0.25 0.75]
+    >>> (u, v) = QuasiRandomSequence(kind='halton', scramble=False).points(1, 4)
+    >>> print(u, v)
+    [0.5  0.25 0.75] [0.33333333 0.66666667 0.11111111]
+
+    Notes
+    -----
+    The Sobol sequence is in Gray code order, and its first 2^m points are
+    a (0, m, 2)-net: every dyadic box of area 2^-m contains exactly one point.
+    """
+
+    kinds = ('sobol', 'halton')
+    bits = 32
+
+    def __init__(self, kind='sobol', scramble=True, seed=None):
+        kind = kind.lower()
+        if kind not in self.kinds:
+            raise ValueError(f"The sequence must be one of {self.kinds}, not '{kind}'.")
+
+        self.kind = kind
+        self.scramble = scramble
+        self.shift = None
+        self.permutations = None
+        if scramble:
+            if isinstance(seed, np.random.Generator):
+                generator = seed
+            else:
+                generator = np.random.default_rng(seed)
+
+            if kind == 'sobol':
+                self.shift = generator.integers(0, 2 ** self.bits, size=2, dtype=np.uint64)
+            else:
+                self.permutations = [np.array([generator.permutation(base) for j in range(self.digitCount(base))])
+                                     for base in (2, 3)]
+
+    def points(self, start, stop):
+        """ The points [start, stop) of the sequence.
+
+        Parameters
+        ----------
+        start, stop : int
+            The range of points
+
+        Returns
+        -------
+        (u, v) : tuple of arrays
+            The two coordinates of the points, from 0 to 1
+        """
+        indices = np.arange(start, max(start, stop), dtype=np.uint64)
+        if self.kind == 'sobol':
+            return self.sobolPoints(indices)
+
+        if self.permutations is None:
+            return (self.radicalInverse(indices, 2), self.radicalInverse(indices, 3))
+        return (self.radicalInverse(indices, 2, self.permutations[0]),
+                self.radicalInverse(indices, 3, self.permutations[1]))
+
+    @classmethod
+    def sobolDirections(cls):
+        """ The direction numbers of the two dimensions of the Sobol
+        sequence, as integers of `bits` bits: the first dimension is the
+        van der Corput sequence, the second one has the primitive polynomial
+        x + 1 (m_k = m_k-1 XOR 2 m_k-1, with m_1 = 1). """
+        directions = np.zeros((2, cls.bits), dtype=np.uint64)
+        m = 1
+        for k in range(cls.bits):
+            directions[0, k] = 1 << (cls.bits - 1 - k)
+            directions[1, k] = m << (cls.bits - 1 - k)
+            m = m ^ (m << 1)
+        return directions
+
+    def sobolPoints(self, indices):
+        """ The points of the Sobol sequence at these indices """
+        if np.any(indices >= 2 ** self.bits):
+            raise ValueError(f"The Sobol sequence is limited to 2^{self.bits} points.")
+
+        directions = self.sobolDirections()
+        grayCode = indices ^ (indices >> np.uint64(1))
+        values = np.zeros((2, len(indices)), dtype=np.uint64)
+        for k in range(self.bits):
+            hasBit = ((grayCode >> np.uint64(k)) & np.uint64(1)).astype(bool)
+            if not np.any(hasBit):
+                continue
+            values[:, hasBit] ^= directions[:, k:k + 1]
+
+        if self.shift is not None:
+            values ^= self.shift[:, np.newaxis]
+
+        scale = 2.0 ** -self.bits
+        return (values[0] * scale, values[1] * scale)
+
+    @staticmethod
+    def digitCount(base):
+        """ The number of digits needed for the precision of a float """
+        return int(np.ceil(53 / np.log2(base)))
+
+    @classmethod
+    def radicalInverse(cls, indices, base, permutations=None):
+        """ The radical inverse of the indices: their digits in the base,
+        mirrored after the decimal point (the van der Corput sequence).
+        With permutations, the digit j is replaced by permutations[j][digit],
+        including the zeros after the last digit. """
+        indices = np.array(indices, dtype=np.uint64)
+        values = np.zeros(len(indices))
+        digitCount = cls.digitCount(base)
+        factor = 1.0 / base
+        for j in range(digitCount):
+            digits = indices % np.uint64(base)
+            if permutations is not None:
+                digits = permutations[j][digits]
+            elif not np.any(indices):
+                break
+            values += digits * factor
+            indices = indices // np.uint64(base)
+            factor /= base
+
+        # Rounding could give exactly 1 with scrambled digits
+        return np.minimum(values, 1 - 2 ** -53)
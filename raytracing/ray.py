@@ -20,15 +20,19 @@ class Ray:
         Initial height of the ray. (Default=0)
     theta : float
         Initial angle of the ray. (Default=0)
-
-    Attributes
-    ----------
     z : float
-        Position of the ray along the optical axis. Initialized at 0.
-    apertureDiameter : float
-        The diameter of any blocking aperture at the present position z. Initialized at +Inf.
+        Position of the ray along the optical axis. (Default=0)
     isBlocked : bool
-        Whether or not the ray was blocked by an aperture. Initialized to False.
+        Whether or not the ray was blocked by an aperture. (Default=False)
+    wavelength : float
+        The wavelength of the ray. (Default=None)
+    apertureDiameter : float
+        The diameter of any blocking aperture at the present position z. (Default=+Inf)
+
+    Notes
+    -----
+    A Ray has a fixed set of attributes (__slots__), which makes it
+    smaller and faster to create: other attributes cannot be added.
 
     See Also
     --------
@@ -36,16 +40,38 @@ class Ray:
 
     """
 
-    def __init__(self, y: float = 0, theta: float = 0, z: float = 0, isBlocked:bool = False, wavelength: float = None):
+    __slots__ = ('y', 'theta', 'z', 'isBlocked', 'apertureDiameter', 'wavelength')
+
+    def __init__(self, y: float = 0, theta: float = 0, z: float = 0, isBlocked:bool = False, wavelength: float = None,
+                 apertureDiameter: float = float("+Inf")):
         self.y = y
         self.theta = theta
 
         self.z = z
         self.isBlocked = isBlocked
-        self.apertureDiameter = float("+Inf")
+        self.apertureDiameter = apertureDiameter
 
         self.wavelength = wavelength
 
+    def __getstate__(self):
+        """ The attributes of the ray, as a dict: the same state as the rays
+        pickled before Ray had __slots__, so that they can be read by any
+        version. """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        """ Restores a pickled ray. The state is a dict of attributes for
+        the rays pickled before Ray had __slots__ (and after, see
+        __getstate__()), or (None, dict) for the default state of __slots__.
+        """
+        if isinstance(state, tuple):
+            (dictState, slotsState) = state
+            state = dict(dictState or {}, **(slotsState or {}))
+
+        Ray.__init__(self)
+        for name, value in state.items():
+            setattr(self, name, value)
+
     @property
     def isNotBlocked(self) -> bool:
         """Opposite of isBlocked. Convenience function for readability.
@@ -229,6 +255,7 @@ class Ray:
         See Also
         --------
         raytracing.Ray.at()
+        raytracing.TraceArray.sampleAt()
 
         """
         closestRay = rayTrace[0]
@@ -0,0 +1,266 @@
+import numpy as np
+import json
+import os
+
+
+class RayFile:
+    """A binary file of rays (or ray traces), stored in columns: one array
+    for each property of the rays.  The file starts with a small header
+    (the format version, the kind of data, the number of rays and the
+    description of each column), followed by the columns, each of them
+    aligned on a page.  The columns are read with numpy.memmap(): opening
+    a file takes the same time whatever the number of rays, and only the
+    parts of the file that are used are actually read from the disk.
+
+    This is the format used by Rays.save() and TraceArray.save().
+
+    Parameters
+    ----------
+    filePath : str or PathLike
+        The path of the file
+
+    Examples
+    --------
+    >>> import os, tempfile
+    >>> from raytracing import *
+    >>> filePath = os.path.join(tempfile.mkdtemp(), "rays.dat")
+    >>> UniformRays(yMax=1, M=3, N=2).save(filePath)
+    >>> rayFile = RayFile(filePath)
+    >>> print(rayFile.kind, rayFile.count, rayFile.columnNames)
+    rays 6 ['y', 'theta', 'z', 'isBlocked']
+    >>> print(rayFile.column('y'))
+    [-1. -1.  0.  0.  1.  1.]
+    """
+
+    magic = b"\x93RAYFILE"
+    version = 1
+    alignment = 4096
+
+    def __init__(self, filePath):
+        self.filePath = filePath
+        header = self.readHeader(filePath)
+        if header is None:
+            raise IOError(f"{filePath} is not a ray file.")
+
+        self.fileVersion = header['version']
+        if self.fileVersion > self.version:
+            raise IOError(f"{filePath} was saved with a more recent version of the format "
+                          f"({self.fileVersion}), it cannot be read.")
+        self.kind = header['kind']
+        self.count = header['count']
+        self.capacity = header.get('capacity', self.count)
+        self.columns = header['columns']
+
+    @property
+    def columnNames(self):
+        """ The names of the columns, in the order they are stored """
+        return list(self.columns.keys())
+
+    def column(self, name, mode='r'):
+        """ The array of a column, mapped in memory.
+
+        Parameters
+        ----------
+        name : str
+            The name of the column
+        mode : str
+            The mode of numpy.memmap(): 'r' to read only, 'c' to allow
+            modifications that are not written to the file, 'r+' to modify
+            the file (default='r')
+
+        Returns
+        -------
+        values : numpy.memmap or array
+            The values of the column, its first dimension is the number of rays.
+        """
+        if name not in self.columns:
+            raise KeyError(f"{self.filePath} has no column '{name}'.")
+
+        description = self.columns[name]
+        dtype = self.descriptionToDtype(description['dtype'])
+        shape = (self.count,) + tuple(description['shape'])
+        if self.count == 0 or dtype.itemsize == 0 or 0 in shape:
+            return np.zeros(shape, dtype=dtype)
+
+        return np.memmap(self.filePath, dtype=dtype, mode=mode, offset=description['offset'], shape=shape)
+
+    @classmethod
+    def isRayFile(cls, filePath):
+        """ True if the file starts like a ray file """
+        with open(filePath, 'rb') as infile:
+            return infile.read(len(cls.magic)) == cls.magic
+
+    @classmethod
+    def readHeader(cls, filePath):
+        """ The header of the file as a dictionary, or None if the file is
+        not a ray file. """
+        with open(filePath, 'rb') as infile:
+            if infile.read(len(cls.magic)) != cls.magic:
+                return None
+            headerLength = int(np.frombuffer(infile.read(4), dtype='<u4')[0])
+            return json.loads(infile.read(headerLength).decode('utf-8'))
+
+    @classmethod
+    def create(cls, filePath, kind, columns, capacity):
+        """ Creates an empty ray file, with room for `capacity` rays that
+        are written later with append().  The space of the columns is
+        reserved but, on most file systems, does not use the disk until
+        the rays are written.
+
+        Parameters
+        ----------
+        filePath : str or PathLike
+            The path of the file
+        kind : str
+            The kind of data, for instance 'rays' or 'traces'
+        columns : dict of (dtype, shape)
+            The dtype of each column, by name, and the shape of the values
+            of one ray (an empty tuple for a single value)
+        capacity : int
+            The maximum number of rays in the file
+
+        Returns
+        -------
+        rayFile : RayFile
+            The empty file
+        """
+        # The header is written first to know where the columns start. It
+        # is large enough to be written again, with any count, in place.
+        descriptions = {}
+        headerSize = 0
+        while True:
+            offset = headerSize
+            for name, (dtype, shape) in columns.items():
+                dtype = np.dtype(dtype)
+                descriptions[name] = {'dtype': cls.dtypeToDescription(dtype), 'shape': list(shape),
+                                      'offset': offset}
+                offset += cls.aligned(capacity * int(np.prod(shape, dtype=int)) * dtype.itemsize)
+            header = cls.encodeHeader(kind, capacity, capacity, descriptions)
+            size = cls.aligned(len(cls.magic) + 4 + len(header))
+            if size <= headerSize:
+                break
+            headerSize = size
+
+        with open(filePath, 'wb') as outfile:
+            outfile.truncate(offset)
+
+        rayFile = cls.__new__(cls)
+        rayFile.filePath = filePath
+        rayFile.fileVersion = cls.version
+        rayFile.kind = kind
+        rayFile.count = 0
+        rayFile.capacity = capacity
+        rayFile.columns = descriptions
+        rayFile.writeHeader()
+        return rayFile
+
+    @classmethod
+    def save(cls, filePath, kind, arrays):
+        """ Writes arrays to a ray file, as columns. All the arrays must have
+        the same length (the number of rays).  The file is written under
+        another name, then renamed: an existing file at the same path can
+        still be mapped in memory (for instance, the arrays themselves,
+        loaded from it) and is never truncated while it is read.
+
+        Parameters
+        ----------
+        filePath : str or PathLike
+            The path of the file
+        kind : str
+            The kind of data, for instance 'rays' or 'traces'
+        arrays : dict of arrays
+            The arrays, by name
+
+        Returns
+        -------
+        rayFile : RayFile
+            The file that was written
+        """
+        arrays = {name: np.asarray(values) for name, values in arrays.items()}
+        counts = set([len(values) for values in arrays.values()])
+        if len(counts) > 1:
+            raise ValueError("All the columns must have the same length.")
+        count = counts.pop() if len(counts) == 1 else 0
+
+        columns = {name: (values.dtype, values.shape[1:]) for name, values in arrays.items()}
+        temporaryPath = "{0}.{1}.tmp".format(os.fspath(filePath), os.getpid())
+        try:
+            rayFile = cls.create(temporaryPath, kind, columns, capacity=count)
+            rayFile.append(arrays)
+            os.replace(temporaryPath, filePath)
+        finally:
+            if os.path.exists(temporaryPath):
+                os.remove(temporaryPath)
+
+        rayFile.filePath = filePath
+        return rayFile
+
+    def append(self, arrays):
+        """ Writes rays after the rays already in the file, and updates
+        the number of rays in the header.
+
+        Parameters
+        ----------
+        arrays : dict of arrays
+            The values of the new rays, for every column of the file
+        """
+        if set(arrays.keys()) != set(self.columns.keys()):
+            raise ValueError("The values of all the columns, and only them, must be given.")
+        if len(arrays) == 0:
+            return
+
+        count = len(next(iter(arrays.values())))
+        if any([len(values) != count for values in arrays.values()]):
+            raise ValueError("All the columns must have the same length.")
+        if self.count + count > self.capacity:
+            raise ValueError(f"The file can only hold {self.capacity} rays.")
+        if count == 0:
+            return
+
+        with open(self.filePath, 'r+b') as outfile:
+            for name, values in arrays.items():
+                description = self.columns[name]
+                dtype = self.descriptionToDtype(description['dtype'])
+                values = np.ascontiguousarray(values, dtype=dtype)
+                if values.shape[1:] != tuple(description['shape']):
+                    raise ValueError(f"The values of '{name}' do not have the shape of the column.")
+                outfile.seek(description['offset'] + self.count * values[0:1].nbytes)
+                values.tofile(outfile)
+
+        self.count += count
+        self.writeHeader()
+
+    def writeHeader(self):
+        """ Writes the header again, with the current number of rays """
+        header = self.encodeHeader(self.kind, self.count, self.capacity, self.columns)
+        with open(self.filePath, 'r+b') as outfile:
+            outfile.write(self.magic)
+            outfile.write(np.array(len(header), dtype='<u4').tobytes())
+            outfile.write(header)
+
+    @classmethod
+    def encodeHeader(cls, kind, count, capacity, columns):
+        """ The header of a file, as bytes, padded to keep its length the
+        same for any count up to the capacity """
+        header = json.dumps({'version': cls.version, 'kind': kind, 'count': count, 'capacity': capacity,
+                             'columns': columns})
+        padding = len(str(capacity)) - len(str(count))
+        return (header + " " * padding).encode('utf-8')
+
+    @classmethod
+    def aligned(cls, size):
+        """ The size rounded up to the alignment of the columns """
+        return -(-size // cls.alignment) * cls.alignment
+
+    @staticmethod
+    def dtypeToDescription(dtype):
+        """ A description of the dtype that can be saved in the header """
+        return np.lib.format.dtype_to_descr(dtype)
+
+    @staticmethod
+    def descriptionToDtype(description):
+        """ The dtype from its description in the header """
+        if isinstance(description, str):
+            return np.dtype(description)
+
+        return np.dtype([tuple(field) for field in description])
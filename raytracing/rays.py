@@ -1,4 +1,6 @@
 from .ray import *
+from .rayfile import *
+from .quasirandom import *
 import numpy as np
 import matplotlib.pyplot as plt
 import pickle
@@ -20,6 +22,10 @@ class Rays:
     instance) and will create each ray on demand, then store them as they go
     in the rays list.
 
+    The rays are stored in NumPy arrays (height, angle, position, blocked
+    status, wavelength and optional weight), and Ray objects are only created
+    when rays are accessed by index or by iteration.
+
     It is an iterable object, which means it can be used in an expression
     like `for ray in rays:` which is convenient both when propagating rays
     or when analysing the resulting rays that reached a plane in ImagingPath,
@@ -60,12 +66,15 @@ class Rays:
     """
 
     def __init__(self, rays=None):
-        if rays is None:
-            self._rays = []
-        else:
-            if isinstance(rays, collections.Iterable):
+        self.clear()
+        if rays is not None:
+            if isinstance(rays, Rays) and len(rays) == rays._count:
+                self.appendArrays(rays.yValues, rays.thetaValues, rays.zValues, rays.isBlockedValues,
+                                  rays.wavelengthValues, rays.weights if rays.isWeighted else None)
+            elif isinstance(rays, collections.Iterable):
+                rays = list(rays)
                 if all([isinstance(ray, Ray) for ray in rays]):
-                    self._rays = list(rays)
+                    self.appendRays(rays)
                 else:
                     raise TypeError("'rays' elements must be of type Ray.")
             else:
@@ -74,7 +83,25 @@ class Rays:
         self.iteration = 0
         self.progressLog = 10000
 
-        # We cache these because they can be lengthy to calculate
+    def clear(self):
+        """Removes all the rays. The rays are kept in contiguous arrays (one
+        for each property of a Ray) that are larger than needed, to allow
+        appending rays efficiently."""
+        capacity = 16
+        self._count = 0
+        self._y = np.zeros(capacity)
+        self._theta = np.zeros(capacity)
+        self._z = np.zeros(capacity)
+        self._isBlocked = np.zeros(capacity, dtype=bool)
+        # Only allocated when needed
+        self._wavelength = None
+        self._weight = None
+
+        self.invalidateCachedValues()
+
+    def invalidateCachedValues(self):
+        """ The histograms are cached because they can be lengthy to calculate.
+        They must be recalculated when rays are modified."""
         self._yValues = None
         self._thetaValues = None
         self._yHistogram = None
@@ -86,17 +113,55 @@ class Rays:
 
         self._anglesHistogramParameters = None
         self._xValuesAnglesHistogram = None
+        self._hasCachedValues = False
+
+    def reserve(self, capacity):
+        """ Makes sure the arrays can hold at least `capacity` rays
+        without being reallocated. """
+        if capacity <= len(self._y):
+            return
+
+        capacity = max(capacity, 2 * len(self._y))
+        for name in ['_y', '_theta', '_z', '_isBlocked', '_wavelength', '_weight']:
+            values = getattr(self, name)
+            if values is not None:
+                newValues = np.empty(capacity, dtype=values.dtype)
+                newValues[:self._count] = values[:self._count]
+                setattr(self, name, newValues)
+
+    def allocateWavelengths(self):
+        """ Allocates the array of wavelengths, which is not needed
+        until a ray has a wavelength. """
+        if self._wavelength is None:
+            self._wavelength = np.full(len(self._y), np.nan)
+
+    def allocateWeights(self):
+        """ Allocates the array of weights, which is not needed
+        until a ray has a weight. """
+        if self._weight is None:
+            self._weight = np.ones(len(self._y))
 
     def __len__(self) -> int:
-        if self._rays is None:
-            return 0
-        return len(self._rays)
+        return self._count
+
+    @property
+    def _rays(self):
+        # For compatibility: the list of rays is not kept anymore, the rays
+        # are created from the arrays.
+        return [RayView(self, i) for i in range(self._count)]
+
+    @_rays.setter
+    def _rays(self, rays):
+        self.clear()
+        self.appendRays(list(rays))
 
     @property
     def rays(self):
-        # Even if "read only" property, we can change the content of the list.
-        # We return a copy with [:]
-        return self._rays[:]
+        """
+        Returns a list of the rays.  The rays are created when requested
+        and modifying them modifies the rays in this object.
+        """
+        return self._rays
 
     @property
     def count(self):
@@ -108,23 +173,138 @@ class Rays:
     @property
     def yValues(self):
         """
-        Returns the heights of rays in the list.
+        Returns the heights of rays in the list. This is a view on the
+        internal array, valid until rays are added.
         """
         if self._yValues is None:
-            self._yValues = list(map(lambda x: x.y, self))
+            self._yValues = self._y[:self._count]
+            self._hasCachedValues = True
 
         return self._yValues
 
     @property
     def thetaValues(self):
         """
-        Returns the angles of rays in the list.
+        Returns the angles of rays in the list. This is a view on the
+        internal array, valid until rays are added.
         """
         if self._thetaValues is None:
-            self._thetaValues = list(map(lambda x: x.theta, self))
+            self._thetaValues = self._theta[:self._count]
+            self._hasCachedValues = True
 
         return self._thetaValues
 
+    @property
+    def zValues(self):
+        """
+        Returns the positions of rays in the list (a view on the internal array).
+        """
+        return self._z[:self._count]
+
+    @property
+    def isBlockedValues(self):
+        """
+        Returns whether the rays in the list are blocked (a view on the internal array).
+        """
+        return self._isBlocked[:self._count]
+
+    @property
+    def wavelengthValues(self):
+        """
+        Returns the wavelengths of rays in the list, with NaN when the
+        wavelength is not defined.
+        """
+        if self._wavelength is None:
+            return np.full(self._count, np.nan)
+        return self._wavelength[:self._count]
+
+    @property
+    def totalWeight(self):
+        """
+        Returns the sum of the weights of all rays, which is the number of
+        rays if the rays have no individual weights.
+        """
+        if self._weight is None:
+            return float(self._count)
+        return float(np.sum(self.weights))
+
+    def normalizedTotalWeight(self, rays):
+        """ The weight of the source that some of its rays represent, to
+        normalize a transmission (see TransmissionEstimate.add()). None
+        means the sum of their weights, which is the case unless the weights
+        are importance weights (see ImportanceSampledRays).
+
+        Parameters
+        ----------
+        rays : Rays
+            Some of the rays, such as a chunk
+        """
+        return None
+
+    def rayArrays(self):
+        """ Returns the heights, angles, positions and blocked status of
+        all the rays as arrays, as used by Matrix.traceArraysThrough().
+        """
+        return (self.yValues, self.thetaValues, self.zValues, self.isBlockedValues)
+
+    def chunk(self, start, stop):
+        """ The rays [start, stop) as a new Rays object, with their weights
+        and wavelengths.
+
+        Parameters
+        ----------
+        start, stop : int
+            The range of rays
+
+        Returns
+        -------
+        rays : Rays
+            The rays of the chunk
+        """
+        (y, theta, z, isBlocked) = self.rayArrays()
+        wavelength = None
+        if self._wavelength is not None:
+            wavelength = self._wavelength[start:min(stop, self._count)]
+        weights = None
+        if self._weight is not None:
+            weights = self._weight[start:min(stop, self._count)]
+
+        rays = Rays()
+        rays.appendArrays(y[start:stop], theta[start:stop], z[start:stop], isBlocked[start:stop],
+                          wavelength=wavelength, weights=weights)
+        return rays
+
+    def chunks(self, chunkSize):
+        """ The rays in consecutive chunks of at most `chunkSize` rays, each
+        of them a Rays object (see chunk()). Random rays are generated chunk
+        by chunk, so any number of rays can be traced with a constant amount
+        of memory.
+
+        Parameters
+        ----------
+        chunkSize : int
+            The number of rays in each chunk
+        """
+        for start in range(0, len(self), chunkSize):
+            yield self.chunk(start, start + chunkSize)
+
+    @property
+    def isWeighted(self):
+        """
+        True if the rays have individual weights.
+        """
+        return self._weight is not None
+
+    @property
+    def weights(self):
+        """
+        Returns the weight of each ray in the list. Without individual
+        weights, all rays have a weight of 1.
+        """
+        if self._weight is None:
+            return np.ones(self._count)
+        return self._weight[:self._count]
+
     def rayCountHistogram(self, binCount=None, minValue=None, maxValue=None):
 
         """ This functions calculates the histogram for the height of the rays.
@@ -182,17 +362,18 @@ class Rays:
             binCount = 40
 
         if minValue is None:
-            minValue = min(self.yValues)
+            minValue = np.min(self.yValues)
 
         if maxValue is None:
-            maxValue = max(self.yValues)
+            maxValue = np.max(self.yValues)
 
         if self._countHistogramParameters != (binCount, minValue, maxValue):
             self._countHistogramParameters = (binCount, minValue, maxValue)
 
             (self._yHistogram, binEdges) = np.histogram(self.yValues,
                                                      bins=binCount,
-                                                     range=(minValue, maxValue))
+                                                     range=(minValue, maxValue),
+                                                     weights=self._weight[:self._count] if self.isWeighted else None)
             self._yHistogram = list(self._yHistogram)
             xValues = []
             for i in range(len(binEdges) - 1):
@@ -262,15 +443,16 @@ class Rays:
             binCount = 40
 
         if minValue is None:
-            minValue = min(self.thetaValues)
+            minValue = np.min(self.thetaValues)
 
         if maxValue is None:
-            maxValue = max(self.thetaValues)
+            maxValue = np.max(self.thetaValues)
 
         if self._anglesHistogramParameters != (binCount, minValue, maxValue):
             self._anglesHistogramParameters = (binCount, minValue, maxValue)
 
-            (self._thetaHistogram, binEdges) = np.histogram(self.thetaValues, bins=binCount, range=(minValue, maxValue))
+            (self._thetaHistogram, binEdges) = np.histogram(self.thetaValues, bins=binCount, range=(minValue, maxValue),
+                                                            weights=self._weight[:self._count] if self.isWeighted else None)
             self._thetaHistogram = list(self._thetaHistogram)
             xValues = []
             for i in range(len(binEdges) - 1):
@@ -350,7 +532,8 @@ class Rays:
             if self.progressLog > nRays:
                 self.progressLog = nRays
 
-            print("Progress {0}/{1} ({2:.0f}%) ".format(self.iteration, nRays, self.iteration / nRays * 100))
+            # A single write, so that lines from several processes are not mixed
+            print("Progress {0}/{1} ({2:.0f}%) \n".format(self.iteration, nRays, self.iteration / nRays * 100), end="")
 
     def __iter__(self):
         self.iteration = 0
@@ -358,111 +541,278 @@ class Rays:
         return self
 
     def __next__(self) -> Ray:
-        if self._rays is None:
-            raise StopIteration
-
-        if self.iteration < len(self._rays):
-            ray = self._rays[self.iteration]
+        if self.iteration < self._count:
+            ray = RayView(self, self.iteration)
             self.iteration += 1
             return ray
 
         raise StopIteration
 
     def __getitem__(self, item):
-        return self._rays[item]
+        if isinstance(item, slice):
+            return [RayView(self, i) for i in range(*item.indices(self._count))]
+
+        item = int(item)
+        if item < 0:
+            item += self._count
+        if item < 0 or item >= self._count:
+            raise IndexError(f"Index {item} out of bound, min = 0, max {self._count}.")
+
+        return RayView(self, item)
 
-    def append(self, ray):
+    def append(self, ray, weight=None):
         """A ray can be appended to the List of the rays using this function.
 
          Parameters
          ----------
          ray : object of ray class
             a ray with height y and angle theta
+         weight : float
+            the weight of the ray (Optional). Rays without weight have a weight of 1.
 
          """
         if not isinstance(ray, Ray):
             raise TypeError("'ray' must be a 'Ray' object.")
-        if self._rays is not None:
-            self._rays.append(ray)
 
-        # Invalidate cached values
-        self._yValues = None
-        self._thetaValues = None
-        self._yHistogram = None
-        self._thetaHistogram = None
-        self._directionBinEdges = None
+        if self._count == len(self._y):
+            self.reserve(self._count + 1)
+
+        i = self._count
+        self._y[i] = ray.y
+        self._theta[i] = ray.theta
+        self._z[i] = ray.z
+        self._isBlocked[i] = ray.isBlocked
+        if ray.wavelength is not None:
+            self.allocateWavelengths()
+        if self._wavelength is not None:
+            self._wavelength[i] = np.nan if ray.wavelength is None else ray.wavelength
+        if weight is not None:
+            self.allocateWeights()
+        if self._weight is not None:
+            self._weight[i] = 1 if weight is None else weight
+        self._count += 1
+
+        if self._hasCachedValues:
+            self.invalidateCachedValues()
+
+    def appendRays(self, rays):
+        """ Appends all the rays of a list of Ray objects.
 
-        self._countHistogramParameters = None
-        self._xValuesCountHistogram = None
+         Parameters
+         ----------
+         rays : list of Ray
+            the rays to append
+        """
+        self.appendArrays([ray.y for ray in rays],
+                          [ray.theta for ray in rays],
+                          [ray.z for ray in rays],
+                          [ray.isBlocked for ray in rays],
+                          [np.nan if ray.wavelength is None else ray.wavelength for ray in rays])
 
-        self._anglesHistogramParameters = None
-        self._xValuesAnglesHistogram = None
+    def appendArrays(self, y, theta, z=0.0, isBlocked=False, wavelength=None, weights=None):
+        """ Appends many rays at once, given by their properties. This is much
+        faster than appending Ray objects one by one.
+
+         Parameters
+         ----------
+         y : array of float
+            Heights of the rays
+         theta : array of float
+            Angles of the rays
+         z : float or array of float
+            Positions of the rays (default=0)
+         isBlocked : bool or array of bool
+            Whether the rays are blocked (default=False)
+         wavelength : float or array of float
+            Wavelengths of the rays (Optional). NaN or None means no wavelength.
+         weights : float or array of float
+            Weights of the rays (Optional). Rays without weight have a weight of 1.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> rays = Rays()
+        >>> rays.appendArrays(y=[0, 1, 2], theta=[0.1, 0.1, 0.1])
+        >>> print(len(rays), rays.yValues)
+        3 [0. 1. 2.]
+        """
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        theta = np.atleast_1d(np.asarray(theta, dtype=float))
+        if y.shape != theta.shape or y.ndim != 1:
+            raise ValueError("'y' and 'theta' must be one-dimensional and have the same length.")
+        if wavelength is not None and not np.all(np.isnan(wavelength)):
+            self.allocateWavelengths()
+
+        n = len(y)
+        start = self._count
+        self.reserve(start + n)
+        self._y[start:start + n] = y
+        self._theta[start:start + n] = theta
+        self._z[start:start + n] = z
+        self._isBlocked[start:start + n] = isBlocked
+        if self._wavelength is not None:
+            self._wavelength[start:start + n] = np.nan if wavelength is None else wavelength
+        if weights is not None:
+            self.allocateWeights()
+        if self._weight is not None:
+            self._weight[start:start + n] = 1 if weights is None else weights
+        self._count += n
+
+        if self._hasCachedValues:
+            self.invalidateCachedValues()
 
     def load(self, filePath, append=False):
 
-        """ A list of rays can be loaded using this function.
+        """ A list of rays can be loaded using this function.  Files saved
+        with save() are mapped in memory (see RayFile) and are not read
+        until the rays are used. Files saved with older versions (a pickled
+        list of Ray) can also be loaded.
 
         Parameters
         ----------
-        filePath : str or PathLike or file-like object
-            A path, or a Python file-like object, or possibly some backend-dependent object.
-            Must be provided in OS-dependent format.
+        filePath : str or PathLike
+            The path of the file. Must be provided in OS-dependent format.
         append : bool
             If True, the loaded rays will be appended to the current list of rays.
         """
 
+        if RayFile.isRayFile(filePath):
+            rayFile = RayFile(filePath)
+            if rayFile.kind != 'rays':
+                raise IOError(f"{filePath} does not contain rays but {rayFile.kind}.")
+
+            # Modifications of the rays are never written to the file
+            columns = {name: rayFile.column(name, mode='c') for name in rayFile.columnNames}
+            if append:
+                self.appendArrays(columns['y'], columns['theta'], columns['z'], columns['isBlocked'],
+                                  columns.get('wavelength'), columns.get('weight'))
+                return
+
+            self.clear()
+            self._y = columns['y']
+            self._theta = columns['theta']
+            self._z = columns['z']
+            self._isBlocked = columns['isBlocked']
+            self._wavelength = columns.get('wavelength')
+            self._weight = columns.get('weight')
+            self._count = rayFile.count
+            return
+
+        # Older files: a pickled list of Ray
         with open(filePath, 'rb') as infile:
             loadedRays = pickle.Unpickler(infile).load()
             if not isinstance(loadedRays, collections.Iterable):
                 raise IOError(f"{filePath} does not contain an iterable of Ray objects.")
             if not all([isinstance(ray, Ray) for ray in loadedRays]):
                 raise IOError(f"{filePath} must contain only Ray objects.")
-            if append and self._rays is not None:
-                self._rays.extend(loadedRays)
-            else:
-                self._rays = loadedRays
+            if not append:
+                self.clear()
+            self.appendRays(list(loadedRays))
 
     def save(self, filePath):
 
-        """ A list of rays can be saved using this function.
+        """ A list of rays can be saved using this function.  The rays are
+        saved in a binary file, one column for each property of the rays
+        (see RayFile), that can be loaded very quickly with load().
 
         Parameters
         ----------
-        filePath : str or PathLike or file-like object
-            A path, or a Python file-like object, or possibly some backend-dependent object.
-            Must be provided in OS-dependent format.
-        """
-
-        with open(filePath, 'wb') as outfile:
-            pickle.Pickler(outfile).dump(self._rays)
-
-        # We save the data to disk using a module called Pickler
-        # Some asynchronous magic is happening here with Pickle
-        # and sometimes, access to files is wonky, especially
-        # when the files are very large.
-        # Make sure file exists
-        while not os.path.exists(filePath):
-            time.sleep(0.1)
-
-        oldSize = None
-        # Make sure file is not still being written to
-        while True:
-            try:
-                currentSize = os.path.getsize(filePath)
-                if currentSize == oldSize:
-                    break
-
-                time.sleep(1)
-                oldSize = currentSize
-            except:
-                # Not possible, yet: sometimes we get here
-                time.sleep(0.1)
+        filePath : str or PathLike
+            The path of the file. Must be provided in OS-dependent format.
+        """
+
+        (y, theta, z, isBlocked) = self.rayArrays()
+        columns = {'y': y, 'theta': theta, 'z': z, 'isBlocked': isBlocked}
+        if self._wavelength is not None:
+            columns['wavelength'] = self.wavelengthValues
+        if self.isWeighted:
+            columns['weight'] = self.weights
+
+        RayFile.save(filePath, 'rays', columns)
 
     # For 2D histogram:
     # https://en.wikipedia.org/wiki/Xiaolin_Wu's_line_algorithm
     # and https://stackoverflow.com/questions/3122049/drawing-an-anti-aliased-line-with-thepython-imaging-library
 
 
+class RayView(Ray):
+    """A Ray stored in a Rays object. Its properties are read from (and
+    written to) the arrays of the Rays object, so that modifying the ray
+    modifies the Rays.  It behaves in every other way like a Ray.
+
+    Parameters
+    ----------
+    parent : Rays
+        The Rays object holding the ray
+    index : int
+        The index of the ray in the parent
+    """
+
+    __slots__ = ('parent', 'index')
+
+    def __init__(self, parent, index):
+        self.parent = parent
+        self.index = index
+        self.apertureDiameter = float("+Inf")
+
+    def __reduce__(self):
+        # Saved and sent to other processes as a regular Ray
+        return (Ray, (self.y, self.theta, self.z, self.isBlocked, self.wavelength))
+
+    def setValue(self, array, value):
+        getattr(self.parent, array)[self.index] = value
+        if self.parent._hasCachedValues:
+            self.parent.invalidateCachedValues()
+
+    @property
+    def y(self):
+        return float(self.parent._y[self.index])
+
+    @y.setter
+    def y(self, value):
+        self.setValue('_y', value)
+
+    @property
+    def theta(self):
+        return float(self.parent._theta[self.index])
+
+    @theta.setter
+    def theta(self, value):
+        self.setValue('_theta', value)
+
+    @property
+    def z(self):
+        return float(self.parent._z[self.index])
+
+    @z.setter
+    def z(self, value):
+        self.setValue('_z', value)
+
+    @property
+    def isBlocked(self):
+        return bool(self.parent._isBlocked[self.index])
+
+    @isBlocked.setter
+    def isBlocked(self, value):
+        self.setValue('_isBlocked', value)
+
+    @property
+    def wavelength(self):
+        if self.parent._wavelength is None:
+            return None
+        wavelength = float(self.parent._wavelength[self.index])
+        if np.isnan(wavelength):
+            return None
+        return wavelength
+
+    @wavelength.setter
+    def wavelength(self, value):
+        if value is not None:
+            self.parent.allocateWavelengths()
+        if self.parent._wavelength is not None:
+            self.setValue('_wavelength', np.nan if value is None else value)
+
+
 class UniformRays(Rays):
     """A list of rays with uniform distribution.
 
@@ -519,11 +869,12 @@ class UniformRays(Rays):
 
         self.M = M
         self.N = N
-        rays = []
-        for y in np.linspace(self.yMin, self.yMax, self.M, endpoint=True):
-            for theta in np.linspace(self.thetaMin, self.thetaMax, self.N, endpoint=True):
-                rays.append(Ray(y, theta))
-        super(UniformRays, self).__init__(rays=rays)
+        super(UniformRays, self).__init__()
+
+        # All heights, and all angles for each height
+        yValues = np.linspace(self.yMin, self.yMax, self.M, endpoint=True)
+        thetaValues = np.linspace(self.thetaMin, self.thetaMax, self.N, endpoint=True)
+        self.appendArrays(np.repeat(yValues, self.N), np.tile(thetaValues, self.M))
 
 class LambertianRays(Rays):
     """A list of rays with Lambertian distribution.
@@ -540,7 +891,8 @@ class LambertianRays(Rays):
     N : int
         Number of rays for each point
     I : int
-        Number of points that are defined for the angle of rays
+        Intensity of the rays along the axis. Each ray has a weight
+        int(I*cos(theta)), and rays with a weight of zero are not included.
 
     Examples
     --------
@@ -575,13 +927,16 @@ class LambertianRays(Rays):
         self.M = M
         self.N = N
         self.I = I
-        rays = []
-        for theta in np.linspace(self.thetaMin, self.thetaMax, N, endpoint=True):
-            intensity = int(I * np.cos(theta))
-            for y in np.linspace(self.yMin, self.yMax, M, endpoint=True):
-                for k in range(intensity):
-                    rays.append(Ray(y, theta))
-        super(LambertianRays, self).__init__(rays=rays)
+        super(LambertianRays, self).__init__()
+
+        # For each angle, all heights, with a weight given by the intensity.
+        # Rays with an intensity of zero are not included.
+        thetaValues = np.linspace(self.thetaMin, self.thetaMax, N, endpoint=True)
+        yValues = np.linspace(self.yMin, self.yMax, M, endpoint=True)
+        intensities = np.repeat((I * np.cos(thetaValues)).astype(int), M)
+        hasIntensity = intensities > 0
+        self.appendArrays(np.tile(yValues, N)[hasIntensity], np.repeat(thetaValues, M)[hasIntensity],
+                          weights=intensities[hasIntensity])
 
 
 class RandomRays(Rays):
@@ -601,7 +956,17 @@ class RandomRays(Rays):
         If no value is assigned to this parameter it will be -thetaMax
     maxCount : int
         Number of rays in the list
-
+    seed : int, SeedSequence or Generator
+        The seed of the random numbers (default=None, a new random seed).
+        The same seed always gives the same rays.
+
+    Notes
+    -----
+    The rays are drawn by blocks of `blockSize` rays, and each block has its
+    own stream of random numbers (spawned from the seed with SeedSequence).
+    Any range of rays can therefore be generated on its own, in any order or
+    in another process, and is always identical to the same range generated
+    all at once.
 
     See Also
     --------
@@ -609,7 +974,12 @@ class RandomRays(Rays):
     raytracing.RandomUniformRays
 
     """
-    def __init__(self, yMax=1.0, yMin=None, thetaMax=np.pi / 2, thetaMin=None, maxCount=100000):
+
+    blockSize = 4096
+
+    def __init__(self, yMax=1.0, yMin=None, thetaMax=np.pi / 2, thetaMin=None, maxCount=100000, seed=None):
+        self.seedSequence = self.asSeedSequence(seed)
+        self._block = None
         self.maxCount = maxCount
         self.yMax = yMax
         self.yMin = yMin
@@ -632,13 +1002,59 @@ class RandomRays(Rays):
         if item < 0 or item >= self.maxCount:
             raise IndexError(f"Index {item} out of bound, min = 0, max {self.maxCount}.")
 
-        start = time.monotonic()
-        while len(self._rays) <= item:
-            self.randomRay()
-            if time.monotonic() - start > 3:
-                warnings.warn(f"Generating missing rays. This can take a few seconds.", UserWarning)
+        if self._count <= item:
+            self.generateRays(item + 1 - self._count)
+
+        return RayView(self, item)
+
+    def generateRays(self, count=None):
+        """ Generates rays that were not generated yet, all at once with
+        randomRayArrays() if the subclass provides it, otherwise one by one
+        with randomRay().
+
+        Parameters
+        ----------
+        count : int
+            The number of rays to generate (default=None, all missing rays).
+        """
+        missingCount = self.maxCount - self._count
+        if count is None or count > missingCount:
+            count = missingCount
+        if count <= 0:
+            return
+
+        if type(self).randomRayArrays is not RandomRays.randomRayArrays:
+            (y, theta) = self.randomRayArraysInRange(self._count, self._count + count)
+            self.appendArrays(y, theta, weights=self.rayWeights(y, theta))
+        else:
+            start = time.monotonic()
+            for i in range(count):
+                self.randomRay()
+                if time.monotonic() - start > 3:
+                    warnings.warn(f"Generating missing rays. This can take a few seconds.", UserWarning)
+
+    def generateAllRays(self):
+        """ Generates all the rays that were not generated yet. """
+        self.generateRays()
 
-        return self._rays[item]
+    @property
+    def yValues(self):
+        self.generateAllRays()
+        return super(RandomRays, self).yValues
+
+    @property
+    def weights(self):
+        self.generateAllRays()
+        return super(RandomRays, self).weights
+
+    @property
+    def thetaValues(self):
+        self.generateAllRays()
+        return super(RandomRays, self).thetaValues
+
+    def rayArrays(self):
+        self.generateAllRays()
+        return super(RandomRays, self).rayArrays()
 
     def __next__(self) -> Ray:
         if self.iteration >= self.maxCount:
@@ -649,7 +1065,101 @@ class RandomRays(Rays):
         return ray
 
     def randomRay(self) -> Ray:
-        raise NotImplementedError("You must implement randomRay() in your subclass")
+        if type(self).randomRayArrays is RandomRays.randomRayArrays:
+            raise NotImplementedError("You must implement randomRay() in your subclass")
+
+        if self._count == self.maxCount:
+            raise AttributeError("Cannot generate more random rays, maximum count achieved")
+
+        self.generateRays(1)
+        return RayView(self, self._count - 1)
+
+    def randomRayArrays(self, count, generator):
+        """ Returns the heights and angles of `count` new random rays as two
+        arrays, drawn with the random number generator. Subclasses that
+        implement this method generate their rays much faster than with
+        randomRay(), and reproducibly (see seed). """
+        raise NotImplementedError("You must implement randomRayArrays() or randomRay() in your subclass")
+
+    @staticmethod
+    def asSeedSequence(seed=None):
+        """ The SeedSequence for a seed: an int, a SeedSequence, a Generator
+        (used to draw a seed) or None (a new random seed). """
+        if isinstance(seed, np.random.SeedSequence):
+            return seed
+        if isinstance(seed, np.random.Generator):
+            return np.random.SeedSequence(seed.integers(0, 2 ** 63, size=4))
+        return np.random.SeedSequence(seed)
+
+    @property
+    def seed(self):
+        """ The seed that gives these same rays again """
+        return self.seedSequence.entropy
+
+    def blockGenerator(self, index):
+        """ The random number generator of a block of rays: the same block
+        always has the same generator, independent of the other blocks. """
+        seedSequence = np.random.SeedSequence(self.seedSequence.entropy,
+                                              spawn_key=self.seedSequence.spawn_key + (index,))
+        return np.random.default_rng(seedSequence)
+
+    def randomRayArraysInRange(self, start, stop):
+        """ The heights and angles of the rays [start, stop), generated from
+        their blocks without generating the other rays. They are the same
+        rays as those of the list, whichever way they are generated.
+
+        Parameters
+        ----------
+        start, stop : int
+            The range of rays
+
+        Returns
+        -------
+        (y, theta) : tuple of arrays
+            The heights and angles of the rays
+        """
+        stop = min(stop, self.maxCount)
+        start = min(start, stop)
+        yParts = []
+        thetaParts = []
+        for index in range(start // self.blockSize, -(-stop // self.blockSize)):
+            if self._block is None or self._block[0] != index:
+                (y, theta) = self.randomRayArrays(self.blockSize, self.blockGenerator(index))
+                self._block = (index, y, theta)
+
+            (blockIndex, y, theta) = self._block
+            blockStart = index * self.blockSize
+            yParts.append(y[max(start - blockStart, 0):stop - blockStart])
+            thetaParts.append(theta[max(start - blockStart, 0):stop - blockStart])
+
+        if len(yParts) == 0:
+            return (np.empty(0), np.empty(0))
+        return (np.concatenate(yParts), np.concatenate(thetaParts))
+
+    def chunk(self, start, stop):
+        """ The rays [start, stop) as a Rays object, identical to the same
+        rays of this list. Different processes can generate different chunks
+        of the same random rays.
+
+        Parameters
+        ----------
+        start, stop : int
+            The range of rays
+
+        Returns
+        -------
+        rays : Rays
+            The rays of the chunk
+        """
+        (y, theta) = self.randomRayArraysInRange(start, stop)
+        rays = Rays()
+        rays.appendArrays(y, theta, weights=self.rayWeights(y, theta))
+        return rays
+
+    def rayWeights(self, y, theta):
+        """ The weights of the rays generated with randomRayArrays(), or None
+        if the rays have no weights (the default). """
+        return None
 
 
 class RandomUniformRays(RandomRays):
@@ -693,19 +1203,28 @@ class RandomUniformRays(RandomRays):
 
         """
 
-    def __init__(self, yMax=1.0, yMin=None, thetaMax=np.pi / 2, thetaMin=None, maxCount=100000):
+    def __init__(self, yMax=1.0, yMin=None, thetaMax=np.pi / 2, thetaMin=None, maxCount=100000, seed=None):
         super(RandomUniformRays, self).__init__(yMax=yMax, yMin=yMin, thetaMax=thetaMax, thetaMin=thetaMin,
-                                                maxCount=maxCount)
+                                                maxCount=maxCount, seed=seed)
 
-    def randomRay(self) -> Ray:
-        if len(self._rays) == self.maxCount:
-            raise AttributeError("Cannot generate more random rays, maximum count achieved")
+    def randomRayArrays(self, count, generator):
+        v = generator.random(count)
+        u = generator.random(count)
+        return self.raysFromUniformValues(u, v)
 
-        theta = self.thetaMin + np.random.random() * (self.thetaMax - self.thetaMin)
-        y = self.yMin + np.random.random() * (self.yMax - self.yMin)
-        ray = Ray(y=y, theta=theta)
-        self.append(ray)
-        return ray
+    def raysFromUniformValues(self, u, v):
+        """ The heights and angles of the rays from values uniformly
+        distributed between 0 and 1: u gives the heights and v the angles. """
+        theta = self.thetaMin + v * (self.thetaMax - self.thetaMin)
+        y = self.yMin + u * (self.yMax - self.yMin)
+        return (y, theta)
+
+    def density(self, y, theta):
+        """ The probability density of the rays at (y, theta) """
+        y = np.asarray(y, dtype=float)
+        theta = np.asarray(theta, dtype=float)
+        isInside = (y >= self.yMin) & (y <= self.yMax) & (theta >= self.thetaMin) & (theta <= self.thetaMax)
+        return np.where(isInside, 1 / ((self.yMax - self.yMin) * (self.thetaMax - self.thetaMin)), 0.0)
 
 
 class RandomLambertianRays(RandomRays):
@@ -744,33 +1263,282 @@ class RandomLambertianRays(RandomRays):
 
     """
 
-    def __init__(self, yMax=1.0, yMin=None, maxCount=10000):
+    def __init__(self, yMax=1.0, yMin=None, maxCount=10000, seed=None):
         super(RandomLambertianRays, self).__init__(yMax=yMax, yMin=yMin, thetaMax=np.pi / 2, thetaMin=-np.pi / 2,
-                                                   maxCount=maxCount)
+                                                   maxCount=maxCount, seed=seed)
+
+    def randomRayArrays(self, count, generator):
+        v = generator.random(count)
+        u = generator.random(count)
+        return self.raysFromUniformValues(u, v)
+
+    def raysFromUniformValues(self, u, v):
+        """ The heights and angles of the rays from values uniformly
+        distributed between 0 and 1: u gives the heights and v the angles. """
+        # The probability of an angle is proportional to cos(theta): its
+        # cumulative distribution is (sin(theta)+1)/2, which we invert.
+        theta = np.arcsin(2 * v - 1)
+        y = self.yMin + u * (self.yMax - self.yMin)
+        return (y, theta)
+
+    def density(self, y, theta):
+        """ The probability density of the rays at (y, theta) """
+        y = np.asarray(y, dtype=float)
+        theta = np.asarray(theta, dtype=float)
+        isInside = (y >= self.yMin) & (y <= self.yMax) & (np.abs(theta) <= np.pi / 2)
+        return np.where(isInside, np.cos(theta) / (2 * (self.yMax - self.yMin)), 0.0)
+
+
+class QuasiRandomUniformRays(RandomUniformRays):
+    """A list of quasi-random rays with uniform distribution: the rays
+    come from a low-discrepancy sequence (Sobol or Halton) instead of random
+    numbers.  They cover the range of heights and angles much more evenly,
+    and an efficiency or a histogram obtained with N rays is about as
+    accurate as with N^2 random rays (for smooth enough quantities).  Any
+    chunk of rays can be generated on its own, for parallel tracing.
 
-    def randomRay(self) -> Ray:
-        if len(self._rays) == self.maxCount:
-            raise AttributeError("Cannot generate more random rays, maximum count achieved")
+    Parameters
+    ----------
+    yMax : float
+        Maximum height for the rays (default=1.0)
+    yMin : float
+        Minimum height for the rays (default=None, -yMax)
+    thetaMax : float
+        Maximum angle for the rays (default=pi/2)
+    thetaMin : float
+        Minimum angle for the rays (default=None, -thetaMax)
+    maxCount : int
+        Number of rays in the list. A power of 2 is best for the Sobol
+        sequence.
+    sequence : str
+        'sobol' (default) or 'halton'
+    scramble : bool
+        If True (default), the sequence is randomly scrambled with the seed:
+        the estimates are unbiased, and different seeds give independent
+        estimates.
+    seed : int, SeedSequence or Generator
+        The seed of the scrambling (default=None, a new random seed)
+
+    Examples
+    --------
+    >>> from raytracing import *
+    >>> path = ImagingPath([Space(d=10), Aperture(diameter=2)])
+    >>> source = QuasiRandomUniformRays(yMax=1, thetaMax=0.1, maxCount=4096, seed=1)
+    >>> outputRays = path.traceManyThrough(source, progress=False)
+    >>> print("{0:.3f}".format(outputRays.count / source.count))
+    0.750
+
+    See Also
+    --------
+    raytracing.RandomUniformRays
+    raytracing.QuasiRandomSequence
+    """
+
+    def __init__(self, yMax=1.0, yMin=None, thetaMax=np.pi / 2, thetaMin=None, maxCount=100000, sequence='sobol',
+                 scramble=True, seed=None):
+        super(QuasiRandomUniformRays, self).__init__(yMax=yMax, yMin=yMin, thetaMax=thetaMax, thetaMin=thetaMin,
+                                                     maxCount=maxCount, seed=seed)
+        self.sequence = QuasiRandomSequence(kind=sequence, scramble=scramble, seed=self.seedSequence)
+
+    def randomRayArraysInRange(self, start, stop):
+        stop = min(stop, self.maxCount)
+        (u, v) = self.sequence.points(min(start, stop), stop)
+        return self.raysFromUniformValues(u, v)
+
+
+class QuasiRandomLambertianRays(RandomLambertianRays):
+    """A list of quasi-random rays with Lambertian distribution: the rays
+    come from a low-discrepancy sequence (Sobol or Halton) warped to the
+    Lambertian distribution of angles.  See QuasiRandomUniformRays.
+
+    Parameters
+    ----------
+    yMax : float
+        Maximum height for the rays (default=1.0)
+    yMin : float
+        Minimum height for the rays (default=None, -yMax)
+    maxCount : int
+        Number of rays in the list
+    sequence : str
+        'sobol' (default) or 'halton'
+    scramble : bool
+        If True (default), the sequence is randomly scrambled with the seed
+    seed : int, SeedSequence or Generator
+        The seed of the scrambling (default=None, a new random seed)
+
+    See Also
+    --------
+    raytracing.RandomLambertianRays
+    raytracing.QuasiRandomUniformRays
+    """
+
+    def __init__(self, yMax=1.0, yMin=None, maxCount=10000, sequence='sobol', scramble=True, seed=None):
+        super(QuasiRandomLambertianRays, self).__init__(yMax=yMax, yMin=yMin, maxCount=maxCount, seed=seed)
+        self.sequence = QuasiRandomSequence(kind=sequence, scramble=scramble, seed=self.seedSequence)
+
+    def randomRayArraysInRange(self, start, stop):
+        stop = min(stop, self.maxCount)
+        (u, v) = self.sequence.points(min(start, stop), stop)
+        return self.raysFromUniformValues(u, v)
+
+
+class ImportanceSampledRays(RandomRays):
+    """Random rays of a source, drawn preferentially inside a region of
+    (y, theta), with weights that correct for it: any quantity computed
+    with the weights (a transmitted fraction, a histogram) has the same
+    expected value as with the source itself.  When the region contains the
+    rays that go through a path (its acceptance region), almost no ray is
+    wasted, and the variance of the transmitted fraction can be smaller by
+    orders of magnitude for the same number of rays.
+
+    The rays are drawn from a mixture: uniformly inside the region with a
+    probability 1 - defensiveFraction, and from the source otherwise.  The
+    weight of a ray is the ratio of the density of the source to the density
+    of the mixture, so the weights average to 1, and the rays outside the
+    region are still sampled: the estimates remain correct even if the
+    region misses some rays that go through.
+
+    Parameters
+    ----------
+    source : RandomUniformRays or RandomLambertianRays
+        The source to sample, which must provide density() and raysFromUniformValues()
+    region : array
+        The vertices (y, theta) of a convex polygon in an array of shape (n, 2),
+        as given by ImagingPath.acceptancePolygon(). A clockwise polygon is
+        reversed, and a ValueError is raised if the polygon has no area. If the
+        region is empty, the rays are drawn from the source.
+    defensiveFraction : float
+        The fraction of the rays drawn from the source itself, more than 0 (default=0.1)
+    maxCount : int
+        Number of rays in the list (default=None, the maxCount of the source)
+    seed : int, SeedSequence or Generator
+        The seed of the random numbers (default=None, a new random seed)
+
+    Examples
+    --------
+    >>> from raytracing import *
+    >>> path = ImagingPath([Space(d=10), Lens(f=10, diameter=3), Space(d=10), Aperture(diameter=0.05)])
+    >>> source = RandomUniformRays(yMax=1, thetaMax=0.3, maxCount=10000)
+    >>> importanceSource = path.importanceSampledRays(source, seed=1)
+    >>> outputRays = path.traceManyThrough(importanceSource, progress=False)
+    >>> print(outputRays.count > 8000)
+    True
+    >>> exact = path.collectionEfficiency(source)
+    >>> print(abs(outputRays.totalWeight / importanceSource.totalWeight - exact) / exact < 0.02)
+    True
+
+    See Also
+    --------
+    raytracing.ImagingPath.importanceSampledRays
+    raytracing.ImagingPath.acceptancePolygon
+    """
+
+    def __init__(self, source, region, defensiveFraction=0.1, maxCount=None, seed=None):
+        if not 0 < defensiveFraction <= 1:
+            raise ValueError("The defensive fraction must be more than 0 and at most 1.")
+        if maxCount is None:
+            maxCount = source.maxCount
+
+        super(ImportanceSampledRays, self).__init__(yMax=source.yMax, yMin=source.yMin, thetaMax=source.thetaMax,
+                                                    thetaMin=source.thetaMin, maxCount=maxCount, seed=seed)
+        self.source = source
+        self.region = np.array(region, dtype=float).reshape(-1, 2)
+        self.defensiveFraction = defensiveFraction
+
+        # The region is split in triangles (v0, vi, vi+1) to draw rays uniformly
+        self.regionArea = 0.0
+        self.triangleFractions = np.array([])
+        if len(self.region) != 0:
+            areas = self.triangleAreas(self.region)
+            if np.sum(areas) < 0:
+                self.region = self.region[::-1].copy()
+                areas = self.triangleAreas(self.region)
+            self.regionArea = float(np.sum(areas))
+            if not self.regionArea > 0:
+                raise ValueError("The region must be a polygon with a non-zero area.")
+            self.triangleFractions = np.cumsum(areas) / self.regionArea
+        else:
+            self.defensiveFraction = 1.0
+
+        self.allocateWeights()
+
+    @staticmethod
+    def triangleAreas(region):
+        """ The signed areas of the triangles (v0, vi, vi+1) of a polygon,
+        positive if the polygon is counterclockwise. """
+        if len(region) < 3:
+            return np.zeros(1)
+        (v0, v1, v2) = (region[0], region[1:-1], region[2:])
+        return ((v1[:, 0] - v0[0]) * (v2[:, 1] - v0[1]) - (v1[:, 1] - v0[1]) * (v2[:, 0] - v0[0])) / 2
+
+    @property
+    def isWeighted(self):
+        return True
+
+    @property
+    def totalWeight(self):
+        """ The weight of the source that the rays represent: the number of
+        rays, since the importance weights average to 1. Dividing by this
+        total instead of the sum of the weights gives unbiased estimates,
+        with a much smaller variance. """
+        return float(self.maxCount)
+
+    def normalizedTotalWeight(self, rays):
+        """ The weight of the source that the rays represent: the number of
+        rays, for the same reason as totalWeight. """
+        return float(len(rays))
+
+    def isInRegion(self, y, theta):
+        """ True for the rays (y, theta) inside the region """
+        isInside = np.full(np.shape(y), self.regionArea > 0)
+        count = len(self.region)
+        for i in range(count):
+            (y1, theta1) = self.region[i]
+            (y2, theta2) = self.region[(i + 1) % count]
+            isInside &= (y2 - y1) * (theta - theta1) - (theta2 - theta1) * (y - y1) >= 0
+        return isInside
+
+    def samplingDensity(self, y, theta):
+        """ The probability density of the rays at (y, theta), as they are drawn """
+        density = self.defensiveFraction * self.source.density(y, theta)
+        if self.regionArea > 0:
+            density = density + (1 - self.defensiveFraction) * self.isInRegion(y, theta) / self.regionArea
+        return density
+
+    def rayWeights(self, y, theta):
+        """ The importance weights of the rays: the density of the source
+        divided by the density of the rays as they are drawn. """
+        samplingDensity = self.samplingDensity(y, theta)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(samplingDensity > 0, self.source.density(y, theta) / samplingDensity, 0.0)
+
+    def randomRayArrays(self, count, generator):
+        isFromSource = generator.random(count) < self.defensiveFraction
+        sourceCount = int(np.sum(isFromSource))
+        regionCount = count - sourceCount
+
+        y = np.empty(count)
+        theta = np.empty(count)
+        (y[isFromSource], theta[isFromSource]) = self.source.raysFromUniformValues(generator.random(sourceCount),
+                                                                                   generator.random(sourceCount))
+        if regionCount > 0:
+            triangles = np.searchsorted(self.triangleFractions, generator.random(regionCount), side='right')
+            triangles = np.minimum(triangles, len(self.triangleFractions) - 1)
+            (v0, v1, v2) = (self.region[0], self.region[triangles + 1], self.region[triangles + 2])
+            s = np.sqrt(generator.random(regionCount))[:, np.newaxis]
+            t = generator.random(regionCount)[:, np.newaxis]
+            points = (1 - s) * v0 + s * (1 - t) * v1 + s * t * v2
+            (y[~isFromSource], theta[~isFromSource]) = (points[:, 0], points[:, 1])
+        return (y, theta)
 
-        theta = 0
-        while (True):
-            theta = self.thetaMin + np.random.random() * (self.thetaMax - self.thetaMin)
-            intensity = np.cos(theta)
-            seed = np.random.random()
-            if seed < intensity:
-                break
-
-        y = self.yMin + np.random.random() * (self.yMax - self.yMin)
-        ray = Ray(y, theta)
-        self.append(ray)
-        return ray
 
 class ObjectRays(UniformRays):
     def __init__(self, diameter, halfAngle=1.0, H=3, T=3):
         super(ObjectRays, self).__init__(yMax=diameter/2, yMin=-diameter/2, thetaMax=halfAngle, thetaMin=-halfAngle, M=H, N=T)
 
 class LampRays(RandomUniformRays):
-    def __init__(self, diameter, NA=1.0, N=10000):
-        super(LampRays, self).__init__(yMax=diameter/2, yMin=-diameter/2, thetaMax=NA, thetaMin=-NA, maxCount=N)
+    def __init__(self, diameter, NA=1.0, N=10000, seed=None):
+        super(LampRays, self).__init__(yMax=diameter/2, yMin=-diameter/2, thetaMax=NA, thetaMin=-NA, maxCount=N,
+                                       seed=seed)
 
 
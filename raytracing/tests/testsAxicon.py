@@ -86,6 +86,16 @@ class TestAxicon(envtest.RaytracingTestCase):
         self.assertEqual(outputRay.theta, axicon.deviationAngle())
         self.assertTrue(outputRay.theta > 0)
 
+    def testTraceArraysThroughSameAsMulRay(self):
+        axicon = Axicon(2.56 * degrees, 1.1, 20)
+        ys = [-15, -10, 0, 10, 15]
+        y, theta, z, isBlocked = axicon.traceArraysThrough(ys, [0] * 5)
+        for i in range(len(ys)):
+            ray = axicon.traceThrough(Ray(ys[i], 0))
+            self.assertAlmostEqual(ray.y, y[i])
+            self.assertAlmostEqual(ray.theta, theta[i])
+            self.assertEqual(ray.isBlocked, isBlocked[i])
+
     def testMulMatrix(self):
         matrix = Matrix()
         axicon = Axicon(2.6543, 1.2*degrees)
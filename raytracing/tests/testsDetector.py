@@ -0,0 +1,107 @@
+import envtest  # modifies path
+import pickle
+import numpy as np
+
+from raytracing import *
+
+inf = float("+inf")
+
+
+class TestDetector(envtest.RaytracingTestCase):
+    def testInvalidBins(self):
+        with self.assertRaises(ValueError):
+            Detector(yBinCount=0)
+        with self.assertRaises(ValueError):
+            Detector(yRange=(1, -1))
+
+    def testSameAsNumpyHistograms(self):
+        rays = RandomUniformRays(yMax=2, thetaMax=0.5, maxCount=10000)
+        detector = Detector(yBinCount=20, yRange=(-1, 1), thetaBinCount=10, thetaRange=(-0.4, 0.4))
+        detector.addRays(rays)
+
+        (yHistogram, edges) = np.histogram(rays.yValues, bins=20, range=(-1, 1))
+        self.assertTrue(np.array_equal(detector.yHistogram, yHistogram))
+        (thetaHistogram, edges) = np.histogram(rays.thetaValues, bins=10, range=(-0.4, 0.4))
+        self.assertTrue(np.array_equal(detector.thetaHistogram, thetaHistogram))
+        (yThetaHistogram, yEdges, thetaEdges) = np.histogram2d(rays.yValues, rays.thetaValues, bins=(20, 10),
+                                                               range=((-1, 1), (-0.4, 0.4)))
+        self.assertTrue(np.array_equal(detector.yThetaHistogram, yThetaHistogram))
+        self.assertEqual(detector.rayCount, 10000)
+
+    def testSameAsRayCountHistogram(self):
+        rays = RandomUniformRays(yMax=1, maxCount=1000)
+        detector = Detector(yBinCount=40, yRange=(np.min(rays.yValues), np.max(rays.yValues)))
+        detector.addRays(rays)
+        (x, y) = rays.rayCountHistogram()
+        (detectorX, detectorY) = detector.rayCountHistogram()
+        self.assertTrue(np.allclose(x, detectorX))
+        self.assertTrue(np.allclose(y, detectorY))
+
+    def testWeights(self):
+        detector = Detector(yBinCount=2, yRange=(0, 2))
+        detector.add(y=[0.5, 1.5, 1.5], theta=[0, 0, 0], weights=[1, 2, 3])
+        self.assertEqual(list(detector.yHistogram), [1, 5])
+        self.assertEqual(detector.totalWeight, 6)
+
+        rays = Rays()
+        rays.appendArrays(y=[0.5, 1.5], theta=[0, 0], isBlocked=[False, True], weights=[4, 5])
+        detector.addRays(rays)
+        self.assertEqual(list(detector.yHistogram), [5, 5])
+        self.assertEqual(detector.rayCount, 4)
+
+    def testOutOfRange(self):
+        detector = Detector(yBinCount=2, yRange=(0, 2), thetaBinCount=2, thetaRange=(-1, 1))
+        detector.add(y=[-1, 0, 2, 3, np.nan], theta=[0, 2, 0, 0, 0])
+        self.assertEqual(list(detector.yHistogram), [1, 1])
+        self.assertEqual(list(detector.thetaHistogram), [0, 4])
+        self.assertEqual(detector.yThetaHistogram.sum(), 1)
+        self.assertEqual(detector.rayCount, 5)
+
+    def testMerge(self):
+        rays = RandomUniformRays(yMax=1, thetaMax=1, maxCount=2000)
+        detector = Detector()
+        detector.addRays(rays)
+
+        first = Detector()
+        second = Detector()
+        first.add(rays.yValues[:500], rays.thetaValues[:500])
+        second.add(rays.yValues[500:], rays.thetaValues[500:])
+        # As from another process
+        second = pickle.loads(pickle.dumps(second))
+        first.merge(second)
+
+        self.assertTrue(np.array_equal(first.yHistogram, detector.yHistogram))
+        self.assertTrue(np.array_equal(first.yThetaHistogram, detector.yThetaHistogram))
+        self.assertEqual(first.rayCount, 2000)
+
+        with self.assertRaises(ValueError):
+            first.merge(Detector(yBinCount=10))
+
+    def testDetectManyThrough(self):
+        path = ImagingPath()
+        path.append(Space(d=10))
+        path.append(Lens(f=10, diameter=10))
+        path.append(Space(d=10))
+        path.append(Aperture(diameter=3))
+        rays = RandomUniformRays(yMax=2, thetaMax=0.5, maxCount=5000)
+
+        detector = path.detectManyThrough(rays, Detector(yRange=(-2, 2)), chunkSize=1000)
+        outputRays = path.traceManyThrough(rays, progress=False)
+        (yHistogram, edges) = np.histogram(outputRays.yValues, bins=40, range=(-2, 2))
+        self.assertTrue(np.array_equal(detector.yHistogram, yHistogram))
+        self.assertEqual(detector.rayCount, len(outputRays))
+
+    def testDetectManyThroughChunks(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10)])
+        chunks = [RandomUniformRays(yMax=1, thetaMax=0.1, maxCount=100) for i in range(3)]
+        detector = path.detectManyThrough(iter(chunks), Detector())
+
+        expected = Detector()
+        for chunk in chunks:
+            expected.addRays(path.traceManyThrough(chunk, progress=False))
+        self.assertTrue(np.array_equal(detector.yThetaHistogram, expected.yThetaHistogram))
+        self.assertEqual(detector.rayCount, 300)
+
+
+if __name__ == '__main__':
+    envtest.main()
@@ -6,18 +6,26 @@ import raytracing
 
 doctest.testmod(m=raytracing.axicon,verbose=False)
 doctest.testmod(m=raytracing.components,verbose=False)
+doctest.testmod(m=raytracing.detector,verbose=False)
+doctest.testmod(m=raytracing.efficiency,verbose=False)
+doctest.testmod(m=raytracing.estimate,verbose=False)
 doctest.testmod(m=raytracing.eo,verbose=False)
 doctest.testmod(m=raytracing.figure,verbose=False)
 doctest.testmod(m=raytracing.gaussianbeam,verbose=False)
+doctest.testmod(m=raytracing.gaussianbeams,verbose=False)
 doctest.testmod(m=raytracing.imagingpath,verbose=False)
 doctest.testmod(m=raytracing.lasercavity,verbose=False)
 doctest.testmod(m=raytracing.laserpath,verbose=False)
 doctest.testmod(m=raytracing.materials,verbose=False)
 doctest.testmod(m=raytracing.matrix,verbose=False)
 doctest.testmod(m=raytracing.matrixgroup,verbose=False)
+doctest.testmod(m=raytracing.parallel,verbose=False)
+doctest.testmod(m=raytracing.quasirandom,verbose=False)
 doctest.testmod(m=raytracing.ray,verbose=False)
+doctest.testmod(m=raytracing.rayfile,verbose=False)
 doctest.testmod(m=raytracing.rays,verbose=False)
 doctest.testmod(m=raytracing.specialtylenses,verbose=False)
+doctest.testmod(m=raytracing.tracearray,verbose=False)
 doctest.testmod(m=raytracing.utils,verbose=False)
 
 
@@ -0,0 +1,85 @@
+import envtest  # modifies path
+import numpy as np
+
+from raytracing import *
+
+inf = float("+inf")
+
+
+class TestEfficiencyReport(envtest.RaytracingTestCase):
+    def setUp(self):
+        self.path = ImagingPath()
+        self.path.append(Space(d=10))
+        self.path.append(Lens(f=10, diameter=10))
+        self.path.append(Space(d=10))
+        self.path.append(Aperture(diameter=8))
+        self.path.append(Space(d=10))
+        self.path.append(Lens(f=10, diameter=6))
+        self.path.append(Space(d=10))
+
+    def testCountsAddUp(self):
+        report = self.path.efficiencyReport(emissionHalfAngle=0.5, nRays=2000)
+        self.assertIsInstance(report, EfficiencyReport)
+        self.assertEqual(report.nRays, 2000)
+        self.assertEqual(report.expectedBlockedCount + report.vignettedCount + report.transmittedCount, 2000)
+        self.assertAlmostEqual(report.efficiency, report.transmittedCount / 2000)
+
+    def testSameAsOneRayAtATime(self):
+        report = self.path.efficiencyReport(emissionHalfAngle=0.5, nRays=200)
+        principal = self.path.principalRay()
+        axial = self.path.axialRay()
+        Iap = abs(self.path.lagrangeInvariant())
+
+        source = Rays()
+        for i in range(200):
+            # The rays are not kept: we find them back from the invariants
+            Irp = report.Irp[i] * Iap
+            Iar = report.Iar[i] * Iap
+            # Irp = theta*yp - y*thetap and Iar = thetaa*y - ya*theta
+            matrix = np.array([[-principal.theta, principal.y], [axial.theta, -axial.y]])
+            (y, theta) = np.linalg.solve(matrix, [Irp, Iar])
+            source.append(Ray(y=y, theta=theta))
+
+        for i, ray in enumerate(source):
+            self.assertAlmostEqual(self.path.opticalInvariant(ray, principal) / Iap, report.Irp[i])
+            self.assertAlmostEqual(self.path.opticalInvariant(axial, ray) / Iap, report.Iar[i])
+            outputRay = self.path.traceThrough(Ray(y=ray.y, theta=ray.theta))
+            if not report.isExpectedBlocked[i]:
+                self.assertEqual(outputRay.isBlocked, bool(report.isVignetted[i]))
+                if outputRay.isBlocked:
+                    self.assertAlmostEqual(outputRay.z, report.blockedPositions[i])
+
+    def testVignettingPositions(self):
+        report = self.path.efficiencyReport(emissionHalfAngle=0.5, nRays=2000)
+        for position in report.vignettingPositions:
+            self.assertIn(position, [10, 20, 30])
+
+    def testObjectDiameter(self):
+        report = self.path.efficiencyReport(objectDiameter=2, emissionHalfAngle=0.1, nRays=100)
+        self.assertEqual(report.maxHeight, 1)
+        self.assertEqual(report.maxAngle, 0.1)
+        self.assertAlmostEqual(report.sourceInvariant, 0.1)
+
+    def testPrintSummary(self):
+        report = self.path.efficiencyReport(emissionHalfAngle=0.5, nRays=1000)
+
+        @envtest.redirectStdOutToFile
+        def printSummary():
+            report.printSummary()
+
+        printed = printSummary()
+        self.assertIn("Collection efficiency from Monte Carlo: {0:.1f}%".format(100 * report.efficiency), printed)
+        self.assertIn("Relative efficiency", printed)
+
+    def testEmptyReport(self):
+        report = EfficiencyReport(label="", lagrangeInvariant=1, principalRay=Ray(), axialRay=Ray(), NA=0, fNumber=0,
+                                  fieldOfView=0, apertureStop=(0, 1), maxHeight=1, maxAngle=1, Irp=np.array([]),
+                                  Iar=np.array([]), isBlocked=np.array([], dtype=bool),
+                                  blockedPositions=np.array([]))
+        self.assertEqual(report.efficiency, 0)
+        self.assertEqual(report.relativeEfficiency, 0)
+        self.assertEqual(report.vignettingPositions, set())
+
+
+if __name__ == '__main__':
+    envtest.main()
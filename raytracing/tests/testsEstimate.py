@@ -0,0 +1,168 @@
+import envtest  # modifies path
+import numpy as np
+
+from raytracing import *
+
+inf = float("+inf")
+
+
+class TestTransmissionEstimate(envtest.RaytracingTestCase):
+    def testInvalidConfidence(self):
+        with self.assertRaises(ValueError):
+            TransmissionEstimate(confidence=1)
+
+    def testDetectorMustBeEmpty(self):
+        detector = Detector()
+        detector.add([0], [0])
+        with self.assertRaises(ValueError):
+            TransmissionEstimate(detector=detector)
+
+    def testEmpty(self):
+        estimate = TransmissionEstimate()
+        self.assertEqual(estimate.transmission, 0)
+        self.assertEqual(estimate.confidenceInterval, (0, 1))
+        self.assertEqual(estimate.relativeError, inf)
+
+    def testWilsonInterval(self):
+        estimate = TransmissionEstimate(confidence=0.95)
+        estimate.add(np.array([True] * 10 + [False] * 90))
+        (low, high) = estimate.confidenceInterval
+        self.assertAlmostEqual(estimate.transmission, 0.1)
+        self.assertAlmostEqual(low, 0.05523, places=4)
+        self.assertAlmostEqual(high, 0.17437, places=4)
+
+    def testNoRayTransmittedHasAnInterval(self):
+        estimate = TransmissionEstimate()
+        estimate.add(np.zeros(1000, dtype=bool))
+        (low, high) = estimate.confidenceInterval
+        self.assertAlmostEqual(low, 0)
+        self.assertTrue(0 < high < 0.005)
+        self.assertEqual(estimate.relativeError, inf)
+
+    def testWeightedInterval(self):
+        estimate = TransmissionEstimate(confidence=0.95)
+        isTransmitted = np.array([True] * 300 + [False] * 700)
+        estimate.add(isTransmitted, weights=np.full(1000, 2.0))
+        self.assertTrue(estimate.isWeighted)
+        (low, high) = estimate.confidenceInterval
+        self.assertAlmostEqual(estimate.transmission, 0.3)
+        self.assertAlmostEqual((high - low) / 2, 1.959964 * np.sqrt(0.3 * 0.7 / 1000), places=6)
+
+    def testWeightedTransmission(self):
+        estimate = TransmissionEstimate()
+        estimate.add(np.array([True, False]), weights=np.array([3.0, 1.0]))
+        estimate.add(np.array([False]), weights=np.array([4.0]))
+        self.assertAlmostEqual(estimate.transmission, 3 / 8)
+        self.assertEqual(estimate.rayCount, 3)
+
+    def testIntervalsCoverTheTransmission(self):
+        path = ImagingPath([Space(d=10), Aperture(diameter=2)])
+        exact = path.collectionEfficiency(UniformRays(yMax=1, thetaMax=0.1))
+        covered = 0
+        for seed in range(200):
+            estimate = path.estimateTransmission(RandomUniformRays(yMax=1, thetaMax=0.1, maxCount=500, seed=seed),
+                                                 relativeError=0)
+            (low, high) = estimate.confidenceInterval
+            covered += low <= exact <= high
+        self.assertTrue(180 <= covered <= 200)
+
+    def testBinIntervals(self):
+        detector = Detector(yBinCount=2, yRange=(-1, 1))
+        estimate = TransmissionEstimate(detector=detector)
+        isTransmitted = np.array([True, True, True, False])
+        estimate.add(isTransmitted, y=np.array([-0.5, 0.5, 0.5]), theta=np.zeros(3))
+        (fraction, low, high) = estimate.binConfidenceIntervals()
+        self.assertTrue(np.allclose(fraction, [0.25, 0.5]))
+        self.assertTrue(np.all(low <= fraction) and np.all(fraction <= high))
+        self.assertEqual(len(estimate.binRelativeErrors(binThreshold=0.6)), 1)
+
+    def testBinIntervalsWithoutDetector(self):
+        with self.assertRaises(ValueError):
+            TransmissionEstimate().binConfidenceIntervals()
+
+
+class TestEstimateTransmission(envtest.RaytracingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = ImagingPath([Space(d=10), Lens(f=10, diameter=3), Space(d=10), Aperture(diameter=0.7)])
+        self.exact = self.path.collectionEfficiency(UniformRays(yMax=1, thetaMax=0.3))
+
+    def testConverges(self):
+        source = RandomUniformRays(yMax=1, thetaMax=0.3, maxCount=10000000, seed=2)
+        estimate = self.path.estimateTransmission(source, relativeError=0.05, chunkSize=1000)
+        self.assertEqual(estimate.stopReason, 'converged')
+        self.assertLessEqual(estimate.relativeError, 0.05)
+        self.assertLess(estimate.rayCount, 100000)
+        self.assertAlmostEqual(estimate.transmission, self.exact, delta=3 * 0.05 * self.exact)
+
+    def testNeedsFewerRaysForLargeTransmission(self):
+        source = RandomUniformRays(yMax=1, thetaMax=0.3, maxCount=10000000, seed=2)
+        estimate = ImagingPath([Space(d=10)]).estimateTransmission(source, relativeError=0.01, chunkSize=1000)
+        self.assertEqual(estimate.stopReason, 'converged')
+        self.assertEqual(estimate.rayCount, 1000)
+        self.assertEqual(estimate.transmission, 1)
+
+    def testMaxRayCount(self):
+        source = RandomUniformRays(yMax=1, thetaMax=0.3, maxCount=10000000, seed=2)
+        estimate = self.path.estimateTransmission(source, relativeError=1e-6, chunkSize=1000, maxRayCount=2500)
+        self.assertEqual(estimate.stopReason, 'maxRayCount')
+        self.assertEqual(estimate.rayCount, 2500)
+        self.assertGreater(estimate.relativeError, 1e-6)
+
+    def testMaxTime(self):
+        source = RandomUniformRays(yMax=1, thetaMax=0.3, maxCount=10000000, seed=2)
+        estimate = self.path.estimateTransmission(source, relativeError=1e-6, chunkSize=1000, maxTime=0)
+        self.assertEqual(estimate.stopReason, 'maxTime')
+        self.assertEqual(estimate.rayCount, 1000)
+
+    def testSourceExhausted(self):
+        source = UniformRays(yMax=1, thetaMax=0.3, M=50, N=50)
+        estimate = self.path.estimateTransmission(source, relativeError=1e-6, chunkSize=1000)
+        self.assertEqual(estimate.stopReason, 'sourceExhausted')
+        self.assertEqual(estimate.rayCount, 2500)
+        outputRays = self.path.traceManyThrough(source, progress=False)
+        self.assertAlmostEqual(estimate.transmission, outputRays.count / 2500)
+
+    def testWeightedSource(self):
+        source = LambertianRays(yMax=1, M=20, N=20, I=20)
+        estimate = self.path.estimateTransmission(source, relativeError=1e-6)
+        outputRays = self.path.traceManyThrough(source, progress=False)
+        self.assertTrue(estimate.isWeighted)
+        self.assertAlmostEqual(estimate.transmission, outputRays.totalWeight / source.totalWeight)
+
+    def testImportanceSampledSourceNeedsFewerRays(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=3), Space(d=10), Aperture(diameter=0.05)])
+        source = RandomUniformRays(yMax=1, thetaMax=0.3, maxCount=10000000, seed=4)
+        exact = path.collectionEfficiency(source)
+        estimate = path.estimateTransmission(source, relativeError=0.05, chunkSize=1000)
+        importanceEstimate = path.estimateTransmission(path.importanceSampledRays(source, seed=5),
+                                                       relativeError=0.05, chunkSize=1000)
+        self.assertEqual(importanceEstimate.stopReason, 'converged')
+        self.assertTrue(importanceEstimate.isNormalized)
+        self.assertLess(importanceEstimate.rayCount * 10, estimate.rayCount)
+        self.assertAlmostEqual(importanceEstimate.transmission, exact, delta=3 * 0.05 * exact)
+
+    def testNormalizedInterval(self):
+        estimate = TransmissionEstimate()
+        weights = np.array([0.5, 0.5, 2.0, 1.0])
+        estimate.add(np.array([True, True, False, False]), weights=weights, totalWeight=4)
+        self.assertAlmostEqual(estimate.transmission, 0.25)
+        (low, high) = estimate.confidenceInterval
+        standardDeviation = np.std([0.5, 0.5, 0, 0]) / np.sqrt(4)
+        self.assertAlmostEqual((high - low) / 2, estimate.z * standardDeviation)
+
+    def testDetectorBinsConverge(self):
+        source = RandomUniformRays(yMax=1, thetaMax=0.3, maxCount=10000000, seed=3)
+        detector = Detector(yBinCount=5, yRange=(-0.35, 0.35))
+        estimate = self.path.estimateTransmission(source, relativeError=0.05, detector=detector, chunkSize=1000)
+        self.assertEqual(estimate.stopReason, 'converged')
+        self.assertTrue(np.all(estimate.binRelativeErrors(0.1) <= 0.05))
+        self.assertEqual(detector.rayCount, round(estimate.transmittedWeight))
+
+        withoutDetector = self.path.estimateTransmission(RandomUniformRays(yMax=1, thetaMax=0.3, maxCount=10000000,
+                                                                           seed=3), relativeError=0.05, chunkSize=1000)
+        self.assertGreater(estimate.rayCount, withoutDetector.rayCount)
+
+
+if __name__ == '__main__':
+    envtest.main()
@@ -0,0 +1,126 @@
+import envtest  # modifies path
+import numpy as np
+
+from raytracing import *
+
+inf = float("+inf")
+
+
+class TestGaussianBeams(envtest.RaytracingTestCase):
+    def testNeedsQOrW(self):
+        with self.assertRaises(ValueError):
+            GaussianBeams()
+
+    def testWAndQGivenMismatch(self):
+        with self.assertRaises(ValueError):
+            GaussianBeams(q=[4.96459e3j * 1.007], w=1)
+        self.assertDoesNotRaise(GaussianBeams, ValueError, q=[4.96459e3j], w=1)
+
+    def testSameAsGaussianBeam(self):
+        parameters = [dict(w=1), dict(w=0.1, R=20), dict(w=inf, R=2), dict(q=0), dict(w=0.5, R=-10, n=1.5),
+                      dict(w=2, wavelength=1e-3)]
+        for kwargs in parameters:
+            beam = GaussianBeam(**kwargs)
+            beams = GaussianBeams(**kwargs)
+            self.assertEqual(beams.isFinite, beam.isFinite)
+            self.assertAlmostEqual(beams.w, beam.w)
+            self.assertAlmostEqual(beams.R, beam.R)
+            self.assertAlmostEqual(beams.zo, beam.zo)
+            self.assertAlmostEqual(beams.waistPosition, beam.waistPosition)
+            if beam.wo is None:
+                self.assertTrue(np.isnan(beams.wo))
+            else:
+                self.assertAlmostEqual(beams.waist, beam.waist)
+
+    def testBroadcast(self):
+        beams = GaussianBeams(w=1, wavelength=[400e-6, 500e-6, 600e-6], z=5)
+        self.assertEqual(len(beams), 3)
+        self.assertEqual(beams.shape, (3,))
+        self.assertTrue(np.array_equal(beams.z, [5, 5, 5]))
+        self.assertTrue(np.allclose(beams.w, 1))
+        self.assertFalse(np.any(beams.isClipped))
+
+    def testFromBeamsAndBack(self):
+        beamList = [GaussianBeam(w=1, z=2), GaussianBeam(w=2, R=10, n=1.5, wavelength=1e-3)]
+        beamList[1].isClipped = True
+        beams = GaussianBeams.fromBeams(beamList)
+        for beam, other in zip(beamList, beams):
+            self.assertIsInstance(other, GaussianBeam)
+            self.assertEqual(other.q, beam.q)
+            self.assertEqual(other.z, beam.z)
+            self.assertEqual(other.n, beam.n)
+            self.assertEqual(other.wavelength, beam.wavelength)
+            self.assertEqual(other.isClipped, beam.isClipped)
+
+    def testSlice(self):
+        beams = GaussianBeams(w=[1, 2, 3])
+        part = beams[1:]
+        self.assertIsInstance(part, GaussianBeams)
+        self.assertTrue(np.allclose(part.w, [2, 3]))
+
+
+class TestTraceBeams(envtest.RaytracingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = LaserPath([Space(d=100), Lens(f=50, diameter=2), Space(d=50),
+                               ThickLens(R1=20, R2=-20, n=1.5, thickness=5, diameter=10), Space(d=30)])
+        self.beamList = [GaussianBeam(w=w, R=R, wavelength=wavelength)
+                         for w in [0.1, 0.5, 1.5] for R in [inf, 100, -50] for wavelength in [400e-6, 800e-6]]
+
+    def testMulBeamsSameAsMulBeam(self):
+        element = ThickLens(R1=20, R2=-20, n=1.5, thickness=5, diameter=1)
+        outputBeams = element.mul_beams(GaussianBeams.fromBeams(self.beamList))
+        for beam, outputBeam in zip(self.beamList, outputBeams):
+            expected = element.mul_beam(beam)
+            self.assertAlmostEqual(outputBeam.q, expected.q)
+            self.assertEqual(outputBeam.z, expected.z)
+            self.assertEqual(outputBeam.n, expected.n)
+            self.assertEqual(outputBeam.isClipped, expected.isClipped)
+
+    def testMulBeamsWarnsForIndex(self):
+        with self.assertWarns(UserWarning):
+            DielectricInterface(n1=1.5, n2=1, R=10).mul_beams(GaussianBeams(w=[1, 2]))
+
+    def testSameAsTrace(self):
+        traces = self.path.traceBeams(GaussianBeams.fromBeams(self.beamList))
+        self.assertEqual(traces.shape, (len(self.beamList), 6))
+        for i, beam in enumerate(self.beamList):
+            beamTrace = self.path.trace(beam)
+            self.assertEqual(len(beamTrace), traces.shape[1])
+            for k, expected in enumerate(beamTrace):
+                self.assertAlmostEqual(traces.w[i, k], expected.w)
+                self.assertAlmostEqual(traces.R[i, k], expected.R)
+                self.assertAlmostEqual(traces.waist[i, k], expected.waist)
+                self.assertAlmostEqual(traces.waistPosition[i, k], expected.waistPosition)
+                self.assertEqual(traces.z[i, k], expected.z)
+                self.assertEqual(traces.n[i, k], expected.n)
+                self.assertEqual(traces.isClipped[i, k], expected.isClipped)
+
+    def testClippingIsKept(self):
+        traces = self.path.traceBeams(GaussianBeams(w=[0.5, 1.5]))
+        self.assertTrue(np.array_equal(traces.isClipped[:, -1], [False, True]))
+        self.assertTrue(np.all(traces.isClipped[1, 2:]))
+
+    def testTraceBeamsOfGaussianBeam(self):
+        traces = self.path.traceBeams(GaussianBeam(w=1))
+        self.assertEqual(traces.shape, (1, 6))
+
+    def testNestedGroups(self):
+        path = LaserPath([Space(d=10), MatrixGroup([Lens(f=10), Space(d=10)])])
+        beam = GaussianBeam(w=1)
+        traces = path.traceBeams([beam])
+        beamTrace = path.trace(beam)
+        self.assertEqual(traces.shape[1], len(beamTrace))
+        self.assertTrue(np.allclose(traces.q[0], [beam.q for beam in beamTrace]))
+
+    def testEmpty(self):
+        traces = self.path.traceBeams(GaussianBeams(q=[]))
+        self.assertEqual(traces.shape, (0, 6))
+
+    def testElementOverridingMulBeam(self):
+        with self.assertRaises(TypeError):
+            LaserPath([Space(d=10), Axicon(alpha=0.01, n=1.5)]).traceBeams(GaussianBeams(w=[1, 2]))
+
+
+if __name__ == '__main__':
+    envtest.main()
@@ -310,6 +310,264 @@ class TestImagingPath(envtest.RaytracingTestCase):
         with self.assertRaises(ValueError):
             path.chiefRay()
 
+    def testFieldStopIsExact(self):
+        path = ImagingPath([Space(d=20), Lens(f=20, diameter=5), Space(d=30), Lens(f=10, diameter=10), Space(d=10)])
+        self.assertTupleEqual(path.fieldStop(), (50, 10))
+        self.assertAlmostEqual(path.halfFieldOfView(), 10 / 3, places=12)
+
+    def testFieldStopWithManyApertures(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=25), Space(d=5), Aperture(diameter=12), Space(d=15),
+                            Lens(f=10, diameter=40), Space(d=10)])
+        self.assertTupleEqual(path.apertureStop(), (15, 12))
+        self.assertTupleEqual(path.fieldStop(), (30, 40))
+        chiefRay = path.chiefRay(y=1)
+        heightAtFieldStop = path.transferMatrix(upTo=30) * chiefRay
+        self.assertAlmostEqual(path.halfFieldOfView(), 20 / abs(heightAtFieldStop.y))
+
+    def testPrincipalRayIsNotBlocked(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=25), Space(d=5), Aperture(diameter=12), Space(d=15),
+                            Lens(f=10, diameter=50), Space(d=10)])
+        principalRay = path.principalRay()
+        self.assertFalse(path.traceThrough(principalRay).isBlocked)
+        higherRay = path.chiefRay(y=principalRay.y * 1.000001)
+        self.assertTrue(path.traceThrough(higherRay).isBlocked)
+
+    def testFieldLimitBySearchSameAsExact(self):
+        path = ImagingPath([Space(d=20), Lens(f=20, diameter=5), Space(d=30), Lens(f=10, diameter=10), Space(d=10)])
+        (position, diameter, halfFieldOfView) = path.fieldLimitBySearch()
+        self.assertEqual((position, diameter), (50, 10))
+        self.assertAlmostEqual(halfFieldOfView, 10 / 3, delta=2 * path.precision)
+
+    def testFieldLimitWithNonLinearElementIsSearched(self):
+        class Deflector(Matrix):
+            def __init__(self, deviation):
+                super(Deflector, self).__init__()
+                self.deviation = deviation
+
+            def mul_ray(self, rightSideRay):
+                outputRay = super(Deflector, self).mul_ray(rightSideRay)
+                if rightSideRay.y >= self.deviation[0]:
+                    outputRay.theta += self.deviation[1]
+                return outputRay
+
+        # The chief rays that reach it above y=1 are deflected and blocked, unlike what the matrices predict
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Deflector((1, 0.5)), Space(d=20),
+                            Aperture(diameter=3), Space(d=5)])
+        (position, diameter, halfFieldOfView) = path.fieldLimit()
+        self.assertEqual((position, diameter), (30, 3))
+        self.assertGreater(halfFieldOfView, 0)
+        self.assertFalse(path.traceThrough(path.chiefRay(y=halfFieldOfView)).isBlocked)
+        self.assertTrue(path.traceThrough(path.chiefRay(y=halfFieldOfView + 2 * path.precision)).isBlocked)
+
+        # Even the chief ray on axis is blocked
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Deflector((-inf, 0.5)), Space(d=20),
+                            Aperture(diameter=3), Space(d=5)])
+        self.assertEqual(path.fieldLimit(), (30, 3, 0))
+
+    def testFieldStopBeyondMaxHeight(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10), Aperture(diameter=100)])
+        path.maxHeight = 10
+        self.assertTupleEqual(path.fieldStop(), (None, inf))
+        self.assertEqual(path.halfFieldOfView(), inf)
+
+    def testAcceptancePolygonOfSingleAperture(self):
+        path = ImagingPath([Space(d=10), Aperture(diameter=2)])
+        (vertices, limits) = path.acceptancePolygon(yMax=1, thetaMax=0.1)
+        self.assertEqual(vertices.shape, (6, 2))
+        self.assertAlmostEqual(ImagingPath.polygonIntegral(vertices), 0.3)
+        self.assertEqual(limits.count((10, 2)), 2)
+        self.assertEqual(limits.count(None), 4)
+
+    def testAcceptancePolygonNoRayGoesThrough(self):
+        path = ImagingPath([Space(d=10), Aperture(diameter=2)])
+        (vertices, limits) = path.acceptancePolygon(yMax=10, yMin=5, thetaMax=0.01)
+        self.assertEqual(len(vertices), 0)
+        self.assertEqual(path.collectionEfficiency(UniformRays(yMax=10, yMin=5, thetaMax=0.01)), 0)
+
+    def testAcceptancePolygonLimitingApertures(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10), Aperture(diameter=4)])
+        (vertices, limits) = path.acceptancePolygon(yMax=20, thetaMax=1)
+        self.assertSetEqual(set(limits), {(10, 10), (20, 4)})
+
+    def testCollectionEfficiencyOfUniformSource(self):
+        path = ImagingPath([Space(d=10), Aperture(diameter=2)])
+        self.assertAlmostEqual(path.collectionEfficiency(UniformRays(yMax=1, thetaMax=0.1)), 0.75)
+        self.assertAlmostEqual(path.collectionEfficiency(RandomUniformRays(yMax=1, thetaMax=0.1)), 0.75)
+
+    def testCollectionEfficiencyMatchesTracing(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10), Aperture(diameter=4),
+                            Space(d=5), Lens(f=5, diameter=6), Space(d=5)])
+        source = RandomUniformRays(yMax=5, thetaMax=0.5, maxCount=20000)
+        outputRays = path.traceManyThrough(source, progress=False)
+        self.assertAlmostEqual(path.collectionEfficiency(source), len(outputRays) / len(source), delta=0.02)
+
+    def testCollectionEfficiencyOfLambertianSource(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10), Aperture(diameter=4)])
+        source = LambertianRays(yMax=2, M=200, N=200)
+        outputRays = path.traceManyThrough(source, progress=False)
+        efficiency = path.collectionEfficiency(source)
+        self.assertAlmostEqual(efficiency, outputRays.totalWeight / source.totalWeight, delta=0.02)
+        self.assertNotAlmostEqual(efficiency, path.collectionEfficiency(UniformRays(yMax=2)), delta=0.02)
+
+    def testCollectionEfficiencyOfOtherRays(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10), Aperture(diameter=4)])
+        source = Rays(RandomUniformRays(yMax=5, thetaMax=0.5, maxCount=1000))
+        outputRays = path.traceManyThrough(source, progress=False)
+        self.assertAlmostEqual(path.collectionEfficiency(source), len(outputRays) / len(source))
+
+    def testImportanceSampledRaysFromAcceptance(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=3), Space(d=10), Aperture(diameter=0.05)])
+        source = RandomUniformRays(yMax=1, thetaMax=0.3, maxCount=20000)
+        rays = path.importanceSampledRays(source, seed=1)
+        self.assertEqual(rays.maxCount, 20000)
+        outputRays = path.traceManyThrough(rays, progress=False)
+        self.assertGreater(outputRays.count, 0.85 * 20000)
+        exact = path.collectionEfficiency(source)
+        self.assertAlmostEqual(outputRays.totalWeight / rays.totalWeight, exact, delta=0.01 * exact)
+        self.assertAlmostEqual(path.collectionEfficiency(rays), exact, delta=0.01 * exact)
+
+    def testImportanceSampledRaysFromPilotRun(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=3), Space(d=10), Aperture(diameter=0.05)])
+        source = RandomUniformRays(yMax=1, thetaMax=0.3, maxCount=20000, seed=2)
+        rays = path.importanceSampledRays(source, pilotCount=20000, seed=3)
+        (yMin, thetaMin) = np.min(rays.region, axis=0)
+        (yMax, thetaMax) = np.max(rays.region, axis=0)
+        self.assertEqual((yMin, yMax), (-1, 1))
+        self.assertTrue(-0.0035 < thetaMin < -0.0025 and 0.0025 < thetaMax < 0.0035)
+        outputRays = path.traceManyThrough(rays, progress=False)
+        exact = path.collectionEfficiency(source)
+        self.assertAlmostEqual(outputRays.totalWeight / rays.totalWeight, exact, delta=0.03 * exact)
+
+    def testImportanceSampledRaysWithoutTransmittedPilotRays(self):
+        path = ImagingPath([Space(d=10), Aperture(diameter=0.1)])
+        source = RandomUniformRays(yMax=2, yMin=1, thetaMax=0.01, maxCount=100)
+        rays = path.importanceSampledRays(source, pilotCount=100)
+        self.assertEqual(rays.defensiveFraction, 1)
+
+    def testImportanceSampledRaysWithPilotRegionWithoutArea(self):
+        path = ImagingPath([Space(d=10), Aperture(diameter=10)])
+        source = RandomUniformRays(yMax=1, thetaMax=0.1, maxCount=100)
+        rays = path.importanceSampledRays(source, pilotCount=1)
+        self.assertEqual(rays.defensiveFraction, 1)
+        self.assertTrue(np.all(rays.weights == 1))
+
+    def testAnalysisIsKeptUntilPathChanges(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10)])
+        self.assertEqual(path.apertureStop(), (10, 10))
+        version = path.version
+        self.assertEqual(path.apertureStop(), (10, 10))
+        self.assertIsNotNone(path._analysisKey)
+        self.assertEqual(path.version, version)
+
+        path.append(Lens(f=10, diameter=4))
+        self.assertGreater(path.version, version)
+        self.assertEqual(path.apertureStop(), (20, 4))
+
+    def testAnalysisChangesWhenElementIsModified(self):
+        lens = Lens(f=10, diameter=10)
+        path = ImagingPath([Space(d=10), lens, Space(d=10), Aperture(diameter=50)])
+        self.assertEqual(path.apertureStop(), (10, 10))
+        lens.apertureDiameter = 1
+        lens.invalidate()
+        self.assertEqual(path.apertureStop(), (10, 1))
+
+    def testAnalysisChangesWhenElementOfNestedGroupIsModified(self):
+        lens = Lens(f=10, diameter=10)
+        path = ImagingPath([Space(d=10), MatrixGroup([lens]), Space(d=10), Aperture(diameter=50)])
+        self.assertEqual(path.apertureStop(), (10, 10))
+        lens.apertureDiameter = 1
+        lens.invalidate()
+        self.assertEqual(path.apertureStop(), (10, 1))
+
+    def testAnalysisIsKeptWhenElementOfOtherPathIsModified(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10)])
+        self.assertEqual(path.apertureStop(), (10, 10))
+        lens = Lens(f=10, diameter=10)
+        otherPath = ImagingPath([Space(d=10), lens])
+        lens.apertureDiameter = 1
+        lens.invalidate()
+
+        analysisKey = path._analysisKey
+        self.assertEqual(path.apertureStop(), (10, 10))
+        self.assertIs(path._analysisKey, analysisKey)
+
+    def testAnalysisChangesWithInsertPopAndFlip(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10)])
+        self.assertEqual(path.entrancePupil(), (10, 10))
+        path.insert(0, Space(d=5))
+        self.assertEqual(path.entrancePupil(), (15, 10))
+        path.pop(0)
+        self.assertEqual(path.entrancePupil(), (10, 10))
+        path.flipOrientation()
+        self.assertEqual(path.apertureStop(), (10, 10))
+
+    def testModifyingReturnedRayDoesNotChangeAnalysis(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10)])
+        axialRay = path.axialRay()
+        theta = axialRay.theta
+        axialRay.theta = 0
+        self.assertEqual(path.axialRay().theta, theta)
+
+    def testTraceAfterAppendIsNotTheCachedTrace(self):
+        path = ImagingPath([Space(d=10)])
+        ray = Ray(y=1, theta=0.1)
+        self.assertEqual(path.trace(ray)[-1].z, 10)
+        path.append(Space(d=10))
+        self.assertEqual(path.trace(ray)[-1].z, 20)
+
+    def testRayDensityMapSameAsAlong(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=5), Space(d=10), Aperture(diameter=2), Space(d=10)])
+        rays = RandomUniformRays(yMax=2, thetaMax=0.3, maxCount=500)
+        (zValues, yValues, density) = path.rayDensityMap(rays, zBinCount=30, yBinCount=20, yRange=(-3, 3),
+                                                         chunkSize=128)
+        self.assertEqual(density.shape, (30, 20))
+        self.assertAlmostEqual(zValues[0], 0.5)
+
+        # The bins crossed by each ray in each column, from many samples
+        expected = np.zeros((30, 20))
+        for rayTrace in path.traceMany(rays):
+            for i, z in enumerate(zValues):
+                isCrossed = np.zeros(20, dtype=bool)
+                for zSample in np.linspace(z - 0.5, z + 0.5, 41):
+                    ray = Ray.along(rayTrace, z=zSample)
+                    if ray.isNotBlocked and -3 <= ray.y <= 3:
+                        isCrossed[min(int((ray.y + 3) / 6 * 20), 19)] = True
+                expected[i] += isCrossed
+        self.assertTrue(np.all(density >= expected - 1e-9))
+        self.assertTrue(np.abs(density - expected).sum() <= 0.01 * expected.sum())  # between the samples
+
+    def testRayDensityMapFillsTheSpanOfTheRays(self):
+        path = ImagingPath([Space(d=10)])
+        (zValues, yValues, density) = path.rayDensityMap([Ray(y=0, theta=0.5)], zBinCount=1, yBinCount=5,
+                                                         yRange=(0, 5))
+        self.assertTrue(np.array_equal(density, [[1, 1, 1, 1, 1]]))
+
+    def testRayDensityMapRayBlockedInsideColumn(self):
+        path = ImagingPath([Space(d=2), Aperture(diameter=1), Space(d=8)])
+        (zValues, yValues, density) = path.rayDensityMap([Ray(y=0, theta=0.45)], zBinCount=1, yBinCount=10,
+                                                         yRange=(0, 5))
+        self.assertTrue(np.array_equal(density, [[1, 1, 0, 0, 0, 0, 0, 0, 0, 0]]))
+
+    def testRayDensityMapRangeFromAllChunks(self):
+        path = ImagingPath([Space(d=10)])
+        rays = Rays()
+        rays.appendArrays(y=[0.1, 3], theta=[0, 0])
+        (zValues, yValues, density) = path.rayDensityMap(rays, zBinCount=2, yBinCount=6, chunkSize=1)
+        self.assertAlmostEqual(yValues[-1], 2.5)
+        self.assertTrue(np.array_equal(density.sum(axis=1), [2, 2]))
+
+    def testRayDensityMapWeights(self):
+        path = ImagingPath([Space(d=10)])
+        rays = Rays()
+        rays.appendArrays(y=[-0.5, 0.5], theta=[0, 0], weights=[1, 3])
+        (zValues, yValues, density) = path.rayDensityMap(rays, zBinCount=5, yBinCount=2)
+        self.assertEqual(list(yValues), [-0.25, 0.25])
+        self.assertTrue(np.array_equal(density, [[1, 3]] * 5))
+
+    def testRayDensityMapInvalidRange(self):
+        with self.assertRaises(ValueError):
+            ImagingPath().rayDensityMap([Ray()])
+
 
 if __name__ == '__main__':
     envtest.main()
@@ -1,5 +1,6 @@
 import envtest  # modifies path
 import subprocess
+import numpy as np
 
 from raytracing import *
 
@@ -278,6 +279,29 @@ class TestMatrix(envtest.RaytracingTestCase):
         trace = [ray, m * ray]
         self.assertListEqual(m.trace(ray), trace)
 
+    def testMulRayKeepsAperture(self):
+        ray = Ray(y=1, theta=1, z=2)
+        m = Matrix(A=1, B=2, C=0, D=1, physicalLength=1, apertureDiameter=3)
+        outputRay = m.mul_ray(ray)
+        self.assertEqual((outputRay.y, outputRay.theta, outputRay.z), (3, 1, 3))
+        self.assertEqual(outputRay.apertureDiameter, 3)
+        self.assertFalse(outputRay.isBlocked)
+        self.assertIsNot(outputRay, ray)
+        self.assertTrue(m.mul_ray(Ray(y=2)).isBlocked)
+
+    def testMulRayBlockedRayIsUnchanged(self):
+        ray = Ray(y=1, theta=1, isBlocked=True)
+        m = Matrix(A=1, B=2, C=0, D=1, physicalLength=1)
+        self.assertIs(m.mul_ray(ray), ray)
+
+    def testAppendTrace(self):
+        ray = Ray(y=1, theta=1)
+        m = Matrix(A=1, B=0, C=0, D=1, physicalLength=1)
+        rayTrace = [Ray()]
+        outputRay = m.appendTrace(ray, rayTrace)
+        self.assertListEqual(rayTrace, [Ray()] + m.trace(ray))
+        self.assertIs(outputRay, rayTrace[-1])
+
     def testTraceNullLength(self):
         ray = Ray(y=1, theta=1)
         m = Matrix(A=1, B=0, C=0, D=1)
@@ -356,6 +380,58 @@ class TestMatrix(envtest.RaytracingTestCase):
         # One less ray, because last is blocked
         self.assertEqual(len(traceManyThrough), len(rays) - 1)
 
+    def testTraceArraysThrough(self):
+        m = Matrix(A=1, B=0, C=-1 / 10, D=1, physicalLength=2, apertureDiameter=10)
+        y, theta, z, isBlocked = m.traceArraysThrough([1, 2, 6], [0, 0.5, 0])
+        self.assertTrue(np.allclose(y, [1, 2, 6]))
+        self.assertTrue(np.allclose(theta, [-0.1, 0.3, 0]))
+        self.assertTrue(np.allclose(z, [2, 2, 0]))
+        self.assertListEqual(list(isBlocked), [False, False, True])
+
+    def testTraceArraysThroughSameAsTraceThrough(self):
+        ys = np.linspace(-6, 6, 25)
+        thetas = np.linspace(-1, 1, 25)
+        for m in [Matrix(A=1, B=0, C=-1 / 10, D=1, physicalLength=2, apertureDiameter=10),
+                  Matrix(A=1, B=0, C=-1 / 10, D=1, physicalLength=0, apertureDiameter=10)]:
+            y, theta, z, isBlocked = m.traceArraysThrough(ys, thetas, z=1, isBlocked=thetas > 0.9)
+            for i in range(len(ys)):
+                ray = m.traceThrough(Ray(ys[i], thetas[i], z=1, isBlocked=bool(thetas[i] > 0.9)))
+                self.assertAlmostEqual(ray.y, y[i])
+                self.assertAlmostEqual(ray.theta, theta[i])
+                self.assertAlmostEqual(ray.z, z[i])
+                self.assertEqual(ray.isBlocked, isBlocked[i])
+
+    def testTraceArraysThroughDifferentLengths(self):
+        with self.assertRaises(ValueError):
+            Matrix().traceArraysThrough([1, 2], [1, 2, 3])
+
+    def testTraceArraysThroughSubclassWithMulRay(self):
+        class Inverter(Matrix):
+            def mul_ray(self, rightSideRay):
+                return Ray(-rightSideRay.y, -rightSideRay.theta, rightSideRay.z)
+
+        y, theta, z, isBlocked = Inverter().traceArraysThrough([1, 2], [3, 4])
+        self.assertListEqual(list(y), [-1, -2])
+        self.assertListEqual(list(theta), [-3, -4])
+
+    def testTraceManyThroughSameAsTraceThrough(self):
+        m = Matrix(A=1, B=2, C=-1 / 10, D=0.8, physicalLength=2, apertureDiameter=10)
+        rays = [Ray(y, theta) for y in np.linspace(-8, 8, 11) for theta in np.linspace(-1, 1, 5)]
+        expected = [m.traceThrough(ray) for ray in rays]
+        expected = [ray for ray in expected if ray.isNotBlocked]
+        outputRays = m.traceManyThrough(rays, progress=False)
+        self.assertEqual(len(outputRays), len(expected))
+        for ray, expectedRay in zip(outputRays, expected):
+            self.assertAlmostEqual(ray.y, expectedRay.y)
+            self.assertAlmostEqual(ray.theta, expectedRay.theta)
+            self.assertAlmostEqual(ray.z, expectedRay.z)
+
+    def testTraceManyThroughOutputSeveralSteps(self):
+        rays = [Ray(y, y) for y in range(25_000)]
+        m = Matrix(physicalLength=1)
+        self.assertPrints(m.traceManyThrough, "Progress 10000/25000 (40%) \nProgress 25000/25000 (100%)",
+                          inputRays=rays, progress=True)
+
     @envtest.skipIf(sys.platform == 'darwin' and sys.version_info.major == 3 and sys.version_info.minor <= 7,
                     "Endless loop on macOS")
     # Some information here: https://github.com/gammapy/gammapy/issues/2453
@@ -378,6 +454,23 @@ class TestMatrix(envtest.RaytracingTestCase):
             # Order is not kept, we have to check if the ray traced is in the original list
             self.assertIn(trace[i], rays)
 
+    @envtest.skipIf(sys.platform == 'darwin' and sys.version_info.major == 3 and sys.version_info.minor <= 7,
+                    "Endless loop on macOS")
+    def testTraceManyThroughInParallelKeepsWeights(self):
+        rays = Rays()
+        rays.appendArrays(y=[0, 1, 2, 3], theta=[0, 0, 0, 0], weights=[1, 2, 3, 4])
+        m = Matrix(physicalLength=1, apertureDiameter=5)
+        outputRays = m.traceManyThroughInParallel(rays, processes=2, progress=False)
+        self.assertTrue(outputRays.isWeighted)
+        self.assertEqual(outputRays.totalWeight, 6)
+
+    def testTraceManyThroughKeepsWeights(self):
+        rays = Rays()
+        rays.appendArrays(y=[0, 1, 2, 3], theta=[0, 0, 0, 0], weights=[1, 2, 3, 4])
+        m = Matrix(physicalLength=1, apertureDiameter=5)
+        outputRays = m.traceManyThrough(rays, progress=False)
+        self.assertListEqual(list(outputRays.weights), [1, 2, 3])
+
     @envtest.skipIf(sys.platform == 'darwin' and sys.version_info.major == 3 and sys.version_info.minor <= 7,
                     "Endless loop on macOS")
     # Some information here: https://github.com/gammapy/gammapy/issues/2453
@@ -1,4 +1,7 @@
 import envtest  # modifies path
+import numpy as np
+import time
+import copy
 
 from raytracing import *
 
@@ -233,6 +236,142 @@ class TestMatrixGroup(envtest.RaytracingTestCase):
         self.assertEqual(mg._lastRayToBeTraced, trace[0])
         self.assertTrue(mgTrace2[-1].isBlocked)
 
+    def testTraceSameAsElementByElement(self):
+        class Inverter(Matrix):
+            def mul_ray(self, rightSideRay):
+                return Ray(-rightSideRay.y, -rightSideRay.theta, rightSideRay.z)
+
+        elements = [Space(2, diameter=5), Lens(6, diameter=5), Inverter(), Space(d=3),
+                    MatrixGroup([Lens(f=5), Space(d=2, diameter=8)]),
+                    ThickLens(n=1.5, R1=10, R2=-10, thickness=2, diameter=8)]
+        mg = MatrixGroup(elements)
+        for ray in [Ray(1, 0.1), Ray(-2, 0.5), Ray(3, -0.2)]:
+            trace = [Ray(ray.y, ray.theta)]
+            for element in elements:
+                trace.extend(element.trace(trace[-1]))
+            mgTrace = mg.trace(ray)
+            self.assertEqual(len(mgTrace), len(trace))
+            for (mgRay, elementRay) in zip(mgTrace, trace):
+                self.assertAlmostEqual(mgRay.y, elementRay.y)
+                self.assertAlmostEqual(mgRay.theta, elementRay.theta)
+                self.assertAlmostEqual(mgRay.z, elementRay.z)
+                self.assertEqual(mgRay.isBlocked, elementRay.isBlocked)
+                self.assertEqual(mgRay.apertureDiameter, elementRay.apertureDiameter)
+
+    def testTraceAfterElementModified(self):
+        lens = Lens(f=10)
+        mg = MatrixGroup([Space(d=10), lens])
+        self.assertAlmostEqual(mg.trace(Ray(1, 0))[-1].theta, -0.1)
+        lens.C = -0.2
+        lens.invalidate()
+        self.assertAlmostEqual(mg.trace(Ray(1, 0))[-1].theta, -0.2)
+        mg.append(Space(d=5))
+        self.assertAlmostEqual(mg.trace(Ray(1, 0))[-1].y, 0)
+
+    def testTraceArraysThrough(self):
+        s = Space(2, diameter=5)
+        l = Lens(6, diameter=5)
+        mg = MatrixGroup([s, l, Space(4), Aperture(3)])
+        ys = [-3, -1, 0, 1, 2, 2.4]
+        thetas = [0, 0.5, 0.1, 0.1, 2, -0.1]
+        y, theta, z, isBlocked = mg.traceArraysThrough(ys, thetas)
+        for i in range(len(ys)):
+            ray = mg.traceThrough(Ray(ys[i], thetas[i]))
+            self.assertAlmostEqual(ray.y, y[i])
+            self.assertAlmostEqual(ray.theta, theta[i])
+            self.assertAlmostEqual(ray.z, z[i])
+            self.assertEqual(ray.isBlocked, isBlocked[i])
+
+    def testTraceArraysThroughEmptyMatrixGroup(self):
+        y, theta, z, isBlocked = MatrixGroup().traceArraysThrough([1, 2], [3, 4])
+        self.assertListEqual(list(y), [1, 2])
+        self.assertListEqual(list(theta), [3, 4])
+        self.assertListEqual(list(isBlocked), [False, False])
+
+    def testCompileFusesElementsWithoutAperture(self):
+        mg = MatrixGroup([Space(10), Lens(10), Space(10), Lens(10, diameter=25), Space(10)])
+        compiledPath = mg.compile()
+        self.assertEqual(len(compiledPath.steps), 3)
+        self.assertIs(compiledPath.steps[1], mg.elements[3])
+        self.assertAlmostEqual(compiledPath.steps[0].A, 0)
+        self.assertAlmostEqual(compiledPath.steps[0].B, 10)
+        self.assertAlmostEqual(compiledPath.steps[0].C, -0.1)
+        self.assertAlmostEqual(compiledPath.steps[0].D, 0)
+        self.assertAlmostEqual(compiledPath.steps[0].L, 20)
+        self.assertAlmostEqual(compiledPath.A, mg.A)
+        self.assertAlmostEqual(compiledPath.B, mg.B)
+        self.assertAlmostEqual(compiledPath.C, mg.C)
+        self.assertAlmostEqual(compiledPath.D, mg.D)
+        self.assertAlmostEqual(compiledPath.L, mg.L)
+
+    def testCompileFlattensNestedGroups(self):
+        inner = MatrixGroup([Space(2), Lens(5, diameter=4), Space(2)])
+        mg = MatrixGroup([Space(10), inner, Space(3), Aperture(2)])
+        self.assertEqual(len(mg.flattenedElements()), 6)
+        compiledPath = mg.compile()
+        self.assertEqual(len(compiledPath.steps), 4)
+        self.assertIs(compiledPath.steps[1], inner.elements[1])
+        self.assertIs(compiledPath.compile(), compiledPath)
+
+    def testCompileEmptyGroup(self):
+        compiledPath = MatrixGroup().compile()
+        self.assertEqual(len(compiledPath.steps), 0)
+        self.assertTrue(compiledPath.isIdentity)
+
+    def testCompiledPathTracesLikeGroup(self):
+        inner = MatrixGroup([Space(2), Lens(5, diameter=4), Space(2)])
+        mg = MatrixGroup([Space(10), inner, Space(3), ThickLens(1.5, 10, -10, 3, diameter=6), Space(5)])
+        compiledPath = mg.compile()
+        ys = np.linspace(-3, 3, 31)
+        thetas = np.linspace(-0.3, 0.3, 31)
+        y, theta, z, isBlocked = compiledPath.traceArraysThrough(ys, thetas)
+        for i in range(len(ys)):
+            ray = mg.traceThrough(Ray(ys[i], thetas[i]))
+            self.assertAlmostEqual(ray.y, y[i])
+            self.assertAlmostEqual(ray.theta, theta[i])
+            self.assertAlmostEqual(ray.z, z[i])
+            self.assertEqual(ray.isBlocked, isBlocked[i])
+            self.assertEqual(compiledPath.traceThrough(Ray(ys[i], thetas[i])).isBlocked, ray.isBlocked)
+
+    def testCompileKeepsElementsWithTheirOwnMulRay(self):
+        class Inverter(Matrix):
+            def mul_ray(self, rightSideRay):
+                return Ray(-rightSideRay.y, -rightSideRay.theta, rightSideRay.z)
+
+        inverter = Inverter()
+        mg = MatrixGroup([Space(10), Lens(10), inverter, Space(10)])
+        compiledPath = mg.compile()
+        self.assertEqual(len(compiledPath.steps), 3)
+        self.assertIs(compiledPath.steps[1], inverter)
+        y, theta, z, isBlocked = mg.traceArraysThrough([1], [0])
+        ray = mg.traceThrough(Ray(1, 0))
+        self.assertAlmostEqual(ray.y, y[0])
+        self.assertAlmostEqual(ray.theta, theta[0])
+
+    def testCompileIsKeptUntilGroupChanges(self):
+        inner = MatrixGroup([Lens(10)])
+        mg = MatrixGroup([Space(10), inner, Space(10), Aperture(diameter=10)])
+        compiledPath = mg.compile()
+        self.assertIs(mg.compile(), compiledPath)
+        self.assertIs(mg.compile(), compiledPath)
+
+        mg.elements[0].B = 5
+        mg.elements[0].L = 5
+        mg.elements[0].invalidate()
+        self.assertIsNot(mg.compile(), compiledPath)
+        self.assertAlmostEqual(mg.compile().steps[0].L, 15)
+
+        compiledPath = mg.compile()
+        inner.elements[0].C = -0.2
+        inner.elements[0].invalidate()
+        self.assertAlmostEqual(mg.compile().steps[0].C, -0.2)
+
+        compiledPath = mg.compile()
+        mg.append(Space(10))
+        self.assertAlmostEqual(mg.compile().L, 25)
+        y, theta, z, isBlocked = mg.traceArraysThrough([1], [0])
+        self.assertAlmostEqual(z[0], 25)
+
     def testTraceIncorrectType(self):
         s = Space(2, diameter=5)
         l = Lens(6, diameter=5)
@@ -508,6 +647,197 @@ class TestMatrixGroup(envtest.RaytracingTestCase):
         mg[0] = space
         self.assertListEqual(mg.elements, [space, lens, space])
 
+    def assertGroupHasTransferMatrixOfElements(self, mg):
+        transferMatrix = Matrix(A=1, B=0, C=0, D=1)
+        for element in mg.elements:
+            transferMatrix = element * transferMatrix
+
+        self.assertAlmostEqual(mg.A, transferMatrix.A)
+        self.assertAlmostEqual(mg.B, transferMatrix.B)
+        self.assertAlmostEqual(mg.C, transferMatrix.C)
+        self.assertAlmostEqual(mg.D, transferMatrix.D)
+        self.assertAlmostEqual(mg.L, transferMatrix.L)
+        self.assertEqual(mg.frontVertex, transferMatrix.frontVertex)
+        self.assertEqual(mg.backVertex, transferMatrix.backVertex)
+
+    def testTransferMatrixAfterPopAndInsert(self):
+        mg = MatrixGroup([Space(10), Lens(10), Space(10), Space(20), Lens(20), Space(20)])
+        mg.pop(1)
+        self.assertGroupHasTransferMatrixOfElements(mg)
+        mg.insert(2, [Lens(5), Space(3)])
+        self.assertGroupHasTransferMatrixOfElements(mg)
+        mg.pop(-1)
+        self.assertGroupHasTransferMatrixOfElements(mg)
+        mg.insert(0, ThickLens(n=1.5, R1=10, R2=-10, thickness=2))
+        self.assertGroupHasTransferMatrixOfElements(mg)
+
+    def testTransferMatrixAfterSetItem(self):
+        mg = MatrixGroup([Space(10), Lens(10), Space(10), Space(20), Lens(20), Space(20)])
+        mg[1] = Lens(7)
+        self.assertGroupHasTransferMatrixOfElements(mg)
+        mg[-2] = Lens(3)
+        self.assertGroupHasTransferMatrixOfElements(mg)
+        mg[2:4] = [Space(1), Lens(2), Space(3)]
+        self.assertGroupHasTransferMatrixOfElements(mg)
+        self.assertEqual(len(mg), 7)
+
+    def testTransferMatrixAfterPopAll(self):
+        mg = MatrixGroup([Space(10), Lens(10)])
+        mg.pop(0)
+        mg.pop(0)
+        self.assertEqual((mg.A, mg.B, mg.C, mg.D, mg.L), (1, 0, 0, 1, 0))
+
+    def testTransferMatrixAfterElementsChangedDirectly(self):
+        mg = MatrixGroup([Space(10), Lens(10)])
+        mg.elements = [Lens(5)]
+        mg.append(Space(5))
+        self.assertGroupHasTransferMatrixOfElements(mg)
+
+    def slowTransferMatrix(self, mg, upTo):
+        transferMatrix = Matrix(A=1, B=0, C=0, D=1)
+        distance = upTo
+        for element in mg.elements:
+            if element.L <= distance:
+                transferMatrix = element * transferMatrix
+                distance -= element.L
+            else:
+                transferMatrix = element.transferMatrix(upTo=distance) * transferMatrix
+                break
+        return transferMatrix
+
+    def testTransferMatrixUpToMatchesElementByElement(self):
+        mg = MatrixGroup([Space(10), Lens(10), Space(5), ThickLens(n=1.5, R1=10, R2=-10, thickness=3), Space(7),
+                          Aperture(10), Space(2)])
+        for z in [-1, 0, 3, 10, 12.5, 15, 16, 18, 25, 27, 100, inf]:
+            transferMatrix = mg.transferMatrix(upTo=z)
+            expected = self.slowTransferMatrix(mg, z)
+            self.assertAlmostEqual(transferMatrix.A, expected.A)
+            self.assertAlmostEqual(transferMatrix.B, expected.B)
+            self.assertAlmostEqual(transferMatrix.C, expected.C)
+            self.assertAlmostEqual(transferMatrix.D, expected.D)
+            self.assertAlmostEqual(transferMatrix.L, expected.L)
+
+    def testTransferMatrixUpToAfterChanges(self):
+        mg = MatrixGroup([Space(10), Lens(10), Space(10)])
+        self.assertAlmostEqual(mg.transferMatrix(upTo=15).A, 0.5)
+        mg[1] = Lens(5)
+        self.assertAlmostEqual(mg.transferMatrix(upTo=15).A, 0)
+        mg.append(Space(10))
+        self.assertAlmostEqual(mg.transferMatrix(upTo=25).A, -2)
+
+    def testTransferMatrixOfEmptyGroup(self):
+        for upTo in [-1, 0, 10, inf]:
+            transferMatrix = MatrixGroup().transferMatrix(upTo=upTo)
+            self.assertTrue(transferMatrix.isIdentity)
+            self.assertEqual(transferMatrix.L, 0)
+
+    def testTransferMatrixIsNotTheCachedMatrix(self):
+        mg = MatrixGroup([Space(10), Lens(10), Space(10)])
+        transferMatrix = mg.transferMatrix()
+        transferMatrix.B = 123
+        self.assertEqual(mg.transferMatrix().B, 10)
+        self.assertEqual(mg.B, 10)
+
+        emptyGroup = MatrixGroup()
+        emptyGroup.transferMatrix(upTo=-1).B = 123
+        self.assertEqual(emptyGroup.transferMatrix(upTo=-1).B, 0)
+
+    def testTransferMatrixUpToAfterElementModifiedInPlace(self):
+        mg = MatrixGroup([Space(10), Lens(10), Space(10)])
+        self.assertAlmostEqual(mg.transferMatrix(upTo=15).C, -0.1)
+        version = mg.version
+        mg.elements[1].C = -0.2
+        mg.elements[1].invalidate()
+        self.assertAlmostEqual(mg.transferMatrix(upTo=15).C, -0.2)
+        self.assertAlmostEqual(mg.C, -0.2)
+        self.assertGreater(mg.version, version)
+
+    def testElementModifiedInPlaceChangesOnlyItsGroups(self):
+        lens = Lens(10)
+        mg = MatrixGroup([Space(10), lens, Space(10)])
+        other = MatrixGroup([Space(10), Lens(10)])
+        (version, otherVersion) = (mg.version, other.version)
+        lens.C = -0.2
+        lens.invalidate()
+        self.assertGreater(mg.version, version)
+        self.assertEqual(other.version, otherVersion)
+
+    def testElementRemovedFromGroupDoesNotChangeIt(self):
+        lens = Lens(10)
+        mg = MatrixGroup([Space(10), lens, Space(10)])
+        mg.pop(1)
+        version = mg.version
+        lens.invalidate()
+        self.assertEqual(mg.version, version)
+
+    def testMatrixHasNoAttributeHook(self):
+        self.assertIs(Matrix.__setattr__, object.__setattr__)
+
+    def testCopiedElementIsNotInGroup(self):
+        lens = Lens(10)
+        mg = MatrixGroup([Space(10), lens])
+        version = mg.version
+        copy.deepcopy(lens).invalidate()
+        pickle.loads(pickle.dumps(lens)).invalidate()
+        self.assertEqual(mg.version, version)
+
+    def testTransferMatrixUpToAfterNestedElementModifiedInPlace(self):
+        inner = MatrixGroup([Lens(10)])
+        mg = MatrixGroup([Space(10), inner, Space(10)])
+        self.assertAlmostEqual(mg.transferMatrix(upTo=15).C, -0.1)
+        inner.elements[0].C = -0.5
+        inner.elements[0].invalidate()
+        self.assertAlmostEqual(mg.transferMatrix(upTo=15).C, -0.5)
+
+    def testTransferMatrixArrays(self):
+        mg = MatrixGroup([Space(10), Lens(10), Space(5), ThickLens(n=1.5, R1=10, R2=-10, thickness=3), Space(7),
+                          Aperture(10), Space(2)])
+        z = np.array([-1, 0, 3, 10, 12.5, 15, 16, 18, 25, 27, 100, inf])
+        (A, B, C, D) = mg.transferMatrixArrays(upTo=z)
+        self.assertEqual(A.shape, z.shape)
+        for i, zi in enumerate(z):
+            expected = mg.transferMatrix(upTo=zi)
+            self.assertAlmostEqual(A[i], expected.A)
+            self.assertAlmostEqual(B[i], expected.B)
+            self.assertAlmostEqual(C[i], expected.C)
+            self.assertAlmostEqual(D[i], expected.D)
+
+    def testTransferMatrixArraysAfterElementModifiedInPlace(self):
+        mg = MatrixGroup([Space(10), Lens(10), Space(10)])
+        (A, B, C, D) = mg.transferMatrixArrays(upTo=[5, 15])
+        self.assertAlmostEqual(C[1], -0.1)
+        mg.elements[1].C = -0.2
+        mg.elements[1].invalidate()
+        (A, B, C, D) = mg.transferMatrixArrays(upTo=[5, 15])
+        self.assertAlmostEqual(C[1], -0.2)
+        self.assertAlmostEqual(A[1], 1 - 5 * 0.2)
+
+    def testTransferMatrixArraysEmptyGroup(self):
+        (A, B, C, D) = MatrixGroup().transferMatrixArrays(upTo=[0, 10])
+        self.assertListEqual(list(A), [1, 1])
+        self.assertListEqual(list(B), [0, 0])
+
+    def testTransferMatrixArraysManyPositionsIsFast(self):
+        mg = MatrixGroup()
+        for i in range(1000):
+            mg.append(Space(d=1))
+            mg.append(Lens(f=100))
+
+        startTime = time.time()
+        (A, B, C, D) = mg.transferMatrixArrays(upTo=np.linspace(0, 1000, 10000))
+        self.assertLess(time.time() - startTime, 5)
+        self.assertAlmostEqual(A[-1], mg.A)
+        self.assertAlmostEqual(B[-1], mg.B)
+
+    def testAppendManyElementsIsFast(self):
+        mg = MatrixGroup()
+        startTime = time.time()
+        for i in range(10000):
+            mg.append(Space(d=0.01))
+        self.assertLess(time.time() - startTime, 5)
+        self.assertAlmostEqual(mg.B, 100)
+        self.assertAlmostEqual(mg.L, 100)
+
     def testEqualityDifferentClassInstance(self):
         mg = MatrixGroup()
         self.assertNotEqual(mg, Matrix())
@@ -640,6 +970,40 @@ class TestSaveAndLoadMatrixGroup(envtest.RaytracingTestCase):
 
         self.assertDoesNotRaise(toto, AssertionError)
 
+    def testLoadFileSavedByOlderVersion(self):
+        # [Lens(f=5), MatrixGroup([Space(d=10)])] pickled by an older version, after tracing Ray(y=1, theta=0.1)
+        data = (b"\x80\x04\x95\xeb\x02\x00\x00\x00\x00\x00\x00]\x94(\x8c\x11raytracing.matrix\x94\x8c\x04Lens\x94"
+                b"\x93\x94)\x81\x94}\x94(\x8c\x01A\x94G?\xf0\x00\x00\x00\x00\x00\x00\x8c\x01B\x94G\x00\x00\x00\x00"
+                b"\x00\x00\x00\x00\x8c\x01C\x94G\xbf\xc9\x99\x99\x99\x99\x99\x9a\x8c\x01D\x94G?\xf0\x00\x00\x00"
+                b"\x00\x00\x00\x8c\x01L\x94G\x00\x00\x00\x00\x00\x00\x00\x00\x8c\x10apertureDiameter\x94G\x7f\xf0"
+                b"\x00\x00\x00\x00\x00\x00\x8c\x0bfrontVertex\x94K\x00\x8c\nbackVertex\x94K\x00\x8c\nfrontIndex"
+                b"\x94G?\xf0\x00\x00\x00\x00\x00\x00\x8c\tbackIndex\x94G?\xf0\x00\x00\x00\x00\x00\x00\x8c\x05label"
+                b"\x94\x8c\x00\x94\x8c\tisFlipped\x94\x89\x8c\x13_physicalHalfHeight\x94K\x04ub\x8c\x16raytracing."
+                b"matrixgroup\x94\x8c\x0bMatrixGroup\x94\x93\x94)\x81\x94}\x94(\x8c\titeration\x94K\x00h\x06G?\xf0"
+                b"\x00\x00\x00\x00\x00\x00h\x07G@$\x00\x00\x00\x00\x00\x00h\x08G\x00\x00\x00\x00\x00\x00\x00\x00h"
+                b"\tG?\xf0\x00\x00\x00\x00\x00\x00h\nG@$\x00\x00\x00\x00\x00\x00h\x0bG\x7f\xf0\x00\x00\x00\x00\x00"
+                b"\x00h\x0cNh\rNh\x0eG?\xf0\x00\x00\x00\x00\x00\x00h\x0fG?\xf0\x00\x00\x00\x00\x00\x00h\x10h\x11h"
+                b"\x12\x89\x8c\x08elements\x94]\x94h\x01\x8c\x05Space\x94\x93\x94)\x81\x94}\x94(h\x06G?\xf0\x00"
+                b"\x00\x00\x00\x00\x00h\x07G@$\x00\x00\x00\x00\x00\x00h\x08G\x00\x00\x00\x00\x00\x00\x00\x00h\tG?"
+                b"\xf0\x00\x00\x00\x00\x00\x00h\nG@$\x00\x00\x00\x00\x00\x00h\x0bG\x7f\xf0\x00\x00\x00\x00\x00\x00"
+                b"h\x0cNh\rNh\x0eK\x01h\x0fK\x01h\x10h\x11h\x12\x89uba\x8c\x12_lastRayToBeTraced\x94\x8c\x0eraytra"
+                b"cing.ray\x94\x8c\x03Ray\x94\x93\x94)\x81\x94}\x94(\x8c\x01y\x94K\x01\x8c\x05theta\x94G?\xb9\x99"
+                b"\x99\x99\x99\x99\x9a\x8c\x01z\x94K\x00\x8c\tisBlocked\x94\x89h\x0bG\x7f\xf0\x00\x00\x00\x00\x00"
+                b"\x00\x8c\nwavelength\x94Nub\x8c\r_lastRayTrace\x94]\x94(h$h$h#)\x81\x94}\x94(h&G@\x00\x00\x00"
+                b"\x00\x00\x00\x00h'G?\xb9\x99\x99\x99\x99\x99\x9ah(G@$\x00\x00\x00\x00\x00\x00h)\x89h\x0bG\x7f"
+                b"\xf0\x00\x00\x00\x00\x00\x00h*Nubeube.")
+        fname = self.tempFilePath("olderVersion.pkl")
+        with open(fname, 'wb') as file:
+            file.write(data)
+
+        mg = MatrixGroup()
+        mg.load(fname)
+        group = mg.elements[1]
+        self.assertEqual(group._lastRayTrace[-1].y, 2)
+        self.assertEqual(group.transferMatrix().B, 10)
+        self.assertEqual(len(group.compile().steps), 1)
+        self.assertAlmostEqual(mg.traceThrough(Ray(y=1, theta=0)).y, -1)
+
     def testSaveThenLoad(self):
         fname = self.tempFilePath("saveThenLoad.pkl")
         mg1 = MatrixGroup([Space(10), Lens(10, 100), Space(10), Aperture(50)])
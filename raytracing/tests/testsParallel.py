@@ -0,0 +1,263 @@
+import envtest  # modifies path
+import numpy as np
+import multiprocessing
+import pickle
+import os
+
+from raytracing import *
+
+inf = float("+inf")
+
+
+class TestSharedRayArrays(envtest.RaytracingTestCase):
+    def testCreate(self):
+        shared = SharedRayArrays(10)
+        self.assertEqual(len(shared.y), 10)
+        self.assertEqual(len(shared.theta), 10)
+        self.assertEqual(len(shared.z), 10)
+        self.assertEqual(len(shared.isBlocked), 10)
+        shared.close()
+        shared.unlink()
+
+    def testOpenByName(self):
+        shared = SharedRayArrays(3)
+        shared.y[:] = [1, 2, 3]
+        shared.isBlocked[:] = [True, False, True]
+        other = SharedRayArrays(3, name=shared.name)
+        self.assertListEqual(list(other.y), [1, 2, 3])
+        self.assertListEqual(list(other.isBlocked), [True, False, True])
+        other.close()
+        shared.close()
+        shared.unlink()
+
+    def testArraysRange(self):
+        shared = SharedRayArrays(5)
+        shared.theta[:] = np.arange(5)
+        (y, theta, z, isBlocked) = shared.arrays(1, 3)
+        self.assertListEqual(list(theta), [1, 2])
+        del y, theta, z, isBlocked
+        shared.close()
+        shared.unlink()
+
+    def testEmpty(self):
+        shared = SharedRayArrays(0)
+        self.assertEqual(len(shared.y), 0)
+        shared.close()
+        shared.unlink()
+
+
+class TestTraceSharedRaysThrough(envtest.RaytracingTestCase):
+    def testTraceRange(self):
+        path = MatrixGroup([Space(d=10), Lens(f=10, diameter=8)])
+        shared = SharedRayArrays(4)
+        shared.y[:] = [0, 1, 2, 3]
+        shared.theta[:] = [0.1, 0.1, 0.5, 0.1]
+        traceSharedRaysThrough(path.compile(), shared.name, 4, 1, 3, progress=False)
+
+        self.assertListEqual(list(shared.y[[0, 3]]), [0, 3])
+        for i in [1, 2]:
+            ray = path.traceThrough(Ray([0, 1, 2, 3][i], [0.1, 0.1, 0.5, 0.1][i]))
+            self.assertAlmostEqual(shared.y[i], ray.y)
+            self.assertAlmostEqual(shared.theta[i], ray.theta)
+            self.assertAlmostEqual(shared.z[i], ray.z)
+            self.assertEqual(shared.isBlocked[i], ray.isBlocked)
+        shared.close()
+        shared.unlink()
+
+
+class TestTraceManyThroughInParallel(envtest.RaytracingTestCase):
+    @envtest.skipIf(sys.platform == 'darwin' and sys.version_info.major == 3 and sys.version_info.minor <= 7,
+                    "Endless loop on macOS")
+    def testSameAsTraceManyThrough(self):
+        path = ImagingPath()
+        path.append(Space(d=10))
+        path.append(System4f(f1=10, f2=20, diameter1=8, diameter2=12))
+        path.append(Space(d=5))
+        rays = UniformRays(yMax=5, thetaMax=0.5, M=50, N=50)
+        outputRays = path.traceManyThrough(rays, progress=False)
+        outputRaysInParallel = path.traceManyThroughInParallel(rays, progress=False, processes=3)
+        self.assertEqual(len(outputRays), len(outputRaysInParallel))
+        self.assertTrue(np.allclose(outputRays.yValues, outputRaysInParallel.yValues))
+        self.assertTrue(np.allclose(outputRays.thetaValues, outputRaysInParallel.thetaValues))
+
+    @envtest.skipIf(sys.platform == 'darwin' and sys.version_info.major == 3 and sys.version_info.minor <= 7,
+                    "Endless loop on macOS")
+    def testNoRays(self):
+        outputRays = Space(d=10).traceManyThroughInParallel(Rays(), progress=False, processes=2)
+        self.assertEqual(len(outputRays), 0)
+
+    def testNotIterable(self):
+        with self.assertRaises(TypeError):
+            Space(d=10).traceManyThroughInParallel(Space(d=3), processes=2)
+
+
+
+@envtest.skipIf(sys.platform == 'darwin' and sys.version_info.major == 3 and sys.version_info.minor <= 7,
+                "Endless loop on macOS")
+class TestTracingPool(envtest.RaytracingTestCase):
+    def testContextManager(self):
+        with TracingPool(processes=2) as pool:
+            self.assertIsNotNone(pool.pool)
+        self.assertIsNone(pool.pool)
+
+    def testDefaultProcesses(self):
+        pool = TracingPool()
+        self.assertEqual(pool.processes, multiprocessing.cpu_count())
+        self.assertIsNone(pool.pool)
+
+    def testFingerprint(self):
+        data1 = pickle.dumps(MatrixGroup([Space(d=10), Lens(f=5)]).compile())
+        data2 = pickle.dumps(MatrixGroup([Space(d=10), Lens(f=5)]).compile())
+        data3 = pickle.dumps(MatrixGroup([Space(d=10), Lens(f=6)]).compile())
+        self.assertEqual(TracingPool.fingerprint(data1), TracingPool.fingerprint(data2))
+        self.assertNotEqual(TracingPool.fingerprint(data1), TracingPool.fingerprint(data3))
+
+    def testPathIsPickledOncePerVersion(self):
+        pool = TracingPool(processes=2)
+        lens = Lens(f=5, diameter=10)
+        path = ImagingPath([Space(d=10), lens, Space(d=5)])
+        (fingerprint, pathData) = pool.pickledPath(path)
+        self.assertIs(pool.pickledPath(path)[1], pathData)
+
+        lens.C = -0.1
+        lens.invalidate()
+        (newFingerprint, newPathData) = pool.pickledPath(path)
+        self.assertNotEqual(newFingerprint, fingerprint)
+        self.assertEqual(pickle.loads(newPathData).C, path.C)
+
+    def testPathIsSentAgainWhenProcessDoesNotHaveIt(self):
+        rays = UniformRays(yMax=5, thetaMax=0.5, M=20, N=20)
+        path = ImagingPath([Space(d=10), Lens(f=7, diameter=8), Space(d=7)])
+        expectedRays = path.traceManyThrough(rays, progress=False)
+        with TracingPool(processes=2) as pool:
+            # As if the path had been sent already: the processes do not have it
+            pool.sentFingerprints.add(pool.pickledPath(path)[0])
+            outputRays = path.traceManyThrough(rays, progress=False, pool=pool)
+        self.assertTrue(np.allclose(outputRays.yValues, expectedRays.yValues))
+
+    def testReusedForManyPaths(self):
+        rays = UniformRays(yMax=5, thetaMax=0.5, M=20, N=20)
+        with TracingPool(processes=2) as pool:
+            for f in [5, 10, 20, 10]:
+                path = ImagingPath([Space(d=10), Lens(f=f, diameter=8), Space(d=f)])
+                outputRays = path.traceManyThrough(rays, progress=False, pool=pool)
+                expectedRays = path.traceManyThrough(rays, progress=False)
+                self.assertTrue(np.allclose(outputRays.yValues, expectedRays.yValues))
+                self.assertTrue(np.allclose(outputRays.thetaValues, expectedRays.thetaValues))
+
+            outputRays = path.traceManyThroughInParallel(rays, progress=False, pool=pool)
+            self.assertEqual(len(outputRays), len(expectedRays))
+
+    def testStartedWhenNeeded(self):
+        pool = TracingPool(processes=2)
+        outputRays = Space(d=10).traceManyThrough([Ray(1, 0.1)], progress=False, pool=pool)
+        self.assertIsNotNone(pool.pool)
+        pool.close()
+        self.assertEqual(len(outputRays), 1)
+        self.assertAlmostEqual(outputRays[0].y, 2)
+
+    def testWeights(self):
+        rays = Rays()
+        rays.appendArrays(y=[0, 1, 2, 3], theta=[0, 0, 0, 0], weights=[1, 2, 3, 4])
+        with TracingPool(processes=2) as pool:
+            outputRays = Aperture(diameter=5).traceManyThrough(rays, progress=False, pool=pool)
+        self.assertListEqual(list(outputRays.weights), [1, 2, 3])
+
+    def testTraceArraysThrough(self):
+        path = ImagingPath([Space(d=10), Lens(f=7, diameter=8), Space(d=7)])
+        y = np.linspace(-5, 5, 101)
+        theta = np.linspace(-0.5, 0.5, 101)
+        expected = path.traceArraysThrough(y, theta)
+        with TracingPool(processes=2) as pool:
+            output = pool.traceArraysThrough(path, y, theta, np.zeros(101), np.zeros(101, dtype=bool))
+        for (values, expectedValues) in zip(output, expected):
+            self.assertTrue(np.allclose(values, expectedValues))
+
+    def testTraceArraysThroughNoRays(self):
+        with TracingPool(processes=2) as pool:
+            (y, theta, z, isBlocked) = pool.traceArraysThrough(Space(d=10), [], [], [], [])
+        self.assertEqual(len(y), 0)
+        self.assertEqual(len(isBlocked), 0)
+
+    def testDetectManyThrough(self):
+        path = ImagingPath([Space(d=10), Lens(f=7, diameter=8), Space(d=7)])
+        rays = UniformRays(yMax=5, thetaMax=0.5, M=20, N=20)
+        expected = path.detectManyThrough(rays, Detector(yRange=(-4, 4)), chunkSize=150)
+        with TracingPool(processes=2) as pool:
+            detector = path.detectManyThrough(rays, Detector(yRange=(-4, 4)), chunkSize=150, pool=pool)
+        self.assertEqual(detector.rayCount, expected.rayCount)
+        self.assertTrue(np.allclose(detector.yHistogram, expected.yHistogram))
+
+    def testEstimateTransmission(self):
+        path = ImagingPath([Space(d=10), Aperture(diameter=1)])
+        expected = path.estimateTransmission(RandomUniformRays(yMax=1, thetaMax=0.1, maxCount=100000, seed=1),
+                                             relativeError=0.02, chunkSize=5000)
+        with TracingPool(processes=2) as pool:
+            estimate = path.estimateTransmission(RandomUniformRays(yMax=1, thetaMax=0.1, maxCount=100000, seed=1),
+                                                 relativeError=0.02, chunkSize=5000, pool=pool)
+        self.assertEqual(estimate.rayCount, expected.rayCount)
+        self.assertEqual(estimate.stopReason, expected.stopReason)
+        self.assertAlmostEqual(estimate.transmission, expected.transmission)
+
+
+class TestTraceFileThrough(envtest.RaytracingTestCase):
+    def setUp(self):
+        self.path = ImagingPath([Space(d=10), Lens(f=10, diameter=8), Space(d=10), Aperture(diameter=6)])
+        self.rays = Rays()
+        self.rays.appendArrays(y=np.linspace(-10, 10, 1001), theta=np.linspace(-0.5, 0.5, 1001),
+                               weights=np.linspace(1, 2, 1001))
+        self.inputFilePath = self.tempFilePath('input.dat')
+        self.rays.save(self.inputFilePath)
+        self.expectedRays = self.path.traceManyThrough(self.rays, progress=False)
+
+    def assertLoadedRaysAreExpected(self, filePath, expectedRays):
+        outputRays = Rays()
+        outputRays.load(filePath)
+        self.assertEqual(len(outputRays), len(expectedRays))
+        self.assertTrue(np.allclose(outputRays.yValues, expectedRays.yValues))
+        self.assertTrue(np.allclose(outputRays.thetaValues, expectedRays.thetaValues))
+        self.assertTrue(np.allclose(outputRays.weights, expectedRays.weights))
+
+    def testSameAsTraceManyThrough(self):
+        outputFilePath = self.tempFilePath('output.dat')
+        count = self.path.traceFileThrough(self.inputFilePath, outputFilePath, chunkSize=100)
+        self.assertEqual(count, len(self.expectedRays))
+        self.assertLoadedRaysAreExpected(outputFilePath, self.expectedRays)
+
+    def testRange(self):
+        outputFilePath = self.tempFilePath('outputRange.dat')
+        self.path.traceFileThrough(self.inputFilePath, outputFilePath, chunkSize=64, start=200, stop=700)
+        rays = Rays()
+        rays.appendArrays(self.rays.yValues[200:700], self.rays.thetaValues[200:700],
+                          weights=self.rays.weights[200:700])
+        self.assertLoadedRaysAreExpected(outputFilePath, self.path.traceManyThrough(rays, progress=False))
+
+    def testDetector(self):
+        detector = Detector(yRange=(-3, 3))
+        count = self.path.traceFileThrough(self.inputFilePath, detector=detector, chunkSize=100)
+        expected = Detector(yRange=(-3, 3))
+        expected.addRays(self.expectedRays)
+        self.assertEqual(count, len(self.expectedRays))
+        self.assertTrue(np.allclose(detector.yHistogram, expected.yHistogram))
+
+    def testNotRays(self):
+        fileName = self.tempFilePath('traces.dat')
+        RayFile.save(fileName, 'traces', {'values': np.zeros(3)})
+        with self.assertRaises(IOError):
+            self.path.traceFileThrough(fileName)
+
+    def testInParallel(self):
+        outputFilePath = self.tempFilePath('outputParallel.dat')
+        detector = Detector(yRange=(-3, 3))
+        with TracingPool(processes=3) as pool:
+            count = self.path.traceFileThrough(self.inputFilePath, outputFilePath, detector=detector, chunkSize=100,
+                                               pool=pool)
+        self.assertEqual(count, len(self.expectedRays))
+        self.assertLoadedRaysAreExpected(outputFilePath, self.expectedRays)
+        self.assertEqual(detector.rayCount, count)
+        for i in range(3):
+            self.assertFalse(os.path.exists("{0}.part{1}".format(outputFilePath, i)))
+
+
+if __name__ == '__main__':
+    envtest.main()
@@ -0,0 +1,98 @@
+import envtest  # modifies path
+import numpy as np
+
+from raytracing import *
+
+inf = float("+inf")
+
+
+class TestQuasiRandomSequence(envtest.RaytracingTestCase):
+    def testInvalidKind(self):
+        with self.assertRaises(ValueError):
+            QuasiRandomSequence(kind='random')
+
+    def testSobolIsANet(self):
+        # Every dyadic box of area 1/256 contains exactly one point
+        (u, v) = QuasiRandomSequence(kind='sobol', scramble=False).points(0, 256)
+        for (uCount, vCount) in [(1, 256), (16, 16), (2, 128), (256, 1)]:
+            boxes = np.floor(u * uCount).astype(int) * vCount + np.floor(v * vCount).astype(int)
+            self.assertTrue(np.array_equal(np.sort(boxes), np.arange(256)))
+
+    def testScrambledSobolIsANet(self):
+        (u, v) = QuasiRandomSequence(kind='sobol', seed=5).points(0, 256)
+        boxes = np.floor(u * 16).astype(int) * 16 + np.floor(v * 16).astype(int)
+        self.assertTrue(np.array_equal(np.sort(boxes), np.arange(256)))
+
+    def testHaltonStratified(self):
+        for scramble in [False, True]:
+            (u, v) = QuasiRandomSequence(kind='halton', scramble=scramble, seed=2).points(0, 6 ** 3)
+            self.assertTrue(np.array_equal(np.bincount(np.floor(u * 8).astype(int)), [27] * 8))
+            self.assertTrue(np.array_equal(np.bincount(np.floor(v * 27 + 1e-9).astype(int)), [8] * 27))
+
+    def testPointsInUnitSquare(self):
+        for kind in QuasiRandomSequence.kinds:
+            (u, v) = QuasiRandomSequence(kind=kind, seed=3).points(0, 10000)
+            self.assertTrue(np.all((u >= 0) & (u < 1)))
+            self.assertTrue(np.all((v >= 0) & (v < 1)))
+
+    def testRangesAreIndependent(self):
+        for kind in QuasiRandomSequence.kinds:
+            sequence = QuasiRandomSequence(kind=kind, seed=4)
+            (u, v) = sequence.points(0, 1000)
+            (uPart, vPart) = sequence.points(600, 1000)
+            self.assertTrue(np.array_equal(u[600:], uPart))
+            self.assertTrue(np.array_equal(v[600:], vPart))
+
+    def testSameSeedSamePoints(self):
+        for kind in QuasiRandomSequence.kinds:
+            (u1, v1) = QuasiRandomSequence(kind=kind, seed=6).points(0, 100)
+            (u2, v2) = QuasiRandomSequence(kind=kind, seed=6).points(0, 100)
+            (u3, v3) = QuasiRandomSequence(kind=kind, seed=7).points(0, 100)
+            self.assertTrue(np.array_equal(u1, u2))
+            self.assertFalse(np.array_equal(u1, u3))
+
+    def testEmptyRange(self):
+        (u, v) = QuasiRandomSequence().points(10, 10)
+        self.assertEqual(len(u), 0)
+        self.assertEqual(len(v), 0)
+
+
+class TestQuasiRandomRays(envtest.RaytracingTestCase):
+    def testUniformRaysInRange(self):
+        rays = QuasiRandomUniformRays(yMax=2, yMin=1, thetaMax=0.5, thetaMin=0.25, maxCount=1000)
+        self.assertEqual(len(rays.yValues), 1000)
+        self.assertTrue(all(1 <= y <= 2 for y in rays.yValues))
+        self.assertTrue(all(0.25 <= theta <= 0.5 for theta in rays.thetaValues))
+
+    def testRaysAreSameAsChunks(self):
+        rays = QuasiRandomUniformRays(maxCount=5000, seed=1)
+        oneByOne = QuasiRandomUniformRays(maxCount=5000, seed=1)
+        ray = oneByOne.randomRay()
+        self.assertEqual(ray, rays[0])
+        chunk = QuasiRandomUniformRays(maxCount=5000, seed=1).chunk(4000, 6000)
+        self.assertEqual(len(chunk), 1000)
+        self.assertTrue(np.array_equal(chunk.yValues, rays.yValues[4000:]))
+
+    def testUniformEfficiencyConverges(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=3), Space(d=10), Aperture(diameter=0.7)])
+        exact = path.collectionEfficiency(UniformRays(yMax=1, thetaMax=0.3))
+        source = QuasiRandomUniformRays(yMax=1, thetaMax=0.3, maxCount=4096, seed=0)
+        outputRays = path.traceManyThrough(source, progress=False)
+        self.assertAlmostEqual(outputRays.count / 4096, exact, delta=2e-3)
+
+    def testLambertianDistribution(self):
+        rays = QuasiRandomLambertianRays(maxCount=4096, sequence='halton', seed=0)
+        thetas = rays.thetaValues
+        self.assertTrue(all(-pi / 2 <= theta <= pi / 2 for theta in thetas))
+        # Fraction of rays within +/- pi/6 is sin(pi/6) for a Lambertian source
+        self.assertAlmostEqual(np.mean(np.abs(thetas) < pi / 6), 0.5, delta=1e-3)
+
+    def testAreRecognizedAsSources(self):
+        path = ImagingPath([Space(d=10), Aperture(diameter=2)])
+        source = QuasiRandomUniformRays(yMax=1, thetaMax=0.1)
+        self.assertAlmostEqual(path.collectionEfficiency(source), 0.75)
+        self.assertIsInstance(QuasiRandomLambertianRays(), RandomLambertianRays)
+
+
+if __name__ == '__main__':
+    envtest.main()
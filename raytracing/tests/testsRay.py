@@ -16,6 +16,29 @@ class TestRay(envtest.RaytracingTestCase):
         self.assertFalse(ray.isBlocked)
         self.assertTrue(ray.isNotBlocked)
 
+    def testRayWithAllProperties(self):
+        ray = Ray(1, 2, 3, True, 500e-9, 10)
+        self.assertEqual((ray.y, ray.theta, ray.z, ray.isBlocked, ray.wavelength, ray.apertureDiameter),
+                         (1, 2, 3, True, 500e-9, 10))
+
+    def testRayHasNoDict(self):
+        ray = Ray()
+        self.assertFalse(hasattr(ray, '__dict__'))
+        with self.assertRaises(AttributeError):
+            ray.color = 'red'
+
+    def testRayPickle(self):
+        import pickle
+        ray = pickle.loads(pickle.dumps(Ray(1, 2, 3, True, 500e-9, 10)))
+        self.assertEqual((ray.y, ray.theta, ray.z, ray.isBlocked, ray.wavelength, ray.apertureDiameter),
+                         (1, 2, 3, True, 500e-9, 10))
+
+    def testRaySetStateOfSlots(self):
+        ray = Ray.__new__(Ray)
+        ray.__setstate__((None, {'y': 1, 'theta': 2, 'isBlocked': True}))
+        self.assertEqual((ray.y, ray.theta, ray.z, ray.isBlocked, ray.wavelength, ray.apertureDiameter),
+                         (1, 2, 0, True, None, float("+inf")))
+
     def testFan(self):
         fan = Ray.fan(y=0, radianMin=-0.1, radianMax=0.1, N=5)
         self.assertIsNotNone(fan)
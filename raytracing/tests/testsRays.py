@@ -92,17 +92,17 @@ class TestRays(envtest.RaytracingTestCase):
 
     def testYValuesDefaultArgs(self):
         r = Rays()
-        self.assertListEqual(r.yValues, [])
+        self.assertListEqual(list(r.yValues), [])
 
     def testYValuesEmptyList(self):
         r = Rays([])
-        self.assertListEqual(r.yValues, [])
+        self.assertListEqual(list(r.yValues), [])
 
     def testYValues(self):
         yvalues = list(range(10))
         listOfRays = [Ray(y) for y in yvalues]
         r = Rays(listOfRays)
-        self.assertListEqual(r.yValues, yvalues)
+        self.assertListEqual(list(r.yValues), yvalues)
 
     def testYValuesNotNone(self):
         r = Rays([Ray()])
@@ -113,17 +113,17 @@ class TestRays(envtest.RaytracingTestCase):
 
     def testThetaValuesDefaultArgs(self):
         r = Rays()
-        self.assertListEqual(r.thetaValues, [])
+        self.assertListEqual(list(r.thetaValues), [])
 
     def testThetaValuesEmptyList(self):
         r = Rays([])
-        self.assertListEqual(r.thetaValues, [])
+        self.assertListEqual(list(r.thetaValues), [])
 
     def testThetaValues(self):
         thetaValues = list(np.linspace(-pi / 2, pi / 2, 10))
         listOfRays = [Ray(theta=theta) for theta in thetaValues]
         r = Rays(listOfRays)
-        self.assertListEqual(r.thetaValues, thetaValues)
+        self.assertListEqual(list(r.thetaValues), thetaValues)
 
     def testRayCountHist(self):
         r = Rays([Ray()])
@@ -242,6 +242,73 @@ class TestRays(envtest.RaytracingTestCase):
         self.assertIsNone(r._anglesHistogramParameters)
         self.assertIsNone(r._xValuesAnglesHistogram)
 
+    def testYValuesIsAView(self):
+        r = Rays([Ray(1, 1), Ray(2, 2)])
+        self.assertIs(r.yValues.base, r._y)
+        self.assertIs(r.thetaValues.base, r._theta)
+
+    def testAppendManyRays(self):
+        r = Rays()
+        for i in range(1000):
+            r.append(Ray(i, -i))
+        self.assertEqual(len(r), 1000)
+        self.assertTrue(np.array_equal(r.yValues, np.arange(1000)))
+        self.assertTrue(np.array_equal(r.thetaValues, -np.arange(1000)))
+        self.assertEqual(r[999], Ray(999, -999))
+        self.assertEqual(r[-1], Ray(999, -999))
+
+    def testAppendArrays(self):
+        r = Rays([Ray(1, 1)])
+        r.appendArrays([2, 3], [0.2, 0.3], z=4, isBlocked=[False, True])
+        self.assertListEqual(r.rays, [Ray(1, 1), Ray(2, 0.2), Ray(3, 0.3)])
+        self.assertListEqual(list(r.zValues), [0, 4, 4])
+        self.assertListEqual(list(r.isBlockedValues), [False, False, True])
+        self.assertFalse(r.isWeighted)
+        self.assertListEqual(list(r.weights), [1, 1, 1])
+
+    def testAppendArraysDifferentLengths(self):
+        with self.assertRaises(ValueError):
+            Rays().appendArrays([1, 2], [1])
+
+    def testAppendWithWeight(self):
+        r = Rays([Ray(1, 1)])
+        r.append(Ray(2, 2), weight=3)
+        self.assertTrue(r.isWeighted)
+        self.assertListEqual(list(r.weights), [1, 3])
+
+    def testRaysFromRays(self):
+        r = Rays([Ray(1, 1, wavelength=0.5), Ray(2, 2, isBlocked=True)])
+        copy = Rays(r)
+        self.assertListEqual(copy.rays, r.rays)
+        self.assertEqual(copy[0].wavelength, 0.5)
+        self.assertIsNone(copy[1].wavelength)
+        self.assertTrue(copy[1].isBlocked)
+
+    def testModifyingRayModifiesRays(self):
+        r = Rays([Ray(1, 1), Ray(2, 2)])
+        r.rayCountHistogram()
+        r[1].y = 5
+        r[0].isBlocked = True
+        self.assertListEqual(list(r.yValues), [1, 5])
+        self.assertListEqual(list(r.isBlockedValues), [True, False])
+        self.assertIsNone(r._countHistogramParameters)
+
+    def testGetItemOutOfBounds(self):
+        r = Rays([Ray(1, 1)])
+        with self.assertRaises(IndexError):
+            r[1]
+
+    def testGetItemSlice(self):
+        r = Rays([Ray(1, 1), Ray(2, 2), Ray(3, 3)])
+        self.assertListEqual(r[1:], [Ray(2, 2), Ray(3, 3)])
+
+    def testRayFromRaysIsPickledAsRay(self):
+        r = Rays([Ray(1, 2, 3)])
+        ray = pickle.loads(pickle.dumps(r[0]))
+        self.assertIs(type(ray), Ray)
+        self.assertEqual(ray, Ray(1, 2))
+        self.assertEqual(ray.z, 3)
+
     def testAppendInvalidInput(self):
         rays = Rays()
         with self.assertRaises(TypeError):
@@ -292,6 +359,42 @@ class TestRaysSaveAndLoad(envtest.RaytracingTestCase):
         self.assertLoadNotFailed(rays)  # We don't append, we override
         self.assertListEqual(rays.rays, self.testRays.rays)
 
+    def testLoadFileSavedBeforeRayHadSlots(self):
+        # [Ray(y=1, theta=0.1), Ray(y=-2, theta=0, z=5, isBlocked=True, wavelength=0.5)] pickled by an older version
+        data = (b'\x80\x04\x95\xac\x00\x00\x00\x00\x00\x00\x00]\x94(\x8c\x0eraytracing.ray\x94\x8c\x03Ray\x94\x93'
+                b'\x94)\x81\x94}\x94(\x8c\x01y\x94K\x01\x8c\x05theta\x94G?\xb9\x99\x99\x99\x99\x99\x9a\x8c\x01z'
+                b'\x94K\x00\x8c\tisBlocked\x94\x89\x8c\x10apertureDiameter\x94G\x7f\xf0\x00\x00\x00\x00\x00\x00'
+                b'\x8c\nwavelength\x94Nubh\x03)\x81\x94}\x94(h\x06J\xfe\xff\xff\xffh\x07K\x00h\x08K\x05h\t\x88h\nG'
+                b'\x7f\xf0\x00\x00\x00\x00\x00\x00h\x0bG?\xe0\x00\x00\x00\x00\x00\x00ube.')
+        fileName = self.tempFilePath('beforeSlots.pkl')
+        with open(fileName, 'wb') as file:
+            file.write(data)
+
+        rays = Rays()
+        rays.load(fileName)
+        self.assertEqual(len(rays), 2)
+        self.assertEqual((rays[0].y, rays[0].theta, rays[0].isBlocked, rays[0].wavelength), (1, 0.1, False, None))
+        self.assertEqual((rays[1].y, rays[1].z, rays[1].isBlocked, rays[1].wavelength), (-2, 5, True, 0.5))
+
+    def testSaveToTheFileThatWasLoaded(self):
+        fileName = self.tempFilePath('loadedThenSaved.dat')
+        rays = Rays()
+        rays.appendArrays(y=[-1, -1, 2], theta=[0.1, 0.2, 0.3], weights=[1, 2, 3])
+        rays.save(fileName)
+
+        loadedRays = Rays()
+        loadedRays.load(fileName)
+        loadedRays.save(fileName)
+        self.assertListEqual(list(loadedRays.yValues), [-1, -1, 2])
+
+        savedRays = Rays()
+        savedRays.load(fileName)
+        self.assertListEqual(list(savedRays.yValues), [-1, -1, 2])
+        self.assertListEqual(list(savedRays.thetaValues), [0.1, 0.2, 0.3])
+        self.assertListEqual(list(savedRays.weights), [1, 2, 3])
+        temporaryFiles = [name for name in os.listdir(os.path.dirname(fileName)) if name.endswith('.tmp')]
+        self.assertListEqual(temporaryFiles, [])
+
     def testLoadWrongIterable(self):
         wrongObj = 7734
         fileName = self.tempFilePath('wrongObj.pkl')
@@ -351,6 +454,117 @@ class TestRaysSaveAndLoad(envtest.RaytracingTestCase):
         self.assertLoadNotFailed(raysLoad, fileName)
         self.assertListEqual(raysLoad.rays, rays.rays)
 
+    def testSaveIsARayFile(self):
+        fileName = self.tempFilePath('rayFile.dat')
+        self.testRays.save(fileName)
+        self.assertTrue(RayFile.isRayFile(fileName))
+        self.assertFalse(RayFile.isRayFile(self.fileName))
+
+        rayFile = RayFile(fileName)
+        self.assertEqual(rayFile.kind, 'rays')
+        self.assertEqual(rayFile.fileVersion, RayFile.version)
+        self.assertEqual(rayFile.count, 4)
+        self.assertEqual(list(rayFile.column('theta')), [0, 1, 1, -1])
+
+    def testSaveIsFast(self):
+        rays = RandomUniformRays(maxCount=100_000)
+        fileName = self.tempFilePath('fastFile.dat')
+        startTime = time.time()
+        rays.save(fileName)
+        self.assertLess(time.time() - startTime, 0.5)
+
+    def testSaveThenLoadWeightsAndWavelengths(self):
+        rays = Rays()
+        rays.appendArrays(y=[1, 2, 3], theta=[0.1, 0.2, 0.3], z=[0, 1, 2], isBlocked=[False, True, False],
+                          wavelength=[0.5, np.nan, 0.6], weights=[1, 2, 3])
+        fileName = self.tempFilePath('weights.dat')
+        rays.save(fileName)
+
+        raysLoad = Rays()
+        raysLoad.load(fileName)
+        self.assertEqual(len(raysLoad), 3)
+        for name in ['yValues', 'thetaValues', 'zValues', 'isBlockedValues', 'weights']:
+            self.assertTrue(np.array_equal(getattr(raysLoad, name), getattr(rays, name)))
+        self.assertTrue(np.array_equal(raysLoad.wavelengthValues, rays.wavelengthValues, equal_nan=True))
+
+    def testLoadedRaysCanBeModifiedWithoutChangingTheFile(self):
+        fileName = self.tempFilePath('modified.dat')
+        self.testRays.save(fileName)
+        rays = Rays()
+        rays.load(fileName)
+        rays[1].y = 10
+        rays.append(Ray(5, 5))
+        self.assertEqual(rays[1].y, 10)
+        self.assertEqual(len(rays), 5)
+
+        raysLoad = Rays()
+        raysLoad.load(fileName)
+        self.assertListEqual(raysLoad.rays, self.testRays.rays)
+
+    def testLoadRayFileAppend(self):
+        fileName = self.tempFilePath('append.dat')
+        self.testRays.save(fileName)
+        rays = Rays([Ray(7, 7)])
+        rays.load(fileName, append=True)
+        self.assertListEqual(rays.rays, [Ray(7, 7)] + self.testRays.rays)
+
+    def testSaveThenLoadEmpty(self):
+        fileName = self.tempFilePath('empty.dat')
+        Rays().save(fileName)
+        rays = Rays([Ray()])
+        rays.load(fileName)
+        self.assertEqual(len(rays), 0)
+        rays.append(Ray(1, 1))
+        self.assertEqual(len(rays), 1)
+
+    def testLoadNewerVersion(self):
+        fileName = self.tempFilePath('newer.dat')
+        RayFile.version += 1
+        try:
+            self.testRays.save(fileName)
+        finally:
+            RayFile.version -= 1
+        with self.assertRaises(IOError):
+            Rays().load(fileName)
+
+    def testLoadOtherKind(self):
+        fileName = self.tempFilePath('traces.dat')
+        RayFile.save(fileName, 'traces', {'values': np.zeros((2, 3))})
+        with self.assertRaises(IOError):
+            Rays().load(fileName)
+
+    def testCreateThenAppendToRayFile(self):
+        fileName = self.tempFilePath('appended.dat')
+        rayFile = RayFile.create(fileName, 'rays', {'y': (float, ()), 'theta': (float, ()), 'z': (float, ()),
+                                                    'isBlocked': (bool, ())}, capacity=5)
+        self.assertEqual(RayFile(fileName).count, 0)
+        for y in [[1, 2], [3, 4, 5]]:
+            rayFile.append({'y': y, 'theta': np.zeros(len(y)), 'z': np.zeros(len(y)), 'isBlocked': [False] * len(y)})
+        self.assertEqual(RayFile(fileName).count, 5)
+
+        with self.assertRaises(ValueError):
+            rayFile.append({'y': [6], 'theta': [0], 'z': [0], 'isBlocked': [False]})
+        with self.assertRaises(ValueError):
+            rayFile.append({'y': [6]})
+
+        rays = Rays()
+        rays.load(fileName)
+        self.assertEqual(list(rays.yValues), [1, 2, 3, 4, 5])
+
+    def testChunkKeepsWeights(self):
+        rays = Rays()
+        rays.appendArrays(y=[0, 1, 2, 3, 4], theta=[0, 0, 0, 0, 0.1], weights=[1, 2, 3, 4, 5])
+        chunk = rays.chunk(3, 10)
+        self.assertEqual(list(chunk.yValues), [3, 4])
+        self.assertEqual(list(chunk.thetaValues), [0, 0.1])
+        self.assertEqual(list(chunk.weights), [4, 5])
+
+    def testChunks(self):
+        rays = UniformRays(M=10, N=10)
+        chunks = list(rays.chunks(30))
+        self.assertEqual([len(chunk) for chunk in chunks], [30, 30, 30, 10])
+        self.assertTrue(np.array_equal(np.concatenate([chunk.yValues for chunk in chunks]), rays.yValues))
+
 
 if __name__ == '__main__':
     envtest.main()
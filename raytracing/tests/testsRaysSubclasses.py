@@ -42,32 +42,55 @@ class TestLambertianRays(envtest.RaytracingTestCase):
     def testLambertianRays(self):
         rays = LambertianRays(1, -1, 10, 11, 12)
         raysList = []
+        weights = []
         for theta in np.linspace(-pi / 2, pi / 2, 11):
             intensity = int(12 * cos(theta))
             for y in np.linspace(-1, 1, 10):
-                for _ in range(intensity):
+                if intensity > 0:
                     raysList.append(Ray(y, theta))
+                    weights.append(intensity)
         self.assertEqual(rays.yMin, -1)
         self.assertEqual(rays.yMax, 1)
         self.assertEqual(rays.M, 10)
         self.assertEqual(rays.N, 11)
         self.assertEqual(rays.I, 12)
         self.assertListEqual(rays.rays, raysList)
+        self.assertListEqual(list(rays.weights), weights)
 
     def testLambertianRaysNoneArgs(self):
         rays = LambertianRays()
         raysList = []
+        weights = []
         for theta in np.linspace(-pi / 2, pi / 2, 100):
             intensity = int(100 * cos(theta))
             for y in np.linspace(-1, 1, 100):
-                for _ in range(intensity):
+                if intensity > 0:
                     raysList.append(Ray(y, theta))
+                    weights.append(intensity)
         self.assertEqual(rays.yMin, -1)
         self.assertEqual(rays.yMax, 1)
         self.assertEqual(rays.M, 100)
         self.assertEqual(rays.N, 100)
         self.assertEqual(rays.I, 100)
         self.assertListEqual(rays.rays, raysList)
+        self.assertListEqual(list(rays.weights), weights)
+        self.assertEqual(rays.totalWeight, sum(weights))
+
+    def testLambertianRaysHistogramsAreWeighted(self):
+        rays = LambertianRays(1, -1, 10, 11, 12)
+        duplicatedRays = Rays()
+        for ray, weight in zip(rays, rays.weights):
+            for _ in range(int(weight)):
+                duplicatedRays.append(ray)
+        self.assertListEqual(list(rays.rayCountHistogram()[1]), list(duplicatedRays.rayCountHistogram()[1]))
+        self.assertListEqual(list(rays.rayAnglesHistogram()[1]), list(duplicatedRays.rayAnglesHistogram()[1]))
+
+    def testLambertianRaysTracingKeepsWeights(self):
+        rays = LambertianRays(1, -1, 10, 11, 12)
+        outputRays = Aperture(diameter=1).traceManyThrough(rays, progress=False)
+        self.assertTrue(outputRays.isWeighted)
+        expectedWeight = sum([weight for ray, weight in zip(rays, rays.weights) if abs(ray.y) <= 0.5])
+        self.assertEqual(outputRays.totalWeight, expectedWeight)
 
 
 class TestRandomRays(envtest.RaytracingTestCase):
@@ -142,6 +165,20 @@ class TestRandomRays(envtest.RaytracingTestCase):
             rays[-6]
 
 
+    def testRandomRaysWithOnlyRandomRayGenerateRays(self):
+        class RandomRaysTest(RandomRays):
+            def randomRay(self):
+                ray = Ray(1, 2)
+                self.append(ray)
+                return ray
+
+        rays = RandomRaysTest(maxCount=5)
+        rays.generateRays(3)
+        self.assertEqual(len(rays.rays), 3)
+        rays.generateAllRays()
+        self.assertListEqual(rays.rays, [Ray(1, 2)] * 5)
+
+
 class TestRandomUniformRays(envtest.RaytracingTestCase):
 
     def testRandomUniformRays(self):
@@ -219,6 +256,58 @@ class TestRandomUniformRays(envtest.RaytracingTestCase):
         self.assertEqual(len(rays.rays), len(rays))
         self.assertListEqual(allRays, rays.rays)
 
+    def testRandomUniformRaysGenerateRays(self):
+        rays = RandomUniformRays(2, 1, 0.5, 0.25, maxCount=10)
+        rays.generateRays(4)
+        self.assertEqual(len(rays.rays), 4)
+        rays.generateRays(100)
+        self.assertEqual(len(rays.rays), 10)
+        self.assertTrue(all(1 <= y <= 2 for y in rays.yValues))
+        self.assertTrue(all(0.25 <= theta <= 0.5 for theta in rays.thetaValues))
+
+    def testRandomUniformRaysValuesGenerateAll(self):
+        rays = RandomUniformRays(maxCount=1000)
+        self.assertEqual(len(rays.yValues), 1000)
+        self.assertEqual(len(rays.rays), 1000)
+
+    def testRandomUniformRaysSameSeedSameRays(self):
+        rays1 = RandomUniformRays(maxCount=10000, seed=42)
+        rays2 = RandomUniformRays(maxCount=10000, seed=42)
+        self.assertTrue(np.array_equal(rays1.yValues, rays2.yValues))
+        self.assertTrue(np.array_equal(rays1.thetaValues, rays2.thetaValues))
+
+    def testRandomUniformRaysDifferentSeeds(self):
+        rays1 = RandomUniformRays(maxCount=100, seed=1)
+        rays2 = RandomUniformRays(maxCount=100, seed=2)
+        self.assertFalse(np.array_equal(rays1.yValues, rays2.yValues))
+
+    def testRandomUniformRaysSeedIsReproducible(self):
+        rays1 = RandomUniformRays(maxCount=100)
+        rays2 = RandomUniformRays(maxCount=100, seed=rays1.seed)
+        self.assertTrue(np.array_equal(rays1.yValues, rays2.yValues))
+
+    def testRandomUniformRaysSeedGenerator(self):
+        rays1 = RandomUniformRays(maxCount=100, seed=np.random.default_rng(3))
+        rays2 = RandomUniformRays(maxCount=100, seed=np.random.default_rng(3))
+        self.assertTrue(np.array_equal(rays1.yValues, rays2.yValues))
+
+    def testRandomUniformRaysSameRaysWhateverTheOrder(self):
+        allRays = RandomUniformRays(maxCount=10000, seed=7)
+        rays = RandomUniformRays(maxCount=10000, seed=7)
+        for count in [1, 10, 5000, 1, 3000]:
+            rays.generateRays(count)
+        rays.generateAllRays()
+        self.assertTrue(np.array_equal(allRays.yValues, rays.yValues))
+        self.assertTrue(np.array_equal(allRays.thetaValues, rays.thetaValues))
+
+    def testRandomUniformRaysChunks(self):
+        rays = RandomUniformRays(maxCount=10000, seed=7)
+        chunks = [RandomUniformRays(maxCount=10000, seed=7).chunk(start, start + 3000)
+                  for start in range(9000, -1, -3000)]
+        self.assertEqual([len(chunk) for chunk in chunks], [1000, 3000, 3000, 3000])
+        y = np.concatenate([chunk.yValues for chunk in reversed(chunks)])
+        self.assertTrue(np.array_equal(rays.yValues, y))
+
     def testRandomUniformRaysGetOutOfBoundsPositive(self):
         rays = RandomUniformRays()
         item = int(1e10)
@@ -307,6 +396,20 @@ class TestRandomLambertianRays(envtest.RaytracingTestCase):
         self.assertEqual(len(rays.rays), len(rays))
         self.assertListEqual(allRays, rays.rays)
 
+    def testRandomLambertianRaysDistribution(self):
+        rays = RandomLambertianRays(maxCount=100_000)
+        thetas = rays.thetaValues
+        self.assertTrue(all(-pi / 2 <= theta <= pi / 2 for theta in thetas))
+        # Fraction of rays within +/- pi/6 is sin(pi/6) for a Lambertian source
+        fraction = np.mean(np.abs(thetas) < pi / 6)
+        self.assertAlmostEqual(fraction, 0.5, delta=0.01)
+
+    def testRandomLambertianRaysSameSeedSameRays(self):
+        rays1 = RandomLambertianRays(maxCount=5000, seed=42)
+        rays2 = RandomLambertianRays(maxCount=5000, seed=42)
+        self.assertTrue(np.array_equal(rays1.thetaValues, rays2.thetaValues))
+        self.assertTrue(np.array_equal(rays1.chunk(4000, 5000).thetaValues, rays2.thetaValues[4000:]))
+
     def testRandomLambertianRaysGetOutOfBoundsPositive(self):
         rays = RandomLambertianRays()
         item = int(1e10)
@@ -320,5 +423,74 @@ class TestRandomLambertianRays(envtest.RaytracingTestCase):
             rays[-item]
 
 
+class TestImportanceSampledRays(envtest.RaytracingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.source = RandomUniformRays(yMax=1, thetaMax=0.5, maxCount=20000, seed=1)
+        self.region = [(-0.1, -0.05), (0.1, -0.05), (0.1, 0.05), (-0.1, 0.05)]
+
+    def testInvalidDefensiveFraction(self):
+        with self.assertRaises(ValueError):
+            ImportanceSampledRays(self.source, self.region, defensiveFraction=0)
+
+    def testMostRaysInRegion(self):
+        rays = ImportanceSampledRays(self.source, self.region, defensiveFraction=0.1, seed=2)
+        self.assertEqual(len(rays.yValues), 20000)
+        fraction = np.mean(rays.isInRegion(rays.yValues, rays.thetaValues))
+        self.assertAlmostEqual(fraction, 0.9 + 0.1 * 0.01, delta=0.01)
+
+    def testWeightsAverageToOne(self):
+        rays = ImportanceSampledRays(self.source, self.region, defensiveFraction=0.5, seed=3)
+        self.assertTrue(rays.isWeighted)
+        self.assertAlmostEqual(np.mean(rays.weights), 1, delta=0.05)
+        self.assertEqual(rays.totalWeight, 20000)
+
+    def testWeightsAreDensityRatios(self):
+        rays = ImportanceSampledRays(self.source, self.region, defensiveFraction=0.1, seed=3)
+        density = 1 / (2 * 1.0)
+        inside = density / (0.1 * density + 0.9 / 0.02)
+        weights = rays.rayWeights(np.array([0, 0.5]), np.array([0, 0.4]))
+        self.assertTrue(np.allclose(weights, [inside, 10]))
+
+    def testWeightedRegionFractionIsUnbiased(self):
+        rays = ImportanceSampledRays(self.source, self.region, defensiveFraction=0.1, seed=4)
+        isInside = rays.isInRegion(rays.yValues, rays.thetaValues)
+        self.assertAlmostEqual(np.sum(rays.weights[isInside]) / rays.totalWeight, 0.01, delta=1e-4)
+
+    def testEmptyRegionIsTheSource(self):
+        rays = ImportanceSampledRays(self.source, [], seed=5)
+        self.assertEqual(rays.defensiveFraction, 1)
+        self.assertTrue(np.all(rays.weights == 1))
+
+    def testClockwiseRegionIsReversed(self):
+        rays = ImportanceSampledRays(self.source, self.region[::-1], seed=2)
+        expected = ImportanceSampledRays(self.source, self.region, seed=2)
+        self.assertAlmostEqual(rays.regionArea, 0.02)
+        self.assertTrue(np.all(rays.isInRegion(np.array([0, 0.05]), np.array([0, 0.01]))))
+        self.assertTrue(np.allclose(rays.weights, expected.weights))
+
+    def testRegionWithoutArea(self):
+        for region in [[(0, 0)], [(0, 0), (0.1, 0.01)], [(0, 0), (0.1, 0.01), (0.2, 0.02)]]:
+            with self.assertRaises(ValueError):
+                ImportanceSampledRays(self.source, region)
+
+    def testNormalizedTotalWeight(self):
+        rays = ImportanceSampledRays(self.source, self.region, seed=2)
+        self.assertEqual(rays.normalizedTotalWeight(rays.chunk(0, 100)), 100)
+        self.assertIsNone(self.source.normalizedTotalWeight(self.source.chunk(0, 100)))
+
+    def testLambertianSource(self):
+        source = RandomLambertianRays(yMax=1, maxCount=20000)
+        rays = ImportanceSampledRays(source, self.region, defensiveFraction=0.2, seed=6)
+        isInside = rays.isInRegion(rays.yValues, rays.thetaValues)
+        expected = 0.2 * (np.sin(0.05) - np.sin(-0.05)) / 2 / 2
+        self.assertAlmostEqual(np.sum(rays.weights[isInside]) / rays.totalWeight, expected, delta=1e-4)
+
+    def testChunksHaveWeights(self):
+        rays = ImportanceSampledRays(self.source, self.region, seed=7)
+        chunk = rays.chunk(100, 200)
+        self.assertTrue(chunk.isWeighted)
+        self.assertTrue(np.array_equal(chunk.weights, rays.weights[100:200]))
+
 if __name__ == '__main__':
     envtest.main()
@@ -0,0 +1,169 @@
+import envtest  # modifies path
+import numpy as np
+
+from raytracing import *
+
+inf = float("+inf")
+
+
+class TestTraceArray(envtest.RaytracingTestCase):
+    def setUp(self):
+        self.path = ImagingPath()
+        self.path.append(Space(d=10))
+        self.path.append(Lens(f=10, diameter=10))
+        self.path.append(Space(d=10))
+        self.path.append(Aperture(diameter=8))
+        self.path.append(System4f(f1=5, f2=5, diameter1=4))
+        self.path.append(ThickLens(R1=10, R2=-10, n=1.5, thickness=2, diameter=6))
+        self.path.append(Space(d=10))
+        self.rays = RandomUniformRays(yMax=6, thetaMax=0.5, maxCount=200)
+
+    def testSameAsListOfRayTraces(self):
+        traces = self.path.traceMany(self.rays, asArray=True)
+        rayTraces = self.path.traceMany(self.rays)
+
+        self.assertIsInstance(traces, TraceArray)
+        self.assertEqual(traces.nRays, len(rayTraces))
+        self.assertEqual(traces.nCheckpoints, len(rayTraces[0]))
+        for i, rayTrace in enumerate(rayTraces):
+            self.assertTrue(np.allclose(traces.y[i], [ray.y for ray in rayTrace]))
+            self.assertTrue(np.allclose(traces.theta[i], [ray.theta for ray in rayTrace]))
+            self.assertTrue(np.allclose(traces.z[i], [ray.z for ray in rayTrace]))
+            self.assertEqual(traces.isBlocked[i, -1], rayTrace[-1].isBlocked)
+
+    def testFirstBlockedIndex(self):
+        traces = self.path.traceMany(self.rays, asArray=True)
+        for i in range(traces.nRays):
+            index = traces.firstBlockedIndex[i]
+            if index < 0:
+                self.assertFalse(np.any(traces.isBlocked[i]))
+            else:
+                self.assertFalse(np.any(traces.isBlocked[i, :index]))
+                self.assertTrue(np.all(traces.isBlocked[i, index:]))
+
+    def testBlockedAtEntranceOfThickElement(self):
+        path = ImagingPath([Space(d=10), ThickLens(R1=10, R2=-10, n=1.5, thickness=2, diameter=6)])
+        traces = path.traceMany([Ray(y=4, theta=0)], asArray=True)
+        self.assertEqual(list(traces.z[0]), [0, 0, 10, 10, 10])
+        self.assertEqual(list(traces.isBlocked[0]), [False, False, False, True, True])
+        self.assertEqual(traces.firstBlockedIndex[0], 3)
+
+    def testFinalRays(self):
+        traces = self.path.traceMany(self.rays, asArray=True)
+        finalRays = traces.finalRays()
+        outputRays = self.path.traceManyThrough(self.rays, progress=False)
+        self.assertEqual(len(finalRays), len(outputRays))
+        self.assertTrue(np.allclose(finalRays.yValues, outputRays.yValues))
+        self.assertTrue(np.allclose(finalRays.thetaValues, outputRays.thetaValues))
+
+    def testRaysAliveAt(self):
+        traces = self.path.traceMany(self.rays, asArray=True)
+        self.assertEqual(len(traces.raysAliveAt(0)), 200)
+        for k in range(traces.nCheckpoints):
+            (y, theta, z, isBlocked) = traces.checkpoint(k)
+            self.assertEqual(len(traces.raysAliveAt(k)), np.count_nonzero(~isBlocked))
+
+    def testWeightsAreKept(self):
+        rays = Rays()
+        rays.appendArrays(y=[0, 1, 9], theta=[0, 0, 0], weights=[1, 2, 3])
+        traces = self.path.traceMany(rays, asArray=True)
+        self.assertEqual(list(traces.weights), [1, 2, 3])
+        self.assertEqual(list(traces.raysAliveAt(0).weights), [1, 2, 3])
+        self.assertEqual(list(traces.finalRays().weights), [1, 2])
+
+    def testRayTrace(self):
+        traces = self.path.traceMany([Ray(y=1, theta=0.1), Ray(y=2, theta=0.1)], asArray=True)
+        rayTrace = traces.rayTrace(1)
+        self.assertEqual(len(rayTrace), traces.nCheckpoints)
+        self.assertEqual(rayTrace[0], Ray(y=2, theta=0.1))
+        self.assertEqual(rayTrace[-1], self.path.traceThrough(Ray(y=2, theta=0.1)))
+        self.assertEqual(len(list(traces)), 2)
+        self.assertEqual(traces[-1], rayTrace)
+        with self.assertRaises(IndexError):
+            traces.rayTrace(2)
+
+    def testNoRays(self):
+        traces = self.path.traceMany([], asArray=True)
+        self.assertEqual(traces.nRays, 0)
+        self.assertEqual(len(traces.firstBlockedIndex), 0)
+        self.assertEqual(len(traces.finalRays()), 0)
+
+    def testSubclassWithOwnTrace(self):
+        class Doubler(Matrix):
+            def trace(self, ray):
+                return [Ray(y=2 * ray.y, theta=ray.theta, z=ray.z)]
+
+        traces = Doubler().traceMany([Ray(y=1), Ray(y=3)], asArray=True)
+        self.assertEqual(list(traces.y[:, -1]), [2, 6])
+
+    def testSampleAtSameAsAlong(self):
+        traces = self.path.traceMany(self.rays, asArray=True)
+        rayTraces = self.path.traceMany(self.rays)
+        planes = [-5, 0, 5, 10, 12.5, 20, 40, 41, 52, 100]
+        (y, theta, z, isBlocked) = traces.sampleAt(planes)
+        self.assertEqual(y.shape, (200, len(planes)))
+        for i, rayTrace in enumerate(rayTraces):
+            for p, plane in enumerate(planes):
+                ray = Ray.along(rayTrace, z=plane)
+                self.assertEqual(isBlocked[i, p], ray.isBlocked)
+                self.assertAlmostEqual(y[i, p], ray.y)
+                self.assertAlmostEqual(theta[i, p], ray.theta)
+                self.assertAlmostEqual(z[i, p], ray.z)
+
+    def testSampleAtBlockedRayStaysWhereItWasBlocked(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10)])
+        traces = path.traceMany([Ray(y=1, theta=0), Ray(y=6, theta=0)], asArray=True)
+        (y, theta, z, isBlocked) = traces.sampleAt([15, 20, 30])
+        self.assertTrue(np.all(isBlocked[1]))
+        self.assertTrue(np.allclose(y[1], [6, 6, 6]))
+        self.assertTrue(np.allclose(z[1], [10, 10, 10]))
+        self.assertTrue(np.allclose(z[0], [15, 20, 20]))
+
+    def testSampleAtInputPositions(self):
+        rays = Rays()
+        rays.appendArrays(y=[1, 1], theta=[0.1, 0.1], z=[0, 5])
+        traces = Space(d=10).traceMany(rays, asArray=True)
+        (y, theta, z, isBlocked) = traces.sampleAt([5, 10, 15])
+        self.assertTrue(np.allclose(y, [[1.5, 2.0, 2.0], [1.0, 1.5, 2.0]]))
+        self.assertTrue(np.allclose(z, [[5, 10, 10], [5, 10, 15]]))
+
+    def testFromRayTraces(self):
+        rayTraces = self.path.traceMany(self.rays)
+        traces = TraceArray.fromRayTraces(rayTraces)
+        self.assertEqual(traces.values.shape, (200, len(rayTraces[0])))
+        self.assertEqual(traces[3], rayTraces[3])
+        with self.assertRaises(ValueError):
+            TraceArray.fromRayTraces([[Ray()], [Ray(), Ray()]])
+
+    def testProfilesFromRayTraces(self):
+        traces = self.path.traceMany(self.rays, asArray=True)
+        rayTraces = self.path.traceMany(self.rays)
+        profiles = self.path.profilesFromRayTraces(traces, z=[5, 30, inf])
+        self.assertEqual(len(profiles), 3)
+        for profile, plane in zip(profiles, [5, 30, inf]):
+            expected = self.path.profileFromRayTraces(rayTraces, z=plane)
+            self.assertEqual(len(profile), len(expected))
+            self.assertTrue(np.allclose(profile.yValues, expected.yValues))
+        self.assertEqual(len(profiles[2]), len(self.path.traceManyThrough(self.rays, progress=False)))
+
+    def testSaveThenLoad(self):
+        rays = Rays()
+        rays.appendArrays(y=[0, 1, 9], theta=[0, 0.1, 0], weights=[1, 2, 3])
+        traces = self.path.traceMany(rays, asArray=True)
+        fileName = self.tempFilePath('traces.dat')
+        traces.save(fileName)
+
+        loadedTraces = TraceArray.load(fileName)
+        self.assertTrue(np.array_equal(loadedTraces.values, traces.values))
+        self.assertEqual(list(loadedTraces.weights), [1, 2, 3])
+        self.assertTrue(np.array_equal(loadedTraces.firstBlockedIndex, traces.firstBlockedIndex))
+
+    def testLoadRaysAsTraces(self):
+        fileName = self.tempFilePath('rays.dat')
+        Rays([Ray()]).save(fileName)
+        with self.assertRaises(IOError):
+            TraceArray.load(fileName)
+
+
+if __name__ == '__main__':
+    envtest.main()
@@ -0,0 +1,293 @@
+from .ray import *
+from .rays import *
+
+import numpy as np
+
+
+class TraceArray:
+    """The ray traces of many rays, stored in a single structured array
+    instead of a list of lists of Ray: element [i, k] is the ray i at
+    checkpoint k, with its height, angle, position and blocked status.
+    The checkpoints are the same for all rays: they are the rays that
+    trace() would return, in the same order.  It is obtained with
+    Matrix.traceMany(rays, asArray=True).
+
+    Parameters
+    ----------
+    checkpoints : list of (y, theta, z, isBlocked)
+        For each checkpoint, the arrays of the heights, angles, positions
+        and blocked status of all rays (see Matrix.traceArrays()).
+    weights : array of float
+        The weights of the rays (Optional).
+
+    Examples
+    --------
+    >>> from raytracing import *
+    >>> path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10)])
+    >>> traces = path.traceMany(UniformRays(yMax=1, thetaMax=0.1, M=3, N=3), asArray=True)
+    >>> print(traces.values.shape)
+    (9, 6)
+    >>> print(traces.firstBlockedIndex)
+    [-1 -1 -1 -1 -1 -1 -1 -1 -1]
+
+    Notes
+    -----
+    Once a ray is blocked, it stays blocked at all the following checkpoints.
+    A ray blocked at the entrance of an element of finite length is blocked
+    at the checkpoint of the entrance, but not at the checkpoint before it.
+    """
+
+    dtype = np.dtype([('y', float), ('theta', float), ('z', float), ('isBlocked', bool)])
+
+    def __init__(self, checkpoints, weights=None):
+        nCheckpoints = len(checkpoints)
+        nRays = 0
+        if nCheckpoints != 0:
+            nRays = len(checkpoints[0][0])
+
+        self.values = np.empty((nRays, nCheckpoints), dtype=self.dtype)
+        for k, (y, theta, z, isBlocked) in enumerate(checkpoints):
+            self.values['y'][:, k] = y
+            self.values['theta'][:, k] = theta
+            self.values['z'][:, k] = z
+            self.values['isBlocked'][:, k] = isBlocked
+
+        self.weights = None
+        if weights is not None:
+            self.weights = np.asarray(weights, dtype=float)
+        self._firstBlockedIndex = None
+
+    @classmethod
+    def fromRayTraces(cls, rayTraces):
+        """ A TraceArray with the ray traces obtained with Matrix.trace() or
+        Matrix.traceMany(), given as lists of Ray of the same length.
+
+        Parameters
+        ----------
+        rayTraces : list of list of Ray
+            The ray traces
+        """
+        rayTraces = list(rayTraces)
+        if len(rayTraces) == 0:
+            return cls([])
+
+        nCheckpoints = len(rayTraces[0])
+        if any([len(rayTrace) != nCheckpoints for rayTrace in rayTraces]):
+            raise ValueError("All the ray traces must have the same number of rays.")
+
+        values = np.array([[(ray.y, ray.theta, ray.z, ray.isBlocked) for ray in rayTrace]
+                           for rayTrace in rayTraces], dtype=float)
+        return cls([(values[:, k, 0], values[:, k, 1], values[:, k, 2], values[:, k, 3] != 0)
+                    for k in range(nCheckpoints)])
+
+    def save(self, filePath):
+        """ Saves the ray traces in a binary file (see RayFile).
+
+        Parameters
+        ----------
+        filePath : str or PathLike
+            The path of the file
+        """
+        columns = {'values': self.values}
+        if self.weights is not None:
+            columns['weights'] = self.weights
+        RayFile.save(filePath, 'traces', columns)
+
+    @classmethod
+    def load(cls, filePath):
+        """ The ray traces saved with save(). The file is mapped in memory
+        and is not read until the values are used.
+
+        Parameters
+        ----------
+        filePath : str or PathLike
+            The path of the file
+        """
+        rayFile = RayFile(filePath)
+        if rayFile.kind != 'traces':
+            raise IOError(f"{filePath} does not contain ray traces but {rayFile.kind}.")
+
+        traces = cls([])
+        traces.values = rayFile.column('values', mode='c')
+        if 'weights' in rayFile.columns:
+            traces.weights = rayFile.column('weights', mode='c')
+        return traces
+
+    def __len__(self) -> int:
+        return self.nRays
+
+    def __getitem__(self, index):
+        return self.rayTrace(index)
+
+    def __iter__(self):
+        for index in range(self.nRays):
+            yield self.rayTrace(index)
+
+    @property
+    def nRays(self):
+        """ The number of ray traces """
+        return self.values.shape[0]
+
+    @property
+    def nCheckpoints(self):
+        """ The number of checkpoints in each ray trace """
+        return self.values.shape[1]
+
+    @property
+    def y(self):
+        """ The heights, an array of shape (nRays, nCheckpoints) """
+        return self.values['y']
+
+    @property
+    def theta(self):
+        """ The angles, an array of shape (nRays, nCheckpoints) """
+        return self.values['theta']
+
+    @property
+    def z(self):
+        """ The positions, an array of shape (nRays, nCheckpoints) """
+        return self.values['z']
+
+    @property
+    def isBlocked(self):
+        """ The blocked status, an array of shape (nRays, nCheckpoints) """
+        return self.values['isBlocked']
+
+    @property
+    def firstBlockedIndex(self):
+        """ For each ray, the index of the first checkpoint where it is
+        blocked, or -1 if it is never blocked. """
+        if self._firstBlockedIndex is None:
+            isBlocked = self.isBlocked
+            if self.nCheckpoints == 0:
+                self._firstBlockedIndex = np.full(self.nRays, -1)
+            else:
+                self._firstBlockedIndex = np.where(isBlocked.any(axis=1), isBlocked.argmax(axis=1), -1)
+        return self._firstBlockedIndex
+
+    def rayTrace(self, index):
+        """ The ray trace of one ray, as a list of Ray, like Matrix.trace().
+
+        Parameters
+        ----------
+        index : int
+            The index of the ray
+
+        Returns
+        -------
+        rayTrace : list of Ray
+            The ray at each checkpoint
+        """
+        if not -self.nRays <= index < self.nRays:
+            raise IndexError("Ray trace index {0} out of range".format(index))
+
+        return [Ray(y=float(value['y']), theta=float(value['theta']), z=float(value['z']),
+                    isBlocked=bool(value['isBlocked'])) for value in self.values[index]]
+
+    def checkpoint(self, index=-1):
+        """ The arrays (y, theta, z, isBlocked) of all rays at a checkpoint.
+
+        Parameters
+        ----------
+        index : int
+            The index of the checkpoint (default=-1, the last one)
+        """
+        values = self.values[:, index]
+        return (values['y'], values['theta'], values['z'], values['isBlocked'])
+
+    def sampleAt(self, z):
+        """ The heights, angles and blocked status of all the rays at many
+        positions z, in a single pass.  The rays are found exactly as with
+        Ray.along() for each ray trace: at a checkpoint, the first ray at
+        this position is used, and in between checkpoints, the ray of the
+        previous checkpoint is propagated in a straight line.  Beyond the
+        last checkpoint of a ray, the last ray is used as is: a blocked
+        ray stays where it was blocked.
+
+        Parameters
+        ----------
+        z : float or array of float
+            The positions of the planes
+
+        Returns
+        -------
+        (y, theta, z, isBlocked) : tuple of arrays
+            The values of the rays, arrays of shape (nRays, nPlanes)
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10)])
+        >>> traces = path.traceMany([Ray(y=1, theta=0), Ray(y=6, theta=0)], asArray=True)
+        >>> (y, theta, z, isBlocked) = traces.sampleAt([5, 15])
+        >>> print(y)
+        [[1.  0.5]
+         [6.  6. ]]
+        >>> print(isBlocked)
+        [[False False]
+         [False  True]]
+        >>> print(z)
+        [[ 5. 15.]
+         [ 5. 10.]]
+
+        See Also
+        --------
+        raytracing.Ray.along
+        """
+        planes = np.atleast_1d(np.asarray(z, dtype=float))
+        nRays = self.nRays
+        nPlanes = len(planes)
+        if self.nCheckpoints == 0:
+            empty = np.empty((nRays, nPlanes))
+            return (empty, empty.copy(), empty.copy(), np.zeros((nRays, nPlanes), dtype=bool))
+
+        # The checkpoints are at the same distance from the input for all
+        # rays, except that blocked rays do not move anymore.  This common
+        # grid is searched once for all rays, and the planes after the
+        # last position of a ray use its last checkpoint.
+        zInput = self.z[:, 0]
+        distances = np.max(self.z - zInput[:, np.newaxis], axis=0)
+        planeDistances = planes[np.newaxis, :] - zInput[:, np.newaxis]
+        after = np.searchsorted(distances, planeDistances, side='left')
+
+        rows = np.arange(nRays)[:, np.newaxis]
+        isBeyond = (after == self.nCheckpoints) | (planes[np.newaxis, :] > self.z[:, -1][:, np.newaxis])
+        after = np.minimum(after, self.nCheckpoints - 1)
+        isAtCheckpoint = ~isBeyond & (self.z[rows, after] == planes[np.newaxis, :])
+        index = np.where(isAtCheckpoint | isBeyond, after, np.maximum(after - 1, 0))
+
+        values = self.values[rows, index]
+        isPropagated = ~(isAtCheckpoint | isBeyond)
+        outputZ = np.where(isPropagated, planes[np.newaxis, :], values['z'])
+        with np.errstate(invalid='ignore', over='ignore'):
+            outputY = np.where(isPropagated, values['y'] + (outputZ - values['z']) * values['theta'], values['y'])
+
+        return (outputY, values['theta'].copy(), outputZ, values['isBlocked'].copy())
+
+    def raysAliveAt(self, index):
+        """ The rays that are not blocked at a checkpoint, with their weights.
+
+        Parameters
+        ----------
+        index : int
+            The index of the checkpoint
+
+        Returns
+        -------
+        rays : Rays
+            The rays not blocked at the checkpoint
+        """
+        (y, theta, z, isBlocked) = self.checkpoint(index)
+        isNotBlocked = ~isBlocked
+        weights = None
+        if self.weights is not None:
+            weights = self.weights[isNotBlocked]
+
+        rays = Rays()
+        rays.appendArrays(y[isNotBlocked], theta[isNotBlocked], z[isNotBlocked], weights=weights)
+        return rays
+
+    def finalRays(self):
+        """ The rays that are not blocked at the end of the traces, the same
+        as Matrix.traceManyThrough(). """
+        return self.raysAliveAt(-1)